@@ -1,13 +1,46 @@
 from typing import Any, Dict
-import logging
 import os
 import uuid
 import boto3
 from AuthPolicy import Policy
 from hmac import compare_digest
+from photo_frame_common.logger import get_logger
 
-LOGGER = logging.getLogger()
-LOGGER.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO")))
+LOGGER = get_logger()
+
+INGEST_RESOURCE = "ingest"
+# Sent by the CloudFront front door of the HTTP API, so requests
+# to the execute-api endpoint that bypass its web ACL are denied
+ORIGIN_VERIFY_HEADER = "x-origin-verify"
+
+
+def get_secret(name: str) -> str:
+    secrets_client = boto3.client("secretsmanager")
+    return secrets_client.get_secret_value(SecretId=name)["SecretString"]
+
+
+def is_from_origin(event: Dict) -> bool:
+    """
+    True unless the API is behind CloudFront (ORIGIN_TOKEN_NAME
+    is set) and the request lacks the origin secret.
+    """
+    origin_token_name = os.environ.get("ORIGIN_TOKEN_NAME")
+    if not origin_token_name:
+        return True
+    actual_token = (event.get("headers") or {}).get(ORIGIN_VERIFY_HEADER, "")
+    return compare_digest(get_secret(origin_token_name), actual_token)
+
+
+def is_ingest_request(event: Dict) -> bool:
+    """
+    Ingest routes are authorized with the ingest token,
+    every other route with the device token.
+    """
+    if event.get("version") == "2.0":
+        path = event["routeKey"].split(" ", 1)[-1]
+    else:
+        path = event.get("resource", "")
+    return path.strip("/").split("/")[0] == INGEST_RESOURCE
 
 
 def main(event: Dict, context: Any):
@@ -22,36 +55,61 @@ def main(event: Dict, context: Any):
     If the request contains an invalid token,
     a 401 will be returned.
 
+    Devices send x-api-token and may only GET /image.
+    Ingest clients send x-ingest-token and may only
+    POST to /ingest routes.
+
+    HTTP API (payload format 2.0) requests use the
+    simple response format instead, a boolean plus
+    context rather than an IAM policy document. They
+    must also carry the origin secret CloudFront adds.
+
     Parameters:
     event (dict): API Gateway Event
 
     returns:
-    dict - IAM policy
+    dict - IAM policy or simple response
     """
-    api_token_name = os.environ["API_TOKEN_NAME"]
-    secrets_client = boto3.client("secretsmanager")
+    ingest = is_ingest_request(event)
+    if ingest:
+        token_name = os.environ["INGEST_TOKEN_NAME"]
+        token_header = "x-ingest-token"
+    else:
+        token_name = os.environ["API_TOKEN_NAME"]
+        token_header = "x-api-token"
+    expected_token = get_secret(token_name)
 
-    expected_token = secrets_client.get_secret_value(SecretId=api_token_name)[
-        "SecretString"
-    ]
-
-    actual_token = event["headers"].get("x-api-token", "")
+    simple_response = event.get("version") == "2.0"
+    actual_token = (event.get("headers") or {}).get(token_header, "")
     if not compare_digest(expected_token, actual_token):
         LOGGER.warning("Mismatched Tokens")
+        if simple_response:
+            # This will return 403 forbidden
+            return {"isAuthorized": False}
         # This will return 401 unauthorized
         raise Exception("Unauthorized")
+    if simple_response and not is_from_origin(event):
+        LOGGER.warning("Request did not come through CloudFront")
+        return {"isAuthorized": False}
+
+    principalId = uuid.uuid4().hex
+    if simple_response:
+        return {"isAuthorized": True, "context": {"principalId": principalId}}
 
     tmp = event["methodArn"].split(":")
     apiGatewayArnTmp = tmp[5].split("/")
     awsAccountId = tmp[4]
-    principalId = uuid.uuid4().hex
 
     policy = Policy.AuthPolicy(principalId, awsAccountId)
     policy.restApiId = apiGatewayArnTmp[0]
     policy.region = tmp[3]
     policy.stage = apiGatewayArnTmp[1]
 
-    policy.allowMethod(Policy.HttpVerb.GET, "image")
+    if ingest:
+        policy.allowMethod(Policy.HttpVerb.POST, INGEST_RESOURCE)
+        policy.allowMethod(Policy.HttpVerb.POST, f"{INGEST_RESOURCE}/*")
+    else:
+        policy.allowMethod(Policy.HttpVerb.GET, "image")
     authResponse = policy.build()
     LOGGER.info(authResponse)
 
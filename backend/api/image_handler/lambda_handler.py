@@ -1,31 +1,88 @@
-from typing import Any, Dict
-import logging
-import os
+from typing import Any, Dict, List, Optional
 import json
+import os
+import re
 import boto3
+from botocore.exceptions import ClientError
 import random
 import base64
+from photo_frame_common.logger import get_logger
 
-LOGGER = logging.getLogger()
-LOGGER.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO")))
+LOGGER = get_logger()
 
+SHUFFLE_INDEX = "ByShuffle"
+# Identifies frames without a client certificate, only used to
+# select their albums
+DEVICE_ID_HEADER = "x-device-id"
+# Picks retried when an indexed image was already removed
+MAX_PICKS = 3
 
-def get_all_files_from_bucket(bucket_name: str, prefix: str):
-    s3_client = boto3.client("s3")
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-    if "Contents" not in response:
-        raise FileNotFoundError()
-    files = response["Contents"]
-    while "NextContinuationToken" in response:
-        response = s3_client.list_objects_v2(
-            Bucket=bucket_name,
-            Prefix=prefix,
-            ContinuationToken=response["NextContinuationToken"],
+
+def get_albums(device_id: Optional[str]) -> List[str]:
+    device_albums = json.loads(os.environ["DEVICE_ALBUMS"])
+    return device_albums.get(device_id) or json.loads(os.environ["DEFAULT_ALBUMS"])
+
+
+def shuffle_value() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+def pick_from_album(table_name: str, album: str) -> Optional[Dict]:
+    """
+    Picks a random image of an album from its index with a single
+    item read, whatever the size of the album or the library.
+    Entries are ordered by a random value and the first entry
+    after a random point is picked. That alone favours entries
+    after large gaps, so the picked entry is moved to a new
+    random point, which gives every image the same chance of
+    being picked over time.
+    """
+    dynamo_client = boto3.client("dynamodb")
+    start = shuffle_value()
+    # wrap around when the random point is after the last entry
+    for condition in (">=", "<"):
+        response = dynamo_client.query(
+            TableName=table_name,
+            IndexName=SHUFFLE_INDEX,
+            KeyConditionExpression=f"album = :album AND shuffle {condition} :start",
+            ExpressionAttributeValues={
+                ":album": {"S": album},
+                ":start": {"S": start},
+            },
+            Limit=1,
         )
-        files.extend(response["Contents"])
-    # remove folder keys themselves
-    files = list(filter(lambda f: f["Size"] > 0, files))
-    return files
+        if response["Items"]:
+            item = response["Items"][0]
+            reshuffle(dynamo_client, table_name, album, item["key"]["S"])
+            return {"key": item["key"]["S"], "size": int(item["size"]["N"])}
+    return None
+
+
+def reshuffle(dynamo_client, table_name: str, album: str, key: str):
+    try:
+        dynamo_client.update_item(
+            TableName=table_name,
+            Key={"album": {"S": album}, "key": {"S": key}},
+            UpdateExpression="SET shuffle = :shuffle",
+            # don't recreate entries removed in the meantime
+            ConditionExpression="attribute_exists(#key)",
+            ExpressionAttributeNames={"#key": "key"},
+            ExpressionAttributeValues={":shuffle": {"S": shuffle_value()}},
+        )
+    except ClientError as ex:
+        # the pick is still served, only its next chance is skewed
+        LOGGER.warning(f"Could not reshuffle {key}: {ex}")
+
+
+def pick_image(table_name: str, albums: List[str]) -> Dict:
+    """Picks an image from one of the albums, skipping empty ones."""
+    albums = random.sample(albums, len(albums))
+    for album in albums:
+        image = pick_from_album(table_name, album)
+        if image:
+            LOGGER.info(f"Picked {image['key']} from {album}")
+            return image
+    raise FileNotFoundError()
 
 
 def download_file_from_s3(bucket_name: str, key_path: str):
@@ -39,20 +96,68 @@ def download_file_from_s3(bucket_name: str, key_path: str):
         LOGGER.error(ex)
 
 
+def get_principal_id(event: Dict) -> Optional[str]:
+    """
+    Returns the principal set by the authorizer.
+    REST APIs send payload format 1.0 events, HTTP APIs
+    send 2.0 events which nest the simple response
+    context under "lambda".
+    """
+    authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+    if event.get("version") == "2.0":
+        authorizer = authorizer.get("lambda") or {}
+    return authorizer.get("principalId")
+
+
+def get_client_cert(event: Dict) -> Optional[Dict]:
+    """
+    Returns the client certificate presented during a
+    mutual TLS handshake, None for token authorized requests.
+    """
+    request_context = event.get("requestContext") or {}
+    if event.get("version") == "2.0":
+        return (request_context.get("authentication") or {}).get("clientCert")
+    return (request_context.get("identity") or {}).get("clientCert")
+
+
+def get_device_id(event: Dict) -> Optional[str]:
+    """
+    Devices authenticated by mutual TLS are identified by the
+    common name of their certificate, falling back to its
+    serial number. Token authorized requests are identified
+    by their x-device-id header, falling back to the
+    authorizer's principal.
+    """
+    client_cert = get_client_cert(event)
+    if not client_cert:
+        headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+        return headers.get(DEVICE_ID_HEADER) or get_principal_id(event)
+    subject_dn = client_cert.get("subjectDN", "")
+    match = re.search(r"(?:^|,)\s*CN=((?:\\,|[^,])+)", subject_dn)
+    if match:
+        return match.group(1).replace("\\,", ",").strip()
+    return client_cert.get("serialNumber")
+
+
 def main(event: Dict, context: Any):
-    """ """
+    """
+    Returns a random image from the albums of the requesting device.
+    """
     try:
+        device_id = get_device_id(event)
+        albums = get_albums(device_id)
+        LOGGER.info(f"Image requested by {device_id} from {albums}")
         s3_bucket_name = os.environ["S3_BUCKET_NAME"]
-        s3_files = get_all_files_from_bucket(
-            bucket_name=s3_bucket_name, prefix="public"
-        )
-        LOGGER.info(s3_files)
-        random_num = random.randint(0, len(s3_files) - 1)
-        random_key = s3_files[random_num]["Key"]
-        LOGGER.info(random_key)
-        object_data = download_file_from_s3(
-            bucket_name=s3_bucket_name, key_path=random_key
-        )
+        table_name = os.environ["ALBUM_TABLE_NAME"]
+        for _ in range(MAX_PICKS):
+            image = pick_image(table_name, albums)
+            object_data = download_file_from_s3(
+                bucket_name=s3_bucket_name, key_path=image["key"]
+            )
+            if object_data:
+                break
+        else:
+            raise FileNotFoundError()
         data = object_data["data"]
         content_length = object_data["length"]
 
@@ -60,10 +165,10 @@ def main(event: Dict, context: Any):
             "statusCode": 200,
             "headers": {
                 "Content-Type": "image/jpeg",
-                "Content-Length": content_length
+                "Content-Length": str(content_length),
             },
             "body": base64.b64encode(data).decode("utf-8"),
             "isBase64Encoded": True,
         }
     except FileNotFoundError:
-        LOGGER.error("Bucket is empty")
+        LOGGER.error(f"No images in albums {albums}")
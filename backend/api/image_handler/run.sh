@@ -0,0 +1,5 @@
+#!/bin/sh
+# Handler of the streaming function, started by the Lambda Web
+# Adapter (AWS_LAMBDA_EXEC_WRAPPER) instead of the Python runtime.
+export PYTHONPATH="/opt/python:$LAMBDA_TASK_ROOT"
+exec python3 -m stream_server
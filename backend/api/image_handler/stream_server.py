@@ -0,0 +1,104 @@
+"""
+HTTP server behind the Lambda Web Adapter, which invokes it for
+every request to the function URL and streams its response back.
+
+GET /image streams a random image of the device's albums
+straight from S3 in fixed-size chunks, without buffering or
+base64 encoding it, so images are not bound by the 6 MB
+response limit or the function's memory.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from hmac import compare_digest
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+from photo_frame_common.logger import get_logger
+from lambda_handler import DEVICE_ID_HEADER, MAX_PICKS, get_albums, pick_image
+from streaming import copy_stream
+
+LOGGER = get_logger()
+
+API_TOKEN_HEADER = "x-api-token"
+# Matches the API authorizer cache, so rotated tokens are picked up
+SECRET_CACHE_SECONDS = 300
+READINESS_PATH = "/ping"
+
+s3_client = boto3.client("s3")
+_secret = {"value": None, "fetched": 0.0}
+
+
+def get_api_token() -> str:
+    # the monotonic clock can start near zero on a fresh microVM,
+    # so an empty cache is never treated as fresh
+    if (
+        _secret["value"] is None
+        or time.monotonic() - _secret["fetched"] > SECRET_CACHE_SECONDS
+    ):
+        secrets_client = boto3.client("secretsmanager")
+        _secret["value"] = secrets_client.get_secret_value(
+            SecretId=os.environ["API_TOKEN_NAME"]
+        )["SecretString"]
+        _secret["fetched"] = time.monotonic()
+    return _secret["value"]
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_empty(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == READINESS_PATH:
+            return self.send_empty(200)
+        if self.path.split("?", 1)[0] != "/image":
+            return self.send_empty(404)
+        # compared as bytes, compare_digest rejects non-ASCII strings
+        if not compare_digest(
+            get_api_token().encode(),
+            self.headers.get(API_TOKEN_HEADER, "").encode(),
+        ):
+            LOGGER.warning("Mismatched Tokens")
+            return self.send_empty(401)
+
+        device_id = self.headers.get(DEVICE_ID_HEADER)
+        albums = get_albums(device_id)
+        LOGGER.info(f"Image streamed to {device_id} from {albums}")
+        bucket_name = os.environ["S3_BUCKET_NAME"]
+        table_name = os.environ["ALBUM_TABLE_NAME"]
+        try:
+            for _ in range(MAX_PICKS):
+                image = pick_image(table_name, albums)
+                try:
+                    content_object = s3_client.get_object(
+                        Bucket=bucket_name, Key=image["key"]
+                    )
+                    break
+                except ClientError as ex:
+                    LOGGER.error(ex)
+            else:
+                raise FileNotFoundError()
+        except FileNotFoundError:
+            LOGGER.error(f"No images in albums {albums}")
+            return self.send_empty(404)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(content_object["ContentLength"]))
+        self.end_headers()
+        copy_stream(content_object["Body"], self.wfile.write)
+
+    def log_message(self, format: str, *args):
+        LOGGER.debug(format % args)
+
+
+def main():
+    port = int(os.environ.get("PORT", "8080"))
+    HTTPServer(("127.0.0.1", port), ImageRequestHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from typing import BinaryIO, Callable
+
+# Bytes held in memory at once while streaming an image
+CHUNK_SIZE = 64 * 1024
+
+
+def copy_stream(
+    source: BinaryIO, write: Callable[[bytes], object], chunk_size: int = CHUNK_SIZE
+) -> int:
+    """
+    Copies a file-like object, e.g. an S3 StreamingBody, to
+    ``write`` one chunk at a time so memory use does not grow
+    with the size of the object.
+
+    returns:
+    int - bytes copied
+    """
+    copied = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return copied
+        write(chunk)
+        copied += len(chunk)
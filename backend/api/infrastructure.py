@@ -1,18 +1,102 @@
 from constructs import Construct
 from dataclasses import dataclass
+from enum import Enum
 from aws_cdk import (
     aws_lambda,
+    Annotations,
+    Aws,
+    CfnOutput,
+    CfnResource,
+    CfnRule,
+    CfnRuleAssertion,
     Duration,
+    Fn,
+    Stack,
+    Token,
     aws_secretsmanager,
     aws_apigateway,
+    aws_apigatewayv2,
+    aws_certificatemanager,
+    aws_cloudfront,
+    aws_cloudfront_origins,
+    aws_dynamodb,
+    aws_iam,
     aws_logs,
     aws_wafv2,
     aws_s3,
 )
+from typing import Dict, List, Optional
+import json
 import os
 
+from backend.layer.infrastructure import SharedLayer
+from backend.stack_helpers.packaging import function_code
+from backend.storage.infrastructure import INCOMING_PREFIX
+
 BASE_FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 
+STAGE_NAME = "public"
+API_TOKEN_HEADER = "x-api-token"
+INGEST_TOKEN_HEADER = "x-ingest-token"
+# Selects the albums of frames using a token
+DEVICE_ID_HEADER = "x-device-id"
+# Secret CloudFront adds to requests to the HTTP API origin
+ORIGIN_VERIFY_HEADER = "x-origin-verify"
+AUTHORIZER_CACHE_TTL = Duration.minutes(5)
+# Seconds throttled devices are told to wait before retrying
+RETRY_AFTER_SECONDS = 60
+METRIC_NAMESPACE = "PhotoFrame"
+# Lambda Web Adapter, runs the streaming image server and streams
+# its responses through the function URL
+WEB_ADAPTER_LAYER = (
+    "arn:aws:lambda:{region}:753240598075:layer:LambdaAdapterLayerX86:17"
+)
+# Image handler modules only used by the streaming function
+STREAMING_MODULES = ["run.sh", "stream_server.py", "streaming.py"]
+
+
+class ApiMode(str, Enum):
+    # API Gateway REST API (v1) with binary media conversion
+    REST = "rest"
+    # API Gateway HTTP API (v2) behind CloudFront
+    HTTP = "http"
+
+
+@dataclass
+class ThrottleSettings:
+    # Steady state requests per second across the stage
+    rate_limit: float = 25
+    # Requests the stage absorbs above the rate limit
+    burst_limit: int = 50
+    # Image requests per client IP per 5 minutes before WAF blocks
+    # the IP, WAF does not accept less than 100. Frames share a
+    # token, so the IP is the closest per device key every request
+    # carries, frames behind one NAT share the limit.
+    device_limit: int = 100
+
+
+@dataclass
+class MutualTlsSettings:
+    # Custom domain devices connect to with their client certificate
+    domain_name: str
+    # ACM certificate of the custom domain
+    certificate_arn: str
+    # Key of the device CA bundle in the storage bucket
+    truststore_key: str
+    # Keep GET /image on the token authorized API for devices
+    # without a client certificate
+    token_fallback: bool = True
+
+
+@dataclass
+class AlbumSettings:
+    # Album indexes maintained by the storage construct
+    table: aws_dynamodb.ITable
+    # Albums of each device, keyed by certificate CN or x-device-id
+    device_albums: Dict[str, List[str]]
+    # Albums of devices without an entry in device_albums
+    default_albums: List[str]
+
 
 @dataclass
 class WafRule:
@@ -24,9 +108,24 @@ class WafRule:
 
 
 class API(Construct):
-    def __init__(self, scope: Construct, id_: str, s3_bucket: aws_s3.Bucket):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        s3_bucket: aws_s3.Bucket,
+        shared_layer: SharedLayer,
+        albums: AlbumSettings,
+        mode: ApiMode = ApiMode.REST,
+        throttle: ThrottleSettings = ThrottleSettings(),
+        mtls: Optional[MutualTlsSettings] = None,
+        streaming: bool = False,
+    ):
         super().__init__(scope, id_)
 
+        if streaming and mtls is not None and not mtls.token_fallback:
+            # the stream function authenticates frames with the API token
+            raise ValueError("Streaming requires the mutual TLS token fallback")
+
         # TODO: fill in details
 
         # Secret for API Access
@@ -34,37 +133,248 @@ class API(Construct):
             self, "apiAccesssecret", secret_name="api-access-token"
         )
 
+        # Secret for uploading images through the ingest API
+        ingest_secrets = aws_secretsmanager.Secret(
+            self, "ingestAccessSecret", secret_name="ingest-access-token"
+        )
+
         # Handles Authorization from API Gateway
         api_authorizer_fn = aws_lambda.Function(
             self,
             "APIAuthorizer",
             runtime=aws_lambda.Runtime.PYTHON_3_9,
-            environment={"API_TOKEN_NAME": api_secrets.secret_name},
+            environment={
+                "API_TOKEN_NAME": api_secrets.secret_name,
+                "INGEST_TOKEN_NAME": ingest_secrets.secret_name,
+            },
             function_name="API-Authorizer",
             handler="lambda_handler.main",
             description="Function that authorizers requests to Lambda API",
-            code=aws_lambda.Code.from_asset(os.path.join(BASE_FILE_PATH, "authorizer")),
+            code=function_code(
+                self,
+                "API-Authorizer",
+                os.path.join(BASE_FILE_PATH, "authorizer"),
+                layer_paths=[shared_layer.python_path],
+            ),
+            layers=[shared_layer.layer_version],
             timeout=Duration.minutes(5),
         )
         api_secrets.grant_read(api_authorizer_fn.role)
+        ingest_secrets.grant_read(api_authorizer_fn.role)
 
         photo_handler_fn = aws_lambda.Function(
             self,
             "PhotoHandler",
             runtime=aws_lambda.Runtime.PYTHON_3_9,
             function_name="Photo-handler",
-            environment={"S3_BUCKET_NAME": s3_bucket.bucket_name},
+            environment={
+                "S3_BUCKET_NAME": s3_bucket.bucket_name,
+                "ALBUM_TABLE_NAME": albums.table.table_name,
+                "DEVICE_ALBUMS": json.dumps(albums.device_albums),
+                "DEFAULT_ALBUMS": json.dumps(albums.default_albums),
+            },
             handler="lambda_handler.main",
             description="Retrieves Photo from S3",
-            code=aws_lambda.Code.from_asset(
-                os.path.join(BASE_FILE_PATH, "image_handler")
+            code=function_code(
+                self,
+                "Photo-handler",
+                os.path.join(BASE_FILE_PATH, "image_handler"),
+                layer_paths=[shared_layer.python_path],
+                exclude=STREAMING_MODULES,
             ),
+            layers=[shared_layer.layer_version],
             timeout=Duration.minutes(5),
         )
         s3_bucket.grant_read(photo_handler_fn.role)
+        albums.table.grant_read_data(photo_handler_fn.role)
+        # picked entries are moved to a new random point
+        albums.table.grant(photo_handler_fn.role, "dynamodb:UpdateItem")
 
-        # API gateway
+        # Hands out presigned multipart upload URLs for image batches
+        ingest_handler_fn = aws_lambda.Function(
+            self,
+            "IngestHandler",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            function_name="Ingest-handler",
+            environment={"S3_BUCKET_NAME": s3_bucket.bucket_name},
+            handler="lambda_handler.main",
+            description="Creates and completes image upload batches",
+            code=function_code(
+                self,
+                "Ingest-handler",
+                os.path.join(BASE_FILE_PATH, "ingest_handler"),
+                layer_paths=[shared_layer.python_path],
+            ),
+            layers=[shared_layer.layer_version],
+            timeout=Duration.seconds(30),
+        )
+        s3_bucket.grant_put(ingest_handler_fn.role, f"{INCOMING_PREFIX}*")
 
+        # WAF
+        rules = [
+            WafRule(
+                name="WafIpreputation",
+                rule_name="AWSManagedRulesAmazonIpReputationList",
+                priority=1,
+                metric_name="aws_reputation",
+                excluded_rules=[],
+            ),
+            WafRule(
+                name="WafAnony",
+                rule_name="AWSManagedRulesAnonymousIpList",
+                priority=2,
+                metric_name="aws_anony",
+                excluded_rules=["HostingProviderIPList"],
+            ),
+            WafRule(
+                name="WafCommonRule",
+                rule_name="AWSManagedRulesCommonRuleSet",
+                priority=3,
+                metric_name="aws_common",
+                # ingest batches can exceed the 8 KB body limit
+                excluded_rules=["NoUserAgent_HEADER", "SizeRestrictions_BODY"],
+            ),
+            WafRule(
+                name="WafBotControl",
+                rule_name="AWSManagedRulesBotControlRuleSet",
+                priority=4,
+                metric_name="aws_bot",
+                excluded_rules=["SignalNonBrowserUserAgent", "CategoryHttpLibrary"],
+            ),
+        ]
+
+        # The rate limit is evaluated first so a looping device is
+        # blocked before the managed rule groups are evaluated.
+        waf_rules = [make_rate_limit_rule(throttle.device_limit, priority=0)] + [
+            make_waf_rule(rule) for rule in rules
+        ]
+
+        # HTTP APIs cannot be associated with a web ACL directly,
+        # so in HTTP mode the ACL is attached to a CloudFront
+        # distribution in front of the API instead.
+        waf_scope = "REGIONAL" if mode == ApiMode.REST else "CLOUDFRONT"
+        web_acl = make_web_acl(
+            self, "PhotoFrameWebACL", "PhotoFrameACL", waf_scope, waf_rules
+        )
+        web_acls = [web_acl]
+        if waf_scope == "CLOUDFRONT" or streaming:
+            self._check_cloudfront_region()
+
+        if streaming:
+            # The stream distribution needs a CLOUDFRONT scoped copy
+            # of the regional web ACL
+            stream_acl = web_acl
+            if waf_scope != "CLOUDFRONT":
+                stream_acl = make_web_acl(
+                    self, "PhotoStreamWebACL", "PhotoStreamACL", "CLOUDFRONT", waf_rules
+                )
+                web_acls.append(stream_acl)
+            self._build_stream_function(
+                s3_bucket, shared_layer, albums, api_secrets, throttle, stream_acl
+            )
+
+        # Logging for API Gateway
+        api_log_group = aws_logs.LogGroup(
+            self, "PhotoFrameAPILog", retention=aws_logs.RetentionDays.ONE_WEEK
+        )
+
+        if mode == ApiMode.REST:
+            self._build_rest_api(
+                api_authorizer_fn,
+                photo_handler_fn,
+                ingest_handler_fn,
+                api_log_group,
+                web_acl,
+                throttle,
+                device_route=mtls is None or mtls.token_fallback,
+            )
+            if mtls is not None:
+                self._build_mtls_api(
+                    photo_handler_fn, api_log_group, web_acl, throttle, s3_bucket, mtls
+                )
+        else:
+            if mtls is not None:
+                # mutual TLS terminates at API Gateway, which would
+                # bypass the web ACL on the CloudFront front door
+                raise ValueError("Mutual TLS requires the REST API mode")
+            self._build_http_api(
+                api_authorizer_fn,
+                photo_handler_fn,
+                ingest_handler_fn,
+                api_log_group,
+                web_acl,
+                throttle,
+            )
+
+        # Requests rejected by the stage throttle
+        aws_logs.MetricFilter(
+            self,
+            "PhotoFrameThrottledRequests",
+            log_group=api_log_group,
+            filter_pattern=aws_logs.FilterPattern.string_value("$.status", "=", "429"),
+            metric_namespace=METRIC_NAMESPACE,
+            metric_name="ThrottledRequests",
+            metric_value="1",
+            default_value=0,
+        )
+
+        cfn_log_group = aws_logs.CfnLogGroup(
+            self,
+            "PhotoFrameWafLogs",
+            log_group_name="aws-waf-logs-photoframe",
+            retention_in_days=30,
+        )
+
+        for acl, config_id in zip(
+            web_acls, ["PhotoFrameLoggingConfig", "PhotoStreamLoggingConfig"]
+        ):
+            aws_wafv2.CfnLoggingConfiguration(
+                self,
+                config_id,
+                log_destination_configs=[
+                    f"arn:aws:logs:{scope.region}:"
+                    f"{scope.account}:log-group:{cfn_log_group.log_group_name}"
+                ],  # noqa
+                resource_arn=acl.attr_arn,
+                redacted_fields=[
+                    aws_wafv2.CfnLoggingConfiguration.FieldToMatchProperty(
+                        single_header={"Name": header},
+                    )
+                    for header in [API_TOKEN_HEADER, INGEST_TOKEN_HEADER]
+                ],
+            )
+
+    def _check_cloudfront_region(self):
+        """CLOUDFRONT scoped web ACLs only exist in us-east-1."""
+        stack = Stack.of(self)
+        region_error = "CLOUDFRONT scoped web ACLs must be deployed in us-east-1"
+        if not Token.is_unresolved(stack.region):
+            if stack.region != "us-east-1":
+                Annotations.of(self).add_error(region_error)
+        else:
+            # environment agnostic stacks are checked before any
+            # resource is created
+            CfnRule(
+                self,
+                "WebAclRegionRule",
+                assertions=[
+                    CfnRuleAssertion(
+                        assert_=Fn.condition_equals(Aws.REGION, "us-east-1"),
+                        assert_description=region_error,
+                    )
+                ],
+            )
+
+    def _build_rest_api(
+        self,
+        api_authorizer_fn: aws_lambda.Function,
+        photo_handler_fn: aws_lambda.Function,
+        ingest_handler_fn: aws_lambda.Function,
+        api_log_group: aws_logs.LogGroup,
+        web_acl: aws_wafv2.CfnWebACL,
+        throttle: ThrottleSettings,
+        device_route: bool = True,
+    ):
         api = aws_apigateway.RestApi(
             self,
             "PhotoFrameAPI",
@@ -76,37 +386,283 @@ class API(Construct):
             ),
         )
 
-        api_items = api.root.add_resource("image")
-        deployment = aws_apigateway.Deployment(
+        # Devices authenticated by mutual TLS use the mTLS API instead
+        if device_route:
+            auth = aws_apigateway.RequestAuthorizer(
+                self,
+                "PhotoFrameRequestAuthorizer",
+                handler=api_authorizer_fn,
+                identity_sources=[
+                    aws_apigateway.IdentitySource.header(API_TOKEN_HEADER)
+                ],
+                results_cache_ttl=AUTHORIZER_CACHE_TTL,
+            )
+            api.root.add_resource("image").add_method(
+                "GET",
+                authorizer=auth,
+                integration=aws_apigateway.LambdaIntegration(
+                    photo_handler_fn,
+                    content_handling=aws_apigateway.ContentHandling.CONVERT_TO_BINARY,
+                ),
+            )
+
+        ingest_auth = aws_apigateway.RequestAuthorizer(
             self,
-            "PhotoFrameDefaultDeployment",
-            description="Photo Frame Deployment",
-            api=api,
+            "PhotoFrameIngestAuthorizer",
+            handler=api_authorizer_fn,
+            identity_sources=[
+                aws_apigateway.IdentitySource.header(INGEST_TOKEN_HEADER)
+            ],
+            results_cache_ttl=AUTHORIZER_CACHE_TTL,
         )
+        ingest_integration = aws_apigateway.LambdaIntegration(ingest_handler_fn)
+        ingest = api.root.add_resource("ingest")
+        ingest.add_method("POST", ingest_integration, authorizer=ingest_auth)
+        ingest.add_resource("{batch_id}").add_resource("complete").add_method(
+            "POST", ingest_integration, authorizer=ingest_auth
+        )
+
+        self._add_rest_stage("PhotoFrame", api, api_log_group, web_acl, throttle)
 
-        auth = aws_apigateway.RequestAuthorizer(
+    def _build_mtls_api(
+        self,
+        photo_handler_fn: aws_lambda.Function,
+        api_log_group: aws_logs.LogGroup,
+        web_acl: aws_wafv2.CfnWebACL,
+        throttle: ThrottleSettings,
+        s3_bucket: aws_s3.Bucket,
+        mtls: MutualTlsSettings,
+    ):
+        """
+        Device API that is only reachable through a custom domain
+        requiring a client certificate signed by the device CA.
+        Devices are authenticated during the TLS handshake, so
+        no Lambda authorizer is invoked.
+        """
+        api = aws_apigateway.RestApi(
             self,
-            "PhotoFrameRequestAuthorizer",
-            handler=api_authorizer_fn,
-            identity_sources=[aws_apigateway.IdentitySource.header("x-api-token")],
+            "PhotoFrameMtlsAPI",
+            binary_media_types=["*/*"],
+            description="Mutual TLS API for Photo Frame to retrieve images",
+            deploy=False,
+            disable_execute_api_endpoint=True,
+            endpoint_configuration=aws_apigateway.EndpointConfiguration(
+                types=[aws_apigateway.EndpointType.REGIONAL]
+            ),
         )
-        api_items.add_method(
+        api.root.add_resource("image").add_method(
             "GET",
-            authorizer=auth,
             integration=aws_apigateway.LambdaIntegration(
                 photo_handler_fn,
                 content_handling=aws_apigateway.ContentHandling.CONVERT_TO_BINARY,
             ),
         )
-        # Logging for API Gateway
-        api_log_group = aws_logs.LogGroup(
-            self, "PhotoFrameAPILog", retention=aws_logs.RetentionDays.ONE_WEEK
+        # The web ACL's rate rule is keyed on the client IP, so
+        # certificate authenticated frames, which send no token,
+        # are rate limited like the others.
+        stage = self._add_rest_stage(
+            "PhotoFrameMtls", api, api_log_group, web_acl, throttle
+        )
+
+        domain = aws_apigateway.DomainName(
+            self,
+            "PhotoFrameMtlsDomain",
+            domain_name=mtls.domain_name,
+            certificate=aws_certificatemanager.Certificate.from_certificate_arn(
+                self, "PhotoFrameMtlsCertificate", mtls.certificate_arn
+            ),
+            endpoint_type=aws_apigateway.EndpointType.REGIONAL,
+            security_policy=aws_apigateway.SecurityPolicy.TLS_1_2,
+            mtls=aws_apigateway.MTLSConfig(bucket=s3_bucket, key=mtls.truststore_key),
+        )
+        domain.add_base_path_mapping(api, stage=stage)
+        CfnOutput(
+            self,
+            "PhotoFrameMtlsDomainTarget",
+            description="Regional domain to alias the mutual TLS domain name to",
+            value=domain.domain_name_alias_domain_name,
+        )
+
+    def _build_stream_function(
+        self,
+        s3_bucket: aws_s3.Bucket,
+        shared_layer: SharedLayer,
+        albums: AlbumSettings,
+        api_secrets: aws_secretsmanager.Secret,
+        throttle: ThrottleSettings,
+        web_acl: aws_wafv2.CfnWebACL,
+    ):
+        """
+        GET /image on a function URL with response streaming. Images
+        are piped from S3 in fixed-size chunks, so their size is not
+        bound by the function's memory or the 6 MB response limit of
+        API Gateway and buffered invokes.
+
+        The URL only accepts requests signed by a CloudFront
+        distribution carrying the web ACL. There are no stage
+        throttles, so the device token is checked by the function
+        and concurrency is capped instead.
+        """
+        stack = Stack.of(self)
+        web_adapter = aws_lambda.LayerVersion.from_layer_version_arn(
+            self,
+            "WebAdapterLayer",
+            WEB_ADAPTER_LAYER.format(region=stack.region),
+        )
+        stream_handler_fn = aws_lambda.Function(
+            self,
+            "PhotoStreamHandler",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            function_name="Photo-stream-handler",
+            environment={
+                "S3_BUCKET_NAME": s3_bucket.bucket_name,
+                "ALBUM_TABLE_NAME": albums.table.table_name,
+                "DEVICE_ALBUMS": json.dumps(albums.device_albums),
+                "DEFAULT_ALBUMS": json.dumps(albums.default_albums),
+                "API_TOKEN_NAME": api_secrets.secret_name,
+                "AWS_LAMBDA_EXEC_WRAPPER": "/opt/bootstrap",
+                "AWS_LWA_INVOKE_MODE": "response_stream",
+                "AWS_LWA_READINESS_CHECK_PATH": "/ping",
+                "PORT": "8080",
+            },
+            handler="run.sh",
+            description="Streams photos from S3",
+            code=function_code(
+                self,
+                "Photo-stream-handler",
+                os.path.join(BASE_FILE_PATH, "image_handler"),
+                handler="run.sh",
+                handler_module="stream_server",
+                layer_paths=[shared_layer.python_path],
+            ),
+            layers=[shared_layer.layer_version, web_adapter],
+            reserved_concurrent_executions=throttle.burst_limit,
+            timeout=Duration.minutes(5),
+        )
+        s3_bucket.grant_read(stream_handler_fn.role)
+        albums.table.grant_read_data(stream_handler_fn.role)
+        # picked entries are moved to a new random point
+        albums.table.grant(stream_handler_fn.role, "dynamodb:UpdateItem")
+        api_secrets.grant_read(stream_handler_fn.role)
+
+        # No L2 function URL or origin access control in this CDK version
+        function_url = CfnResource(
+            self,
+            "PhotoStreamUrl",
+            type="AWS::Lambda::Url",
+            properties={
+                "TargetFunctionArn": stream_handler_fn.function_arn,
+                "AuthType": "AWS_IAM",
+                "InvokeMode": "RESPONSE_STREAM",
+            },
+        )
+        origin_access = CfnResource(
+            self,
+            "PhotoStreamOriginAccess",
+            type="AWS::CloudFront::OriginAccessControl",
+            properties={
+                "OriginAccessControlConfig": {
+                    "Name": f"{stack.stack_name}-photo-stream",
+                    "OriginAccessControlOriginType": "lambda",
+                    "SigningBehavior": "always",
+                    "SigningProtocol": "sigv4",
+                }
+            },
+        )
+
+        origin_request_policy = aws_cloudfront.OriginRequestPolicy(
+            self,
+            "PhotoStreamOriginRequestPolicy",
+            comment="Forwards the access token and device id to the stream function",
+            header_behavior=aws_cloudfront.OriginRequestHeaderBehavior.allow_list(
+                API_TOKEN_HEADER, DEVICE_ID_HEADER
+            ),
+            query_string_behavior=aws_cloudfront.OriginRequestQueryStringBehavior.all(),
+        )
+        distribution = aws_cloudfront.Distribution(
+            self,
+            "PhotoStreamDistribution",
+            comment="Front door for the Photo Frame stream function",
+            default_behavior=aws_cloudfront.BehaviorOptions(
+                # https://<url-id>.lambda-url.<region>.on.aws/
+                origin=aws_cloudfront_origins.HttpOrigin(
+                    Fn.select(
+                        2,
+                        Fn.split("/", function_url.get_att("FunctionUrl").to_string()),
+                    )
+                ),
+                allowed_methods=aws_cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                cache_policy=aws_cloudfront.CachePolicy.CACHING_DISABLED,
+                origin_request_policy=origin_request_policy,
+                viewer_protocol_policy=aws_cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+            ),
+            web_acl_id=web_acl.attr_arn,
+        )
+        distribution.node.default_child.add_property_override(
+            "DistributionConfig.Origins.0.OriginAccessControlId",
+            origin_access.get_att("Id").to_string(),
+        )
+
+        distribution_arn = stack.format_arn(
+            service="cloudfront",
+            region="",
+            resource="distribution",
+            resource_name=distribution.distribution_id,
+        )
+        url_permission = aws_lambda.CfnPermission(
+            self,
+            "PhotoStreamUrlPermission",
+            action="lambda:InvokeFunctionUrl",
+            function_name=stream_handler_fn.function_name,
+            principal="cloudfront.amazonaws.com",
+            source_arn=distribution_arn,
+        )
+        url_permission.add_property_override("FunctionUrlAuthType", "AWS_IAM")
+        # New function URLs also require lambda:InvokeFunction
+        invoke_permission = aws_lambda.CfnPermission(
+            self,
+            "PhotoStreamInvokePermission",
+            action="lambda:InvokeFunction",
+            function_name=stream_handler_fn.function_name,
+            principal="cloudfront.amazonaws.com",
+            source_arn=distribution_arn,
+        )
+        invoke_permission.add_property_override("InvokedViaFunctionUrl", True)
+
+        CfnOutput(
+            self,
+            "PhotoStreamDistributionDomain",
+            description="Domain name devices use to stream images, GET /image",
+            value=distribution.distribution_domain_name,
+        )
+
+    def _add_rest_stage(
+        self,
+        id_prefix: str,
+        api: aws_apigateway.RestApi,
+        api_log_group: aws_logs.LogGroup,
+        web_acl: aws_wafv2.CfnWebACL,
+        throttle: ThrottleSettings,
+    ) -> aws_apigateway.Stage:
+        """Deploys a REST API to a throttled, logged and WAF protected stage."""
+        api.add_gateway_response(
+            f"{id_prefix}ThrottledResponse",
+            type=aws_apigateway.ResponseType.THROTTLED,
+            response_headers={"Retry-After": f"'{RETRY_AFTER_SECONDS}'"},
+        )
+        deployment = aws_apigateway.Deployment(
+            self,
+            f"{id_prefix}DefaultDeployment",
+            description="Photo Frame Deployment",
+            api=api,
         )
         stage = aws_apigateway.Stage(
             self,
-            "PhotoFrameStage",
+            f"{id_prefix}Stage",
             deployment=deployment,
-            stage_name="public",
+            stage_name=STAGE_NAME,
+            throttling_rate_limit=throttle.rate_limit,
+            throttling_burst_limit=throttle.burst_limit,
             access_log_destination=aws_apigateway.LogGroupLogDestination(api_log_group),
             access_log_format=aws_apigateway.AccessLogFormat.json_with_standard_fields(
                 caller=False,
@@ -121,86 +677,284 @@ class API(Construct):
             ),
         )
 
-        # WAF
-        rules = [
-            WafRule(
-                name="WafIpreputation",
-                rule_name="AWSManagedRulesAmazonIpReputationList",
-                priority=1,
-                metric_name="aws_reputation",
-                excluded_rules=[],
-            ),
-            WafRule(
-                name="WafAnony",
-                rule_name="AWSManagedRulesAnonymousIpList",
-                priority=2,
-                metric_name="aws_anony",
-                excluded_rules=["HostingProviderIPList"],
-            ),
-            WafRule(
-                name="WafCommonRule",
-                rule_name="AWSManagedRulesCommonRuleSet",
-                priority=3,
-                metric_name="aws_common",
-                excluded_rules=["NoUserAgent_HEADER"],
-            ),
-            WafRule(
-                name="WafBotControl",
-                rule_name="AWSManagedRulesBotControlRuleSet",
-                priority=4,
-                metric_name="aws_bot",
-                excluded_rules=["SignalNonBrowserUserAgent", "CategoryHttpLibrary"],
-            ),
-        ]
-
-        waf_rules = [make_waf_rule(rule) for rule in rules]
-
-        web_acl = aws_wafv2.CfnWebACL(
-            self,
-            "PhotoFrameWebACL",
-            default_action=aws_wafv2.CfnWebACL.DefaultActionProperty(allow={}),
-            scope="REGIONAL",
-            visibility_config=aws_wafv2.CfnWebACL.VisibilityConfigProperty(
-                cloud_watch_metrics_enabled=True,
-                metric_name="webACL",
-                sampled_requests_enabled=True,
-            ),
-            name="PhotoFrameACL",
-            rules=waf_rules,
-        )
-
         resource_arn = (
             f"arn:aws:apigateway:{api.env.region}::/"
             f"restapis/{api.rest_api_id}/stages/{stage.stage_name}"
         )
         aws_wafv2.CfnWebACLAssociation(
             self,
-            "PhotoFrameACLAssociation",
+            f"{id_prefix}ACLAssociation",
             web_acl_arn=web_acl.attr_arn,
             resource_arn=resource_arn,
         )
+        return stage
 
-        cfn_log_group = aws_logs.CfnLogGroup(
+    def _build_http_api(
+        self,
+        api_authorizer_fn: aws_lambda.Function,
+        photo_handler_fn: aws_lambda.Function,
+        ingest_handler_fn: aws_lambda.Function,
+        api_log_group: aws_logs.LogGroup,
+        web_acl: aws_wafv2.CfnWebACL,
+        throttle: ThrottleSettings,
+    ):
+        stack = Stack.of(self)
+
+        # The execute-api endpoint can't be disabled as it is the
+        # CloudFront origin, so requests reaching it without this
+        # secret are rejected by the authorizer.
+        origin_secret = aws_secretsmanager.Secret(
             self,
-            "PhotoFrameWafLogs",
-            log_group_name="aws-waf-logs-photoframe",
-            retention_in_days=30,
+            "originVerifySecret",
+            secret_name="origin-verify-token",
+            generate_secret_string=aws_secretsmanager.SecretStringGenerator(
+                exclude_punctuation=True, password_length=48
+            ),
+        )
+        origin_secret.grant_read(api_authorizer_fn.role)
+        api_authorizer_fn.add_environment(
+            "ORIGIN_TOKEN_NAME", origin_secret.secret_name
         )
 
-        aws_wafv2.CfnLoggingConfiguration(
+        api = aws_apigatewayv2.CfnApi(
             self,
-            "PhotoFrameLoggingConfig",
-            log_destination_configs=[
-                f"arn:aws:logs:{scope.region}:"
-                f"{scope.account}:log-group:{cfn_log_group.log_group_name}"
-            ],  # noqa
-            resource_arn=web_acl.attr_arn,
-            redacted_fields=[
-                aws_wafv2.CfnLoggingConfiguration.FieldToMatchProperty(
-                    single_header={"Name": "x-api-token"},
-                )
+            "PhotoFrameHttpAPI",
+            name="PhotoFrameHttpAPI",
+            protocol_type="HTTP",
+            description="API for Photo Frame to retrieve images",
+        )
+
+        integration = aws_apigatewayv2.CfnIntegration(
+            self,
+            "PhotoFrameHttpIntegration",
+            api_id=api.ref,
+            integration_type="AWS_PROXY",
+            integration_uri=photo_handler_fn.function_arn,
+            payload_format_version="2.0",
+        )
+
+        ingest_integration = aws_apigatewayv2.CfnIntegration(
+            self,
+            "PhotoFrameHttpIngestIntegration",
+            api_id=api.ref,
+            integration_type="AWS_PROXY",
+            integration_uri=ingest_handler_fn.function_arn,
+            payload_format_version="2.0",
+        )
+
+        # Simple responses return a boolean and context instead
+        # of an IAM policy document.
+        authorizer_uri = (
+            f"arn:{stack.partition}:apigateway:{stack.region}:lambda:path/"
+            f"2015-03-31/functions/{api_authorizer_fn.function_arn}/invocations"
+        )
+        auth = aws_apigatewayv2.CfnAuthorizer(
+            self,
+            "PhotoFrameHttpAuthorizer",
+            api_id=api.ref,
+            name="PhotoFrameHttpAuthorizer",
+            authorizer_type="REQUEST",
+            authorizer_uri=authorizer_uri,
+            authorizer_payload_format_version="2.0",
+            enable_simple_responses=True,
+            identity_source=[
+                f"$request.header.{API_TOKEN_HEADER}",
+                f"$request.header.{ORIGIN_VERIFY_HEADER}",
+            ],
+            authorizer_result_ttl_in_seconds=AUTHORIZER_CACHE_TTL.to_seconds(),
+        )
+        ingest_auth = aws_apigatewayv2.CfnAuthorizer(
+            self,
+            "PhotoFrameHttpIngestAuthorizer",
+            api_id=api.ref,
+            name="PhotoFrameHttpIngestAuthorizer",
+            authorizer_type="REQUEST",
+            authorizer_uri=authorizer_uri,
+            authorizer_payload_format_version="2.0",
+            enable_simple_responses=True,
+            identity_source=[
+                f"$request.header.{INGEST_TOKEN_HEADER}",
+                f"$request.header.{ORIGIN_VERIFY_HEADER}",
             ],
+            authorizer_result_ttl_in_seconds=AUTHORIZER_CACHE_TTL.to_seconds(),
+        )
+
+        aws_apigatewayv2.CfnRoute(
+            self,
+            "PhotoFrameHttpImageRoute",
+            api_id=api.ref,
+            route_key="GET /image",
+            target=f"integrations/{integration.ref}",
+            authorization_type="CUSTOM",
+            authorizer_id=auth.ref,
+        )
+        for route_id, route_key in [
+            ("PhotoFrameHttpIngestRoute", "POST /ingest"),
+            ("PhotoFrameHttpIngestCompleteRoute", "POST /ingest/{batch_id}/complete"),
+        ]:
+            aws_apigatewayv2.CfnRoute(
+                self,
+                route_id,
+                api_id=api.ref,
+                route_key=route_key,
+                target=f"integrations/{ingest_integration.ref}",
+                authorization_type="CUSTOM",
+                authorizer_id=ingest_auth.ref,
+            )
+
+        aws_apigatewayv2.CfnStage(
+            self,
+            "PhotoFrameHttpStage",
+            api_id=api.ref,
+            stage_name=STAGE_NAME,
+            auto_deploy=True,
+            default_route_settings=aws_apigatewayv2.CfnStage.RouteSettingsProperty(
+                throttling_rate_limit=throttle.rate_limit,
+                throttling_burst_limit=throttle.burst_limit,
+            ),
+            access_log_settings=aws_apigatewayv2.CfnStage.AccessLogSettingsProperty(
+                destination_arn=api_log_group.log_group_arn,
+                format=json.dumps(
+                    {
+                        "requestId": "$context.requestId",
+                        "ip": "$context.identity.sourceIp",
+                        "requestTime": "$context.requestTime",
+                        "httpMethod": "$context.httpMethod",
+                        "routeKey": "$context.routeKey",
+                        "status": "$context.status",
+                        "protocol": "$context.protocol",
+                        "responseLength": "$context.responseLength",
+                        "authorizerError": "$context.authorizer.error",
+                    }
+                ),
+            ),
+        )
+
+        execute_api_arn = stack.format_arn(
+            service="execute-api", resource=api.ref, resource_name="*"
+        )
+        photo_handler_fn.add_permission(
+            "PhotoFrameHttpInvoke",
+            principal=aws_iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=execute_api_arn,
         )
+        ingest_handler_fn.add_permission(
+            "PhotoFrameHttpIngestInvoke",
+            principal=aws_iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=execute_api_arn,
+        )
+        api_authorizer_fn.add_permission(
+            "PhotoFrameHttpAuthorizerInvoke",
+            principal=aws_iam.ServicePrincipal("apigateway.amazonaws.com"),
+            source_arn=execute_api_arn,
+        )
+
+        # Front door that carries the web ACL
+        origin_request_policy = aws_cloudfront.OriginRequestPolicy(
+            self,
+            "PhotoFrameOriginRequestPolicy",
+            comment="Forwards the access tokens and device ids to the Photo Frame API",
+            header_behavior=aws_cloudfront.OriginRequestHeaderBehavior.allow_list(
+                API_TOKEN_HEADER, INGEST_TOKEN_HEADER, DEVICE_ID_HEADER
+            ),
+            query_string_behavior=aws_cloudfront.OriginRequestQueryStringBehavior.all(),
+        )
+        distribution = aws_cloudfront.Distribution(
+            self,
+            "PhotoFrameDistribution",
+            comment="Front door for the Photo Frame HTTP API",
+            default_behavior=aws_cloudfront.BehaviorOptions(
+                origin=aws_cloudfront_origins.HttpOrigin(
+                    f"{api.ref}.execute-api.{stack.region}.{stack.url_suffix}",
+                    origin_path=f"/{STAGE_NAME}",
+                    custom_headers={
+                        ORIGIN_VERIFY_HEADER: origin_secret.secret_value.to_string()
+                    },
+                ),
+                allowed_methods=aws_cloudfront.AllowedMethods.ALLOW_ALL,
+                cache_policy=aws_cloudfront.CachePolicy.CACHING_DISABLED,
+                origin_request_policy=origin_request_policy,
+                viewer_protocol_policy=aws_cloudfront.ViewerProtocolPolicy.HTTPS_ONLY,
+            ),
+            web_acl_id=web_acl.attr_arn,
+        )
+        CfnOutput(
+            self,
+            "PhotoFrameDistributionDomain",
+            description="Domain name devices use to reach the Photo Frame API",
+            value=distribution.distribution_domain_name,
+        )
+
+
+def make_web_acl(
+    scope: Construct,
+    id_: str,
+    name: str,
+    waf_scope: str,
+    rules: List[aws_wafv2.CfnWebACL.RuleProperty],
+) -> aws_wafv2.CfnWebACL:
+    return aws_wafv2.CfnWebACL(
+        scope,
+        id_,
+        default_action=aws_wafv2.CfnWebACL.DefaultActionProperty(allow={}),
+        scope=waf_scope,
+        visibility_config=aws_wafv2.CfnWebACL.VisibilityConfigProperty(
+            cloud_watch_metrics_enabled=True,
+            metric_name="webACL",
+            sampled_requests_enabled=True,
+        ),
+        name=name,
+        rules=rules,
+    )
+
+
+def make_rate_limit_rule(limit: int, priority: int):
+    """
+    Blocks a client IP that sends more than ``limit`` image requests
+    in 5 minutes with a 429 firmware can back off on. Token and
+    mutual TLS requests are counted alike, ingest requests are not.
+    """
+    return aws_wafv2.CfnWebACL.RuleProperty(
+        name="DeviceRateLimit",
+        priority=priority,
+        visibility_config=aws_wafv2.CfnWebACL.VisibilityConfigProperty(
+            cloud_watch_metrics_enabled=True,
+            metric_name="device_rate_limit",
+            sampled_requests_enabled=True,
+        ),
+        action=aws_wafv2.CfnWebACL.RuleActionProperty(
+            block=aws_wafv2.CfnWebACL.BlockActionProperty(
+                custom_response=aws_wafv2.CfnWebACL.CustomResponseProperty(
+                    response_code=429,
+                    response_headers=[
+                        aws_wafv2.CfnWebACL.CustomHTTPHeaderProperty(
+                            name="Retry-After", value=str(RETRY_AFTER_SECONDS)
+                        )
+                    ],
+                )
+            )
+        ),
+        statement=aws_wafv2.CfnWebACL.StatementProperty(
+            rate_based_statement=aws_wafv2.CfnWebACL.RateBasedStatementProperty(
+                aggregate_key_type="IP",
+                limit=limit,
+                scope_down_statement=aws_wafv2.CfnWebACL.StatementProperty(
+                    byte_match_statement=aws_wafv2.CfnWebACL.ByteMatchStatementProperty(
+                        field_to_match=aws_wafv2.CfnWebACL.FieldToMatchProperty(
+                            uri_path={}
+                        ),
+                        positional_constraint="ENDS_WITH",
+                        search_string="/image",
+                        text_transformations=[
+                            aws_wafv2.CfnWebACL.TextTransformationProperty(
+                                priority=0, type="LOWERCASE"
+                            )
+                        ],
+                    )
+                ),
+            )
+        ),
+    )
 
 
 def make_waf_rule(rule: WafRule):
@@ -0,0 +1,203 @@
+from typing import Any, Dict, List, Optional
+import base64
+import json
+import math
+import os
+import re
+import time
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+from photo_frame_common.logger import get_logger
+
+LOGGER = get_logger()
+
+INCOMING_PREFIX = "incoming/"
+# S3 parts must be at least 5 MiB, except the last one
+PART_SIZE = 8 * 1024 * 1024
+MAX_BATCH_IMAGES = 100
+MAX_IMAGE_BYTES = 100 * 1024 * 1024
+URL_EXPIRY_SECONDS = 60 * 60
+NAME_PATTERN = re.compile(r"^[\w][\w. -]{0,200}$")
+# Space separated tags of the albums a batch is added to
+ALBUM_PATTERN = re.compile(r"^[\w-]{1,64}( [\w-]{1,64}){0,9}$")
+
+s3_client = boto3.client("s3")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def response(status_code: int, body: Dict) -> Dict:
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(body),
+    }
+
+
+def get_body(event: Dict) -> Dict:
+    body = event.get("body") or "{}"
+    # REST API binary media types also apply to request bodies
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    try:
+        body = json.loads(body)
+    except ValueError:
+        raise BadRequest("Body must be JSON")
+    if not isinstance(body, dict):
+        raise BadRequest("Body must be a JSON object")
+    return body
+
+
+def validate_images(images: Any) -> List[Dict]:
+    """
+    Returns the name and size of every image, validated before
+    any upload is started.
+    """
+    if not isinstance(images, list) or not 0 < len(images) <= MAX_BATCH_IMAGES:
+        raise BadRequest(f"A batch holds 1 to {MAX_BATCH_IMAGES} images")
+    validated = []
+    stems = set()
+    for image in images:
+        if not isinstance(image, dict):
+            raise BadRequest("Images must be objects")
+        name = image.get("name")
+        size = image.get("size")
+        if not isinstance(name, str) or not NAME_PATTERN.match(name):
+            raise BadRequest(f"Invalid image name {name!r}")
+        if (
+            not isinstance(size, int)
+            or isinstance(size, bool)
+            or not 0 < size <= MAX_IMAGE_BYTES
+        ):
+            raise BadRequest(f"Invalid size for {name}")
+        # every image is stored as <stem>.jpg
+        stem = os.path.splitext(name)[0]
+        if stem in stems:
+            raise BadRequest(f"Duplicate image name {name}")
+        stems.add(stem)
+        validated.append({"name": name, "size": size})
+    return validated
+
+
+def create_batch(bucket_name: str, images: Any, album: Optional[str] = None) -> Dict:
+    """
+    Starts a multipart upload for every image and presigns
+    the URLs of its parts. Processed images are tagged with
+    the album, if any.
+    """
+    images = validate_images(images)
+    metadata = {
+        "batch-created": str(time.time()),
+        # lets the processor tell when the batch is done
+        "batch-images": str(len(images)),
+    }
+    if album is not None:
+        if not isinstance(album, str) or not ALBUM_PATTERN.match(album):
+            raise BadRequest(f"Invalid album {album!r}")
+        metadata["album"] = album
+
+    batch_id = uuid.uuid4().hex
+    uploads = []
+    for image in images:
+        name = image["name"]
+        size = image["size"]
+        key = f"{INCOMING_PREFIX}{batch_id}/{name}"
+        upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            Metadata=metadata,
+        )["UploadId"]
+        part_urls = [
+            s3_client.generate_presigned_url(
+                "upload_part",
+                Params={
+                    "Bucket": bucket_name,
+                    "Key": key,
+                    "UploadId": upload_id,
+                    "PartNumber": part_number,
+                },
+                ExpiresIn=URL_EXPIRY_SECONDS,
+            )
+            for part_number in range(1, math.ceil(size / PART_SIZE) + 1)
+        ]
+        uploads.append(
+            {
+                "name": name,
+                "key": key,
+                "upload_id": upload_id,
+                "part_size": PART_SIZE,
+                "part_urls": part_urls,
+            }
+        )
+    LOGGER.info(f"Created batch {batch_id} with {len(uploads)} images")
+    return {"batch_id": batch_id, "uploads": uploads}
+
+
+def complete_batch(bucket_name: str, batch_id: str, uploads: Any) -> Dict:
+    """
+    Completes the multipart uploads of a batch. Each completed
+    upload triggers the image processor.
+
+    Parameters:
+    uploads (list): key, upload_id and the parts ({PartNumber, ETag})
+    of every upload
+    """
+    if not isinstance(uploads, list) or not uploads:
+        raise BadRequest("uploads must be a non-empty list")
+    for upload in uploads:
+        if not isinstance(upload, dict):
+            raise BadRequest("Uploads must be objects")
+        key = upload.get("key")
+        if not isinstance(key, str) or not key.startswith(
+            f"{INCOMING_PREFIX}{batch_id}/"
+        ):
+            raise BadRequest(f"{key!r} is not part of batch {batch_id}")
+        if not isinstance(upload.get("upload_id"), str):
+            raise BadRequest(f"Invalid upload_id for {key}")
+        parts = upload.get("parts")
+        if not isinstance(parts, list) or not all(
+            isinstance(part, dict) for part in parts
+        ):
+            raise BadRequest(f"Invalid parts for {key}")
+
+    completed = []
+    for upload in uploads:
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=upload["key"],
+            UploadId=upload["upload_id"],
+            MultipartUpload={"Parts": upload["parts"]},
+        )
+        completed.append(upload["key"])
+    return {"batch_id": batch_id, "completed": completed}
+
+
+def main(event: Dict, context: Any):
+    """
+    POST /ingest
+        {"images": [{"name": "beach.jpg", "size": 1234567}], "album": "beach"}
+        returns presigned part URLs for a new batch, album is optional
+    POST /ingest/{batch_id}/complete
+        {"uploads": [{"key", "upload_id", "parts"}]}
+        completes the uploads of a batch
+    """
+    s3_bucket_name = os.environ["S3_BUCKET_NAME"]
+    batch_id = (event.get("pathParameters") or {}).get("batch_id")
+    try:
+        body = get_body(event)
+        if batch_id is None:
+            return response(
+                200,
+                create_batch(s3_bucket_name, body.get("images"), body.get("album")),
+            )
+        if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+            raise BadRequest("Invalid batch id")
+        return response(
+            200, complete_batch(s3_bucket_name, batch_id, body.get("uploads"))
+        )
+    except (BadRequest, KeyError, ClientError) as ex:
+        LOGGER.warning(ex)
+        return response(400, {"message": str(ex)})
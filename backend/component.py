@@ -6,10 +6,21 @@ from constructs import Construct
 from dacite import from_dict
 
 
-from backend.storage.infrastructure import Storage
-from backend.api.infrastructure import API
+from backend.storage.infrastructure import (
+    DEFAULT_TRUSTSTORE_DIR,
+    Album,
+    Storage,
+)
+from backend.api.infrastructure import (
+    API,
+    AlbumSettings,
+    ApiMode,
+    MutualTlsSettings,
+    ThrottleSettings,
+)
 from backend.stack_helpers.stack_helpers import Environment
 from backend.iot.infrastructure import IOT
+from backend.layer.infrastructure import SharedLayer
 
 
 class Backend(cdk.Stack):
@@ -25,6 +36,55 @@ class Backend(cdk.Stack):
         config = dict(self.node.try_get_context(key="prod"))
         config_env: Environment = from_dict(data_class=Environment, data=config)  # noqa
 
-        storage = Storage(self, "Storage")
-        API(self, "API", storage.s3_bucket)
-        IOT(self, "IOT")
+        truststore_dir = None
+        if config_env.domain_name:
+            truststore_dir = config_env.truststore_dir or DEFAULT_TRUSTSTORE_DIR
+
+        albums = {name: Album(**album) for name, album in config_env.albums.items()}
+        for album in config_env.default_albums + [
+            album
+            for device_albums in config_env.device_albums.values()
+            for album in device_albums
+        ]:
+            if album not in albums:
+                raise ValueError(f"Unknown album {album}")
+
+        shared_layer = SharedLayer(self, "SharedLayer")
+        storage = Storage(
+            self,
+            "Storage",
+            shared_layer,
+            truststore_dir=truststore_dir,
+            albums=albums,
+        )
+        mtls = None
+        if config_env.domain_name:
+            mtls = MutualTlsSettings(
+                domain_name=config_env.domain_name,
+                certificate_arn=config_env.certificate_arn,
+                truststore_key=storage.truststore_key,
+                token_fallback=config_env.mtls_token_fallback,
+            )
+        api = API(
+            self,
+            "API",
+            storage.s3_bucket,
+            shared_layer,
+            AlbumSettings(
+                table=storage.album_table,
+                device_albums=config_env.device_albums,
+                default_albums=config_env.default_albums,
+            ),
+            mode=ApiMode(config_env.api_mode),
+            throttle=ThrottleSettings(
+                rate_limit=config_env.throttle_rate_limit,
+                burst_limit=config_env.throttle_burst_limit,
+                device_limit=config_env.device_rate_limit,
+            ),
+            mtls=mtls,
+            streaming=config_env.streaming,
+        )
+        if storage.truststore_deployment:
+            # the truststore must exist before the domain is created
+            api.node.add_dependency(storage.truststore_deployment)
+        IOT(self, "IOT", shared_layer)
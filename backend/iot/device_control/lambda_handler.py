@@ -1,54 +1,85 @@
-from typing import Any, Dict
-import logging
+from typing import Any, Dict, List
 import os
-import json
 import boto3
-import random
-import base64
 import datetime
+from photo_frame_common.logger import get_logger
 
-LOGGER = logging.getLogger()
-LOGGER.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO")))
+LOGGER = get_logger()
 
 MAX_SECONDS_DELTA = 60 * 60 * 24  # one day
 
 
+def get_devices(dynamo_client, table_name: str) -> List[Dict]:
+    """Latest lifecycle event of every device, one item per device."""
+    paginator = dynamo_client.get_paginator("scan")
+    return [
+        item
+        for page in paginator.paginate(TableName=table_name, ConsistentRead=True)
+        for item in page["Items"]
+    ]
+
+
 def main(event: Dict, context: Any):
-    """ """
+    """
+    Tells the frames a new image is available when any of them
+    is connected. Devices disconnected for more than a day are
+    reported once until they reconnect, and the schedule is
+    disabled once every device is offline.
+    """
     dynamo_client = boto3.client("dynamodb")
     table_name = os.environ["IOT_TABLE_NAME"]
     sns_topic_arn = os.environ["DEVICE_OFFLINE_TOPIC"]
     rule_name = os.environ["RULE_NAME"]
     try:
-        recent_status = dynamo_client.get_item(
-            ConsistentRead=True,
-            TableName=table_name,
-            Key={"device_name": {"S": "esp32c3_photo_frame"}},
-        )
-        if recent_status["Item"]["payload"]["M"]["eventType"]["S"] == "connected":
-            LOGGER.info("Device connected, sending message")
+        devices = get_devices(dynamo_client, table_name)
+        connected = [
+            device
+            for device in devices
+            if device["payload"]["M"]["eventType"]["S"] == "connected"
+        ]
+        if connected:
+            LOGGER.info(f"{len(connected)} devices connected, sending message")
             iot_client = boto3.client("iot-data")
             iot_client.publish(topic="new_image_available")
-        else:
+
+        offline = []
+        for device in devices:
+            if device in connected:
+                continue
+            device_name = device["device_name"]["S"]
             last_connected_time = datetime.datetime.fromtimestamp(
-                int(recent_status["Item"]["payload"]["M"]["timestamp"]["N"])
+                int(device["payload"]["M"]["timestamp"]["N"])
                 / 1000  # from milliseconds to seconds
             )
-            LOGGER.info(f"Last connected time was {last_connected_time}")
-            now = datetime.datetime.now()
-            delta = now - last_connected_time
-            seconds = delta.total_seconds()
-            LOGGER.info(f"Disconnected for {seconds} seconds")
-            if seconds > MAX_SECONDS_DELTA:
-                sns_client = boto3.client("sns")
-                events_client = boto3.client('events')
-                sns_client.publish(
-                    TopicArn=sns_topic_arn,
-                    Message=f"Device offline as of {last_connected_time}. Rule disabled and must be manually re-enabled.", # noqa
-                )
-                events_client.disable_rule(
-                    Name=rule_name
-                )
+            seconds = (datetime.datetime.now() - last_connected_time).total_seconds()
+            LOGGER.info(f"{device_name} disconnected for {seconds} seconds")
+            if seconds <= MAX_SECONDS_DELTA:
+                continue
+            offline.append(device_name)
+            # the flag is dropped when the next lifecycle event
+            # replaces the item
+            if "offline_notified" in device:
+                continue
+            sns_client = boto3.client("sns")
+            sns_client.publish(
+                TopicArn=sns_topic_arn,
+                Message=f"{device_name} offline as of {last_connected_time}.",
+            )
+            dynamo_client.update_item(
+                TableName=table_name,
+                Key={"device_name": {"S": device_name}},
+                UpdateExpression="SET offline_notified = :true",
+                ExpressionAttributeValues={":true": {"BOOL": True}},
+            )
+
+        if devices and len(offline) == len(devices):
+            events_client = boto3.client("events")
+            sns_client = boto3.client("sns")
+            sns_client.publish(
+                TopicArn=sns_topic_arn,
+                Message="All devices offline. Rule disabled and must be manually re-enabled.",  # noqa
+            )
+            events_client.disable_rule(Name=rule_name)
 
     except Exception as ex:
         LOGGER.error(ex, exc_info=True)
@@ -12,16 +12,24 @@ from aws_cdk import (
     aws_iot,
     aws_iam,
     aws_sns,
+    aws_sqs,
     aws_events,
     aws_events_targets,
+    aws_lambda_event_sources,
 )
 import os
 
+from backend.layer.infrastructure import SharedLayer
+from backend.stack_helpers.packaging import function_code
+
 BASE_FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 
+# Days presence events are kept in the history table
+HISTORY_RETENTION_DAYS = 90
+
 
 class IOT(Construct):
-    def __init__(self, scope: Construct, id_: str):
+    def __init__(self, scope: Construct, id_: str, shared_layer: SharedLayer):
         super().__init__(scope, id_)
 
         # TODO: fill in details
@@ -63,9 +71,13 @@ class IOT(Construct):
             function_name="Device-Control",
             handler="lambda_handler.main",
             description="Publishes to MQTT topics",
-            code=aws_lambda.Code.from_asset(
-                os.path.join(BASE_FILE_PATH, "device_control")
+            code=function_code(
+                self,
+                "Device-Control",
+                os.path.join(BASE_FILE_PATH, "device_control"),
+                layer_paths=[shared_layer.python_path],
             ),
+            layers=[shared_layer.layer_version],
             timeout=Duration.minutes(5),
         )
 
@@ -112,7 +124,8 @@ class IOT(Construct):
                     aws_iot.CfnTopicRule.ActionProperty(
                         dynamo_db=aws_iot.CfnTopicRule.DynamoDBActionProperty(
                             hash_key_field="device_name",
-                            hash_key_value="esp32c3_photo_frame",
+                            # one item per device, keyed by its client id
+                            hash_key_value="${topic(5)}",
                             role_arn=iot_role.role_arn,
                             table_name=iot_table.table_name,
                         ),
@@ -121,3 +134,90 @@ class IOT(Construct):
                 sql="SELECT * as event, timestamp, version, topic(4) as eventType, topic(5) as clientId FROM '$aws/events/presence/+/+' WHERE topic(4) = 'connected' or topic(4) = 'disconnected'",  # noqa
             ),
         )
+
+        # every lifecycle event, keyed by device and time. The stream
+        # only orders the records of a key, so a device's events
+        # share one to reach the rollups in order.
+        history_table = aws_dynamodb.Table(
+            self,
+            "PresenceHistoryTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="device_name", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="timestamp", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            stream=aws_dynamodb.StreamViewType.NEW_IMAGE,
+        )
+        history_table.grant_write_data(iot_role)
+
+        aws_iot.CfnTopicRule(
+            self,
+            "PresenceHistory",
+            topic_rule_payload=aws_iot.CfnTopicRule.TopicRulePayloadProperty(
+                actions=[
+                    aws_iot.CfnTopicRule.ActionProperty(
+                        dynamo_d_bv2=aws_iot.CfnTopicRule.DynamoDBv2ActionProperty(
+                            put_item=aws_iot.CfnTopicRule.PutItemInputProperty(
+                                table_name=history_table.table_name
+                            ),
+                            role_arn=iot_role.role_arn,
+                        ),
+                    )
+                ],
+                sql=f"SELECT timestamp, topic(5) as device_name, topic(4) as eventType, disconnectReason, floor(timestamp / 1000) + {HISTORY_RETENTION_DAYS * 24 * 60 * 60} as expires_at FROM '$aws/events/presence/+/+' WHERE topic(4) = 'connected' or topic(4) = 'disconnected'",  # noqa
+            ),
+        )
+
+        # hourly and daily uptime and disconnects per device,
+        # plus the current state of each device
+        rollup_table = aws_dynamodb.Table(
+            self,
+            "PresenceRollupTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="device", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="period", type=aws_dynamodb.AttributeType.STRING
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+        )
+
+        presence_rollup_fn = aws_lambda.Function(
+            self,
+            "PresenceRollup",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            environment={"ROLLUP_TABLE_NAME": rollup_table.table_name},
+            function_name="Presence-rollup",
+            handler="lambda_handler.main",
+            description="Rolls presence events up into uptime per hour and day",
+            code=function_code(
+                self,
+                "Presence-rollup",
+                os.path.join(BASE_FILE_PATH, "presence_rollup"),
+                layer_paths=[shared_layer.python_path],
+            ),
+            layers=[shared_layer.layer_version],
+            timeout=Duration.minutes(1),
+        )
+        rollup_table.grant_read_write_data(presence_rollup_fn.role)
+        # records that still fail after the retries, to replay
+        # once the cause is fixed
+        rollup_failures = aws_sqs.Queue(
+            self,
+            "PresenceRollupFailures",
+            retention_period=Duration.days(14),
+        )
+        presence_rollup_fn.add_event_source(
+            aws_lambda_event_sources.DynamoEventSource(
+                history_table,
+                starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                batch_size=100,
+                bisect_batch_on_error=True,
+                retry_attempts=3,
+                on_failure=aws_lambda_event_sources.SqsDlq(rollup_failures),
+            )
+        )
@@ -0,0 +1,202 @@
+from typing import Any, Dict, List, Optional
+import json
+import os
+import random
+import time
+import boto3
+from botocore.exceptions import ClientError
+from photo_frame_common.logger import get_logger
+from rollup import (
+    FLEET_DEVICE,
+    DeviceState,
+    PresenceEvent,
+    Rollups,
+    apply_event,
+    apply_fleet,
+)
+
+LOGGER = get_logger()
+
+STATE_PERIOD = "state"
+# Counters queued for the fleet are kept under fleet#<since_ms>
+QUEUED_PREFIX = "fleet#"
+# Concurrent batches adding to the same fleet items cancel
+# each other's transactions, which are retried with backoff
+FLEET_WRITE_ATTEMPTS = 5
+# Hourly rollups expire this long after their last update,
+# daily rollups are kept
+HOURLY_RETENTION_SECONDS = 60 * 60 * 24 * 35
+
+
+class DynamoRollupStore:
+    """
+    Rollup table keyed by device and period, with one state
+    item per device under the "state" period. The state, the
+    counters of an event and its fleet queue entry are written
+    in one transaction.
+    """
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb")
+
+    def get_state(self, device: str) -> Optional[DeviceState]:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={"device": {"S": device}, "period": {"S": STATE_PERIOD}},
+            ConsistentRead=True,
+        ).get("Item")
+        if not item:
+            return None
+        return DeviceState(
+            status=item["status"]["S"], since_ms=int(item["since_ms"]["N"])
+        )
+
+    def apply(
+        self,
+        device: str,
+        previous: Optional[DeviceState],
+        state: DeviceState,
+        rollups: Rollups,
+    ) -> bool:
+        items = [
+            {"Put": self.state_put(device, previous, state)},
+            {
+                "Put": {
+                    "TableName": self.table_name,
+                    "Item": {
+                        "device": {"S": device},
+                        "period": {"S": f"{QUEUED_PREFIX}{state.since_ms}"},
+                        "rollups": {"S": json.dumps(rollups)},
+                    },
+                }
+            },
+        ]
+        for period, counters in rollups.items():
+            items.append({"Update": self.rollup_update(device, period, counters)})
+        try:
+            self.client.transact_write_items(TransactItems=items)
+            return True
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            # reasons are listed in item order, the state comes first
+            reasons = ex.response.get("CancellationReasons") or [{}]
+            if reasons[0].get("Code") == "ConditionalCheckFailed":
+                return False
+            raise
+
+    def queued_fleet(self, device: str) -> Dict[int, Rollups]:
+        pages = self.client.get_paginator("query").paginate(
+            TableName=self.table_name,
+            KeyConditionExpression="device = :device AND begins_with(period, :prefix)",
+            ExpressionAttributeValues={
+                ":device": {"S": device},
+                ":prefix": {"S": QUEUED_PREFIX},
+            },
+            ConsistentRead=True,
+        )
+        return {
+            int(item["period"]["S"][len(QUEUED_PREFIX) :]): json.loads(
+                item["rollups"]["S"]
+            )
+            for page in pages
+            for item in page["Items"]
+        }
+
+    def apply_fleet(self, queued: Dict[str, List[int]], rollups: Rollups):
+        items: List[Dict] = [
+            {
+                "Delete": {
+                    "TableName": self.table_name,
+                    "Key": {
+                        "device": {"S": device},
+                        "period": {"S": f"{QUEUED_PREFIX}{queued_ms}"},
+                    },
+                    "ConditionExpression": "attribute_exists(device)",
+                }
+            }
+            for device, entries in queued.items()
+            for queued_ms in entries
+        ]
+        for period, counters in rollups.items():
+            items.append({"Update": self.rollup_update(FLEET_DEVICE, period, counters)})
+        for attempt in range(1, FLEET_WRITE_ATTEMPTS + 1):
+            try:
+                self.client.transact_write_items(TransactItems=items)
+                return
+            except ClientError as ex:
+                reasons = ex.response.get("CancellationReasons") or []
+                conflict = any(
+                    reason.get("Code") == "TransactionConflict" for reason in reasons
+                )
+                if not conflict or attempt == FLEET_WRITE_ATTEMPTS:
+                    raise
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+
+    def state_put(
+        self, device: str, previous: Optional[DeviceState], state: DeviceState
+    ) -> Dict:
+        if previous:
+            condition = {
+                "ConditionExpression": "since_ms = :previous",
+                "ExpressionAttributeValues": {
+                    ":previous": {"N": str(previous.since_ms)}
+                },
+            }
+        else:
+            condition = {"ConditionExpression": "attribute_not_exists(device)"}
+        return {
+            "TableName": self.table_name,
+            "Item": {
+                "device": {"S": device},
+                "period": {"S": STATE_PERIOD},
+                "status": {"S": state.status},
+                "since_ms": {"N": str(state.since_ms)},
+            },
+            **condition,
+        }
+
+    def rollup_update(self, device: str, period: str, counters: Dict[str, float]):
+        names = {f"#c{i}": name for i, name in enumerate(counters)}
+        values = {
+            f":c{i}": {"N": str(value)} for i, value in enumerate(counters.values())
+        }
+        update = "ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(counters)))
+        if period.startswith("hour#"):
+            names["#expires_at"] = "expires_at"
+            values[":expires_at"] = {
+                "N": str(int(time.time()) + HOURLY_RETENTION_SECONDS)
+            }
+            update += " SET #expires_at = :expires_at"
+        return {
+            "TableName": self.table_name,
+            "Key": {"device": {"S": device}, "period": {"S": period}},
+            "UpdateExpression": update,
+            "ExpressionAttributeNames": names,
+            "ExpressionAttributeValues": values,
+        }
+
+
+def main(event: Dict, context: Any):
+    """
+    Invoked by the presence history table stream. Every
+    appended lifecycle event is applied to the hourly and
+    daily rollups of its device, then the batch is added to
+    the fleet's. History items removed by TTL are ignored.
+    """
+    store = DynamoRollupStore(os.environ["ROLLUP_TABLE_NAME"])
+    devices: Dict[str, None] = {}
+    for record in event["Records"]:
+        if record["eventName"] != "INSERT":
+            continue
+        image = record["dynamodb"]["NewImage"]
+        presence_event = PresenceEvent(
+            device=image["device_name"]["S"],
+            event_type=image["eventType"]["S"],
+            timestamp_ms=int(image["timestamp"]["N"]),
+        )
+        devices[presence_event.device] = None
+        if not apply_event(store, presence_event):
+            LOGGER.info(f"Skipped {presence_event}")
+    apply_fleet(store, devices)
@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol, Tuple
+
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+# Counters are also added to this device, so fleet-wide
+# health is read from one item per period
+FLEET_DEVICE = "_fleet"
+# Items in a DynamoDB transaction
+TRANSACTION_ITEMS = 100
+# Longer sessions are rolled up in chunks, which keeps each
+# write within the items of a transaction
+SESSION_CHUNK_MS = 24 * HOUR_MS
+
+
+@dataclass
+class PresenceEvent:
+    device: str
+    event_type: str
+    timestamp_ms: int
+
+
+@dataclass
+class DeviceState:
+    # Type and time of the last event applied to the rollups
+    status: str
+    since_ms: int
+
+
+# Counters keyed by period
+Rollups = Dict[str, Dict[str, float]]
+
+
+class RollupStore(Protocol):
+    def get_state(self, device: str) -> Optional[DeviceState]:
+        ...
+
+    def apply(
+        self,
+        device: str,
+        previous: Optional[DeviceState],
+        state: DeviceState,
+        rollups: Rollups,
+    ) -> bool:
+        """
+        Replaces the device state if it still is ``previous``, adds
+        the counters to the device's rollups and queues them for the
+        fleet under the new state's since_ms, all or nothing. Returns
+        False if another event got there first.
+        """
+        ...
+
+    def queued_fleet(self, device: str) -> Dict[int, Rollups]:
+        """Returns the counters the device queued for the fleet."""
+        ...
+
+    def apply_fleet(self, queued: Dict[str, List[int]], rollups: Rollups):
+        """
+        Adds the counters to the fleet rollups and dequeues the
+        entries of each device, all or nothing. Raises if an entry
+        is no longer queued.
+        """
+        ...
+
+
+def period_key(period_ms: int, start_ms: int) -> str:
+    """hour#2022-10-19T13 or day#2022-10-19, sortable within a device."""
+    start = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc)
+    if period_ms == HOUR_MS:
+        return f"hour#{start:%Y-%m-%dT%H}"
+    return f"day#{start:%Y-%m-%d}"
+
+
+def split_interval(
+    start_ms: int, end_ms: int, period_ms: int
+) -> Iterator[Tuple[int, int]]:
+    """
+    Splits [start_ms, end_ms) on period boundaries.
+
+    returns:
+    (period start, milliseconds of the interval in that period)
+    """
+    while start_ms < end_ms:
+        period_start = start_ms - start_ms % period_ms
+        period_end = min(period_start + period_ms, end_ms)
+        yield period_start, period_end - start_ms
+        start_ms = period_end
+
+
+def uptime_deltas(start_ms: int, end_ms: int) -> Dict[str, Dict[str, float]]:
+    """Returns the uptime of [start_ms, end_ms) in each hourly and daily period."""
+    deltas: Dict[str, Dict[str, float]] = {}
+    for period_ms in (HOUR_MS, DAY_MS):
+        for start, duration_ms in split_interval(start_ms, end_ms, period_ms):
+            deltas[period_key(period_ms, start)] = {"uptime_s": duration_ms / 1000}
+    return deltas
+
+
+def rollup_deltas(
+    state: Optional[DeviceState], event: PresenceEvent
+) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the counters an event adds to each hourly and daily
+    period. The uptime of a session is added when the event
+    after its connect arrives, so the current session of a
+    connected device is read from its state.
+    """
+    deltas: Dict[str, Dict[str, float]] = {}
+    if state and state.status == CONNECTED:
+        deltas = uptime_deltas(state.since_ms, event.timestamp_ms)
+    counter = "disconnects" if event.event_type == DISCONNECTED else "connects"
+    for period_ms in (HOUR_MS, DAY_MS):
+        counters = deltas.setdefault(period_key(period_ms, event.timestamp_ms), {})
+        counters[counter] = counters.get(counter, 0) + 1
+    return deltas
+
+
+def add_rollups(total: Rollups, rollups: Rollups):
+    for period, counters in rollups.items():
+        total_counters = total.setdefault(period, {})
+        for name, value in counters.items():
+            total_counters[name] = total_counters.get(name, 0) + value
+
+
+def apply_event(store: RollupStore, event: PresenceEvent) -> bool:
+    """
+    Applies a presence event to the rollups of its device and
+    queues its counters for the fleet, see apply_fleet. Events
+    older than the device state, i.e. retried or delivered out
+    of order, are skipped. The state and the counters are
+    written together, so a failure part way never loses or
+    counts an event twice.
+
+    The uptime of sessions longer than SESSION_CHUNK_MS is added
+    a chunk at a time, each one moving the start of the session
+    forward, so a failed chunk is resumed by the retried event.
+
+    returns:
+    bool - False if the event was skipped
+    """
+    if event.event_type not in (CONNECTED, DISCONNECTED):
+        return False
+    state = store.get_state(event.device)
+    if state and state.since_ms >= event.timestamp_ms:
+        return False
+    while state and state.status == CONNECTED:
+        chunk_end = state.since_ms - state.since_ms % HOUR_MS + SESSION_CHUNK_MS
+        if chunk_end >= event.timestamp_ms:
+            break
+        chunk_state = DeviceState(status=CONNECTED, since_ms=chunk_end)
+        deltas = uptime_deltas(state.since_ms, chunk_end)
+        if not store.apply(event.device, state, chunk_state, deltas):
+            return False
+        state = chunk_state
+    new_state = DeviceState(status=event.event_type, since_ms=event.timestamp_ms)
+    return store.apply(event.device, state, new_state, rollup_deltas(state, event))
+
+
+def apply_fleet(store: RollupStore, devices: Iterable[str]):
+    """
+    Adds the counters queued by the devices' events to the fleet
+    rollups. The events of a batch are added together, so
+    concurrent batches contend for the fleet items once instead
+    of once per event. Entries are dequeued in the write that
+    adds them, so a retried batch adds whatever an earlier
+    attempt left, even for events it skips.
+    """
+    queued: Dict[str, List[int]] = {}
+    rollups: Rollups = {}
+    for device in devices:
+        for queued_ms, deltas in sorted(store.queued_fleet(device).items()):
+            # a delete per entry and an update per period
+            items = sum(map(len, queued.values())) + 1
+            if queued and items + len(rollups.keys() | deltas.keys()) > (
+                TRANSACTION_ITEMS
+            ):
+                store.apply_fleet(queued, rollups)
+                queued, rollups = {}, {}
+            queued.setdefault(device, []).append(queued_ms)
+            add_rollups(rollups, deltas)
+    if queued:
+        store.apply_fleet(queued, rollups)
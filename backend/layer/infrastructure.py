@@ -0,0 +1,37 @@
+import os
+
+from aws_cdk import aws_lambda, RemovalPolicy
+from constructs import Construct
+
+from backend.stack_helpers.packaging import get_bundle, report_bundle
+
+
+BASE_FILE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+class SharedLayer(Construct):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        runtime: aws_lambda.Runtime = aws_lambda.Runtime.PYTHON_3_9,
+    ):
+        super().__init__(scope, id_)
+
+        # Runtime code shared by every function, importable from /opt/python
+        bundle = get_bundle(os.path.join(BASE_FILE_PATH, "shared"), runtime)
+        report_bundle(self, "SharedLayer", bundle)
+
+        # Directory to add to sys.path when importing handlers locally
+        self.python_path = os.path.join(bundle.path, "python")
+
+        self.layer_version = aws_lambda.LayerVersion(
+            self,
+            "SharedLayerVersion",
+            layer_version_name="photo-frame-shared",
+            description=f"Shared Photo Frame runtime code ({bundle.digest[:12]})",
+            code=aws_lambda.Code.from_asset(bundle.path),
+            compatible_runtimes=[runtime],
+            # keep previous versions for functions that still reference them
+            removal_policy=RemovalPolicy.RETAIN,
+        )
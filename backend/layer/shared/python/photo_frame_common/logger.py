@@ -0,0 +1,12 @@
+import logging
+import os
+
+
+def get_logger() -> logging.Logger:
+    """
+    Returns the root logger configured from
+    the LOG_LEVEL environment variable.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO")))
+    return logger
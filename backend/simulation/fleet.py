@@ -0,0 +1,585 @@
+"""
+Local load simulator for the photo frame request path.
+
+Drives a fleet of virtual frames through
+API Gateway -> authorizer -> image handler (and optionally the
+scheduled MQTT notify path) using asyncio and in-process
+stand-ins for the AWS services. Service latencies are drawn
+from log-normal distributions, and each Lambda function is
+modelled as a pool of execution environments with cold starts,
+idle reclamation and concurrency limits.
+
+The simulation runs on a virtual clock: the event loop jumps
+straight to the next scheduled wake-up instead of waiting for
+it, so an hour of traffic takes as long as its events take to
+process, and runs with the same ``seed`` give the same results
+whatever the host.
+
+Usage:
+    python -m backend.simulation.fleet --devices 500 --duration 3600
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import selectors
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Lambda synchronous response payload limit
+MAX_RESPONSE_BYTES = 6 * 1024 * 1024
+# Memory at which a function is allocated one full vCPU
+FULL_VCPU_MEMORY_MB = 1769
+# Peak memory of the handler relative to the image size
+# (raw bytes + base64 copy + decoded str), as measured by
+# backend.simulation.streaming_benchmark
+BUFFERED_MEMORY_FACTOR = 3.67
+# Response streaming limits, bandwidth is capped after the first 6 MB
+MAX_STREAM_BYTES = 20 * 1024 * 1024
+STREAM_UNCAPPED_BYTES = 6 * 1024 * 1024
+STREAM_CAPPED_MB_S = 2.0
+# Bytes buffered by the streaming handler
+STREAM_CHUNK_MB = 64 / 1024
+# Keys returned per ListObjectsV2 page
+LIST_PAGE_SIZE = 1000
+
+
+class Throttled(Exception):
+    pass
+
+
+@dataclass
+class LatencyModel:
+    """Log-normal latency in milliseconds."""
+
+    median_ms: float
+    sigma: float = 0.35
+
+    def sample(self, rng: random.Random) -> float:
+        return self.median_ms * math.exp(self.sigma * rng.gauss(0, 1))
+
+
+@dataclass
+class ServiceLatencies:
+    api_gateway: LatencyModel = field(default_factory=lambda: LatencyModel(12))
+    http_api: LatencyModel = field(default_factory=lambda: LatencyModel(6))
+    cloudfront: LatencyModel = field(default_factory=lambda: LatencyModel(10))
+    function_url: LatencyModel = field(default_factory=lambda: LatencyModel(5))
+    boto3_client: LatencyModel = field(default_factory=lambda: LatencyModel(8))
+    secrets_manager: LatencyModel = field(default_factory=lambda: LatencyModel(20))
+    s3_list: LatencyModel = field(default_factory=lambda: LatencyModel(35))
+    s3_get_first_byte: LatencyModel = field(default_factory=lambda: LatencyModel(25))
+    dynamodb: LatencyModel = field(default_factory=lambda: LatencyModel(6))
+    iot_publish: LatencyModel = field(default_factory=lambda: LatencyModel(15))
+    mqtt_delivery: LatencyModel = field(default_factory=lambda: LatencyModel(80, 0.6))
+    # S3 download rate with a full vCPU, in MB/s
+    s3_throughput_mb_s: float = 80.0
+    # base64 encode rate with a full vCPU, in MB/s
+    base64_mb_s: float = 400.0
+
+
+@dataclass
+class FunctionConfig:
+    name: str
+    memory_mb: int = 128
+    timeout_s: float = 300
+    reserved_concurrency: Optional[int] = None
+    cold_start: LatencyModel = field(default_factory=lambda: LatencyModel(300, 0.25))
+    # Seconds an idle execution environment is kept warm
+    idle_timeout_s: float = 600
+    # Resident memory of the runtime before any image is loaded
+    baseline_memory_mb: float = 45
+
+    @property
+    def cpu_share(self) -> float:
+        return min(1.0, self.memory_mb / FULL_VCPU_MEMORY_MB)
+
+
+@dataclass
+class SimulationConfig:
+    """Mirrors the settings of the API and IOT constructs."""
+
+    devices: int = 100
+    # "rest" (API Gateway v1) or "http" (CloudFront + API Gateway v2)
+    api_mode: str = "rest"
+    # Stream images through the function URL instead of the API
+    streaming: bool = False
+    duration_s: float = 3600
+    # Seconds between image fetches of a single frame
+    request_interval_s: float = 900
+    # Drive fetches from the scheduled MQTT notification
+    # instead of independent polling
+    notify: bool = False
+    notify_interval_s: float = 900
+    images: int = 50
+    # Pick images from the album index, False models the
+    # previous ListObjectsV2 scan of the public/ prefix
+    album_index: bool = True
+    image_size_kb: LatencyModel = field(default_factory=lambda: LatencyModel(250, 0.5))
+    # Authorizer result cache TTL, 0 disables caching
+    authorizer_cache_ttl_s: float = 300
+    # Devices share a single x-api-token
+    shared_token: bool = True
+    # API stage throttle, None disables it
+    stage_rate_limit: Optional[float] = None
+    stage_burst_limit: int = 0
+    account_concurrency: int = 1000
+    authorizer: FunctionConfig = field(
+        default_factory=lambda: FunctionConfig("API-Authorizer")
+    )
+    image_handler: FunctionConfig = field(
+        default_factory=lambda: FunctionConfig("Photo-handler")
+    )
+    device_control: FunctionConfig = field(
+        default_factory=lambda: FunctionConfig("Device-Control")
+    )
+    latencies: ServiceLatencies = field(default_factory=ServiceLatencies)
+    seed: Optional[int] = None
+
+
+@dataclass
+class FunctionReport:
+    invocations: int = 0
+    cold_starts: int = 0
+    throttles: int = 0
+    peak_concurrency: int = 0
+    # Time-averaged environments in use
+    mean_concurrency: float = 0.0
+    # Init and handler duration per invocation
+    mean_duration_ms: float = 0.0
+    gb_seconds: float = 0.0
+
+
+@dataclass
+class SimulationReport:
+    requests: int
+    succeeded: int
+    throttled: int
+    errors: int
+    throughput_rps: float
+    latency_ms: Dict[str, float]
+    functions: Dict[str, FunctionReport]
+    s3_requests: Dict[str, int]
+    dynamodb_requests: Dict[str, int]
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """
+    Polls without blocking and moves the loop's clock forward by
+    the time it would have waited for the next timer.
+    """
+
+    def __init__(self, loop: "VirtualTimeLoop"):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: Optional[float] = None):
+        if timeout:
+            self._loop.advance(timeout)
+        return super().select(0)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time only moves when every coroutine waits."""
+
+    def __init__(self):
+        self._virtual_time = 0.0
+        super().__init__(selector=_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        self._virtual_time += seconds
+
+
+class SimClock:
+    """Simulated clock shared by every coroutine of a simulation."""
+
+    def __init__(self):
+        self._start = asyncio.get_running_loop().time()
+
+    def now_ms(self) -> float:
+        return (asyncio.get_running_loop().time() - self._start) * 1000
+
+    async def sleep(self, ms: float) -> float:
+        await asyncio.sleep(ms / 1000)
+        return ms
+
+
+class TokenBucket:
+    """API Gateway stage throttle."""
+
+    def __init__(self, clock: SimClock, rate: float, burst: int):
+        self._clock = clock
+        self._rate = rate
+        self._capacity = max(burst, 1)
+        self._tokens = float(self._capacity)
+        self._updated_ms = clock.now_ms()
+
+    def take(self) -> bool:
+        now = self._clock.now_ms()
+        elapsed_s = (now - self._updated_ms) / 1000
+        self._tokens = min(self._capacity, self._tokens + elapsed_s * self._rate)
+        self._updated_ms = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class Account:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+
+
+class LambdaPool:
+    """Execution environments of a single Lambda function."""
+
+    def __init__(
+        self,
+        config: FunctionConfig,
+        clock: SimClock,
+        account: Account,
+        rng: random.Random,
+    ):
+        self.config = config
+        self.report = FunctionReport()
+        self._clock = clock
+        self._account = account
+        self._rng = rng
+        self._idle_since: List[float] = []
+        self._busy = 0
+        self._busy_since_ms = 0.0
+        self._busy_ms = 0.0
+        self._duration_ms = 0.0
+
+    def _acquire(self) -> bool:
+        """Reserve an environment, returns True on a cold start."""
+        limit = self.config.reserved_concurrency
+        if (limit is not None and self._busy >= limit) or (
+            self._account.in_flight >= self._account.limit
+        ):
+            self.report.throttles += 1
+            raise Throttled(self.config.name)
+
+        now = self._clock.now_ms()
+        keep_warm_ms = self.config.idle_timeout_s * 1000
+        self._idle_since = [t for t in self._idle_since if now - t < keep_warm_ms]
+
+        self._track_busy()
+        self._busy += 1
+        self._account.in_flight += 1
+        self.report.invocations += 1
+        self.report.peak_concurrency = max(self.report.peak_concurrency, self._busy)
+        if self._idle_since:
+            self._idle_since.pop()
+            return False
+        self.report.cold_starts += 1
+        return True
+
+    def _track_busy(self):
+        now = self._clock.now_ms()
+        self._busy_ms += self._busy * (now - self._busy_since_ms)
+        self._busy_since_ms = now
+
+    def _release(self):
+        self._track_busy()
+        self._busy -= 1
+        self._account.in_flight -= 1
+        self._idle_since.append(self._clock.now_ms())
+
+    async def invoke(
+        self, work: Callable[["LambdaPool"], Awaitable[Tuple[float, bool]]]
+    ) -> Tuple[float, bool]:
+        """
+        Runs ``work`` inside an execution environment.
+
+        ``work`` returns the handler duration in milliseconds and
+        whether it succeeded. The returned latency includes the
+        init phase on a cold start.
+        """
+        cold = self._acquire()
+        try:
+            init_ms = 0.0
+            if cold:
+                init_ms = await self._clock.sleep(
+                    self.config.cold_start.sample(self._rng)
+                )
+            duration_ms, ok = await work(self)
+            duration_ms = min(duration_ms, self.config.timeout_s * 1000)
+            # the init phase is billed along with the handler, rounded
+            # up to the nearest millisecond
+            self.report.gb_seconds += (
+                self.config.memory_mb / 1024 * math.ceil(init_ms + duration_ms) / 1000
+            )
+            self._duration_ms += init_ms + duration_ms
+            return init_ms + duration_ms, ok
+        finally:
+            self._release()
+
+    def finish(self, elapsed_ms: float) -> FunctionReport:
+        self._track_busy()
+        self.report.mean_concurrency = self._busy_ms / elapsed_ms
+        if self.report.invocations:
+            self.report.mean_duration_ms = self._duration_ms / self.report.invocations
+        return self.report
+
+
+class FleetSimulation:
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._latencies: List[float] = []
+        self._throttled = 0
+        self._errors = 0
+        self._s3_requests = {"LIST": 0, "GET": 0}
+        self._dynamodb_requests = {"QUERY": 0}
+        self._authorizer_cache: Dict[str, float] = {}
+
+    def _sample(self, model: LatencyModel) -> float:
+        return model.sample(self._rng)
+
+    async def _step(self, model: LatencyModel) -> float:
+        return await self._clock.sleep(self._sample(model))
+
+    async def _authorize(self, pool: LambdaPool) -> Tuple[float, bool]:
+        lat = self.config.latencies
+        elapsed = await self._step(lat.boto3_client)
+        elapsed += await self._step(lat.secrets_manager)
+        return elapsed, True
+
+    async def _get_image(self, pool: LambdaPool) -> Tuple[float, bool]:
+        lat = self.config.latencies
+        cpu = pool.config.cpu_share
+        elapsed = await self._step(lat.boto3_client)
+
+        if self.config.album_index:
+            # one single item query, a second one when the random
+            # start point is after the last entry
+            queries = 1 + (self._rng.random() < 1 / (self.config.images + 1))
+            for _ in range(queries):
+                self._dynamodb_requests["QUERY"] += 1
+                elapsed += await self._step(lat.dynamodb)
+        else:
+            for _ in range(max(1, math.ceil(self.config.images / LIST_PAGE_SIZE))):
+                self._s3_requests["LIST"] += 1
+                elapsed += await self._step(lat.s3_list)
+
+        size_mb = self._sample(self.config.image_size_kb) / 1024
+        self._s3_requests["GET"] += 1
+        elapsed += await self._step(lat.s3_get_first_byte)
+        transfer_ms = size_mb / (lat.s3_throughput_mb_s * max(cpu, 0.25)) * 1000
+
+        if self.config.streaming:
+            size_bytes = size_mb * 1024 * 1024
+            capped_mb = max(0, size_bytes - STREAM_UNCAPPED_BYTES) / (1024 * 1024)
+            transfer_ms = max(transfer_ms, capped_mb / STREAM_CAPPED_MB_S * 1000)
+            elapsed += await self._clock.sleep(transfer_ms)
+            peak_mb = pool.config.baseline_memory_mb + STREAM_CHUNK_MB
+            ok = peak_mb <= pool.config.memory_mb and size_bytes <= MAX_STREAM_BYTES
+            return elapsed, ok
+
+        elapsed += await self._clock.sleep(transfer_ms)
+        peak_mb = pool.config.baseline_memory_mb + BUFFERED_MEMORY_FACTOR * size_mb
+        if peak_mb > pool.config.memory_mb:
+            # runtime is killed when it exceeds its memory size
+            return elapsed, False
+        elapsed += await self._clock.sleep(size_mb / (lat.base64_mb_s * cpu) * 1000)
+        response_bytes = math.ceil(size_mb * 1024 * 1024 / 3) * 4
+        return elapsed, response_bytes <= MAX_RESPONSE_BYTES
+
+    def _authorizer_cached(self, token: str) -> bool:
+        ttl_ms = self.config.authorizer_cache_ttl_s * 1000
+        cached_at = self._authorizer_cache.get(token)
+        return cached_at is not None and self._clock.now_ms() - cached_at < ttl_ms
+
+    async def request_image(self, device: int):
+        lat = self.config.latencies
+        token = "shared" if self.config.shared_token else str(device)
+        # the streaming function checks the token itself against a
+        # cached secret, and function URLs have no stage throttle
+        streaming = self.config.streaming
+        if streaming:
+            latency = self._sample(lat.function_url)
+        elif self.config.api_mode == "http":
+            latency = self._sample(lat.cloudfront) + self._sample(lat.http_api)
+        else:
+            latency = self._sample(lat.api_gateway)
+        if not streaming and self._stage_throttle and not self._stage_throttle.take():
+            self._throttled += 1
+            return
+        try:
+            if not streaming and not self._authorizer_cached(token):
+                auth_ms, _ = await self._authorizer_pool.invoke(self._authorize)
+                latency += auth_ms
+                self._authorizer_cache[token] = self._clock.now_ms()
+            handler_ms, ok = await self._image_pool.invoke(self._get_image)
+            latency += handler_ms
+        except Throttled:
+            self._throttled += 1
+            return
+        if ok:
+            self._latencies.append(latency)
+        else:
+            self._errors += 1
+
+    async def _device_control(self, pool: LambdaPool) -> Tuple[float, bool]:
+        lat = self.config.latencies
+        elapsed = await self._step(lat.boto3_client)
+        elapsed += await self._step(lat.dynamodb)
+        elapsed += await self._step(lat.boto3_client)
+        elapsed += await self._step(lat.iot_publish)
+        return elapsed, True
+
+    async def _poll(self, device: int, end_ms: float):
+        interval_ms = self.config.request_interval_s * 1000
+        await self._clock.sleep(self._rng.uniform(0, interval_ms))
+        tasks = []
+        while self._clock.now_ms() < end_ms:
+            tasks.append(asyncio.ensure_future(self.request_image(device)))
+            await self._clock.sleep(interval_ms)
+        await asyncio.gather(*tasks)
+
+    async def _notify(self, end_ms: float):
+        async def deliver(device: int):
+            await self._step(self.config.latencies.mqtt_delivery)
+            await self.request_image(device)
+
+        tasks = []
+        while self._clock.now_ms() < end_ms:
+            try:
+                await self._device_control_pool.invoke(self._device_control)
+            except Throttled:
+                pass
+            else:
+                tasks.extend(
+                    asyncio.ensure_future(deliver(device))
+                    for device in range(self.config.devices)
+                )
+            await self._clock.sleep(self.config.notify_interval_s * 1000)
+        await asyncio.gather(*tasks)
+
+    async def run(self) -> SimulationReport:
+        config = self.config
+        self._clock = SimClock()
+        account = Account(config.account_concurrency)
+        self._stage_throttle = None
+        if config.stage_rate_limit is not None:
+            self._stage_throttle = TokenBucket(
+                self._clock, config.stage_rate_limit, config.stage_burst_limit
+            )
+        self._authorizer_pool = LambdaPool(
+            config.authorizer, self._clock, account, self._rng
+        )
+        self._image_pool = LambdaPool(
+            config.image_handler, self._clock, account, self._rng
+        )
+        self._device_control_pool = LambdaPool(
+            config.device_control, self._clock, account, self._rng
+        )
+
+        end_ms = config.duration_s * 1000
+        if config.notify:
+            await self._notify(end_ms)
+        else:
+            await asyncio.gather(
+                *(self._poll(device, end_ms) for device in range(config.devices))
+            )
+        return self._report(max(self._clock.now_ms(), end_ms))
+
+    def _report(self, elapsed_ms: float) -> SimulationReport:
+        latencies = sorted(self._latencies)
+        pools = [self._authorizer_pool, self._image_pool]
+        if self.config.notify:
+            pools.append(self._device_control_pool)
+        return SimulationReport(
+            requests=len(latencies) + self._throttled + self._errors,
+            succeeded=len(latencies),
+            throttled=self._throttled,
+            errors=self._errors,
+            throughput_rps=len(latencies) / (elapsed_ms / 1000),
+            latency_ms={
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else 0.0,
+            },
+            functions={pool.config.name: pool.finish(elapsed_ms) for pool in pools},
+            s3_requests=dict(self._s3_requests),
+            dynamodb_requests=dict(self._dynamodb_requests),
+        )
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def simulate(config: SimulationConfig) -> SimulationReport:
+    loop = VirtualTimeLoop()
+    try:
+        return loop.run_until_complete(FleetSimulation(config).run())
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=3600, help="seconds")
+    parser.add_argument("--interval", type=float, default=900, help="seconds")
+    parser.add_argument("--api-mode", choices=["rest", "http"], default="rest")
+    parser.add_argument("--notify", action="store_true")
+    parser.add_argument(
+        "--streaming", action="store_true", help="stream through the function URL"
+    )
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--image-size-kb", type=float, default=250)
+    parser.add_argument(
+        "--list-bucket", action="store_true", help="list images instead of the index"
+    )
+    parser.add_argument("--memory", type=int, default=128, help="image handler MB")
+    parser.add_argument("--reserved-concurrency", type=int, default=None)
+    parser.add_argument("--account-concurrency", type=int, default=1000)
+    parser.add_argument("--rate-limit", type=float, default=None, help="stage rps")
+    parser.add_argument("--burst-limit", type=int, default=0, help="stage burst")
+    parser.add_argument("--cache-ttl", type=float, default=300, help="seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = SimulationConfig(
+        devices=args.devices,
+        api_mode=args.api_mode,
+        streaming=args.streaming,
+        duration_s=args.duration,
+        request_interval_s=args.interval,
+        notify=args.notify,
+        notify_interval_s=args.interval,
+        images=args.images,
+        album_index=not args.list_bucket,
+        image_size_kb=LatencyModel(args.image_size_kb, 0.5),
+        authorizer_cache_ttl_s=args.cache_ttl,
+        stage_rate_limit=args.rate_limit,
+        stage_burst_limit=args.burst_limit,
+        account_concurrency=args.account_concurrency,
+        image_handler=FunctionConfig(
+            "Photo-handler",
+            memory_mb=args.memory,
+            reserved_concurrency=args.reserved_concurrency,
+        ),
+        seed=args.seed,
+    )
+    print(json.dumps(simulate(config).as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
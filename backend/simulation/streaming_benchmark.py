@@ -0,0 +1,100 @@
+"""
+Peak memory of the buffered and streaming image responses.
+
+The buffered path mirrors the Photo-handler function: the S3
+body is read whole and base64 encoded into the response. The
+streaming path mirrors the Photo-stream-handler function: the
+body is copied to the response in fixed-size chunks. Memory is
+traced with tracemalloc while serving synthetic images of
+growing size.
+
+Usage:
+    python -m backend.simulation.streaming_benchmark --sizes 1 4 16 64
+"""
+import argparse
+import base64
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from backend.api.image_handler.streaming import CHUNK_SIZE, copy_stream
+
+
+class SyntheticBody:
+    """
+    Stands in for an S3 StreamingBody, producing bytes on read
+    without holding the whole object.
+    """
+
+    def __init__(self, size: int):
+        self._remaining = size
+
+    def read(self, amt: int = -1) -> bytes:
+        if amt < 0 or amt > self._remaining:
+            amt = self._remaining
+        self._remaining -= amt
+        return b"\xff" * amt
+
+
+def buffered_response(size: int) -> int:
+    data = SyntheticBody(size).read()
+    body = base64.b64encode(data).decode("utf-8")
+    return len(body)
+
+
+def streaming_response(size: int) -> int:
+    sent = 0
+
+    def write(chunk: bytes):
+        nonlocal sent
+        sent += len(chunk)
+
+    copy_stream(SyntheticBody(size), write)
+    return sent
+
+
+def measure(response: Callable[[int], int], size: int) -> Tuple[float, float]:
+    """Returns the peak traced memory in MB and the elapsed ms."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    response(size)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024), elapsed_ms
+
+
+def run(sizes_mb: List[float]) -> List[dict]:
+    results = []
+    for size_mb in sizes_mb:
+        size = int(size_mb * 1024 * 1024)
+        buffered_mb, buffered_ms = measure(buffered_response, size)
+        streaming_mb, streaming_ms = measure(streaming_response, size)
+        results.append(
+            {
+                "image_mb": size_mb,
+                "buffered_peak_mb": buffered_mb,
+                "buffered_ms": buffered_ms,
+                "streaming_peak_mb": streaming_mb,
+                "streaming_ms": streaming_ms,
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    print(f"chunk size {CHUNK_SIZE // 1024} KiB")
+    print(f"{'image MB':>9} {'buffered peak MB':>17} {'streaming peak MB':>18}")
+    for result in run(args.sizes):
+        print(
+            f"{result['image_mb']:>9.1f} {result['buffered_peak_mb']:>17.2f} "
+            f"{result['streaming_peak_mb']:>18.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Bundling for Lambda function and layer assets.
+
+Sources are copied without tests, caches or dead modules
+and byte-compiled so the runtime does not have to compile
+them on a cold start. Bytecode is written by the runtime's
+own Python version, a local interpreter of that version or
+the runtime's bundling image. A requirements.txt next to the
+sources is installed from wheels built for Lambda, and the
+install is cached by the hash of its requirements. Each
+bundle's zipped size and the import time of its handler
+on the runtime's Python version are reported at synth time.
+"""
+import atexit
+import fnmatch
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from aws_cdk import Annotations, aws_lambda
+from constructs import Construct
+
+# Never shipped in any asset, matched against file and directory names
+EXCLUDE_PATTERNS = [
+    "__pycache__",
+    "*.pyc",
+    ".DS_Store",
+    "*.md",
+    "test",
+    "tests",
+    "test_*.py",
+    "*_test.py",
+    "conftest.py",
+]
+# Never shipped in any asset, matched against paths relative to the source.
+# Function directories are only packages so the repo can import them.
+ROOT_EXCLUDE = ["__init__.py", "requirements.txt"]
+# Platform of the Lambda execution environment for binary wheels
+LAMBDA_PLATFORM = "manylinux2014_x86_64"
+# Installed requirements, shared by every synth and test run
+REQUIREMENTS_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "photo-frame",
+    "requirements",
+)
+
+# Set to 1 to synth without bytecode when no runtime interpreter is available
+NO_BYTECODE_VARIABLE = "PHOTO_FRAME_NO_BYTECODE"
+
+_BUNDLES: Dict[Tuple, "LambdaBundle"] = {}
+_INTERPRETERS: Dict[str, Optional["RuntimePython"]] = {}
+
+
+class RuntimePython:
+    """
+    Python of a Lambda runtime, run locally or in the runtime's
+    bundling image with host paths mounted at the same place.
+    """
+
+    def __init__(self, command: List[str], image: Optional[str] = None):
+        self.command = command
+        self.image = image
+
+    @classmethod
+    def find(cls, runtime: aws_lambda.Runtime) -> Optional["RuntimePython"]:
+        if runtime.name not in _INTERPRETERS:
+            _INTERPRETERS[runtime.name] = cls._find(runtime)
+        return _INTERPRETERS[runtime.name]
+
+    @classmethod
+    def _find(cls, runtime: aws_lambda.Runtime) -> Optional["RuntimePython"]:
+        version = runtime.name.replace("python", "")
+        candidates = []
+        if runtime.name == "python{}.{}".format(*sys.version_info[:2]):
+            candidates.append(cls([sys.executable]))
+        executable = shutil.which(runtime.name)
+        if executable:
+            candidates.append(cls([executable]))
+        if shutil.which("docker"):
+            candidates.append(cls(["python"], image=runtime.bundling_image.image))
+        for candidate in candidates:
+            # e.g. version manager shims of uninstalled versions fail here
+            result = candidate.run(
+                ["-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+                timeout=300,
+            )
+            if result.returncode == 0 and result.stdout.strip() == version:
+                return candidate
+        return None
+
+    def run(
+        self, args: Sequence[str], paths: Sequence[str] = (), timeout: float = 60
+    ) -> subprocess.CompletedProcess:
+        command = self.command + list(args)
+        if self.image:
+            mounts = []
+            for path in paths:
+                mounts += ["--volume", f"{path}:{path}"]
+            user = ["--user", f"{os.getuid()}:{os.getgid()}"]
+            command = ["docker", "run", "--rm", *user, *mounts, self.image, *command]
+        try:
+            return subprocess.run(
+                command, capture_output=True, text=True, timeout=timeout
+            )
+        except (OSError, subprocess.TimeoutExpired) as ex:
+            return subprocess.CompletedProcess(command, 1, "", str(ex))
+
+
+class LambdaBundle:
+    """Trimmed and byte-compiled copy of a source directory."""
+
+    def __init__(
+        self,
+        source_dir: str,
+        runtime: aws_lambda.Runtime,
+        exclude: Sequence[str] = (),
+    ):
+        self.source_dir = source_dir
+        # Assets are staged into cdk.out when the function is
+        # defined, so the bundle is only needed until synth ends
+        self.path = tempfile.mkdtemp(prefix="lambda-bundle-")
+        atexit.register(shutil.rmtree, self.path, ignore_errors=True)
+        self._import_ms: Dict[Tuple, Optional[float]] = {}
+        self.python = RuntimePython.find(runtime)
+        relative_exclude = ROOT_EXCLUDE + list(exclude)
+
+        def ignore(directory: str, names: Sequence[str]):
+            relative_dir = os.path.relpath(directory, source_dir)
+            return [
+                name
+                for name in names
+                if any(fnmatch.fnmatch(name, p) for p in EXCLUDE_PATTERNS)
+                or any(
+                    fnmatch.fnmatch(
+                        os.path.normpath(os.path.join(relative_dir, name)), p
+                    )
+                    for p in relative_exclude
+                )
+            ]
+
+        shutil.copytree(source_dir, self.path, ignore=ignore, dirs_exist_ok=True)
+        self._install_requirements(runtime)
+
+        # Bytecode is only usable by the interpreter version that wrote it
+        self.compiled = False
+        if self.python:
+            self._compile()
+        elif os.environ.get(NO_BYTECODE_VARIABLE) != "1":
+            raise RuntimeError(
+                f"No {runtime.name} interpreter or docker to byte-compile "
+                f"{source_dir}, put {runtime.name} on the PATH, start docker "
+                f"or set {NO_BYTECODE_VARIABLE}=1 to ship sources only"
+            )
+
+    def _compile(self):
+        # Unchecked hash based pycs are deterministic, so the asset
+        # hash is stable, and are never revalidated against the source.
+        result = self.python.run(
+            [
+                "-m",
+                "compileall",
+                "-q",
+                "--invalidation-mode",
+                "unchecked-hash",
+                # paths relative to the bundle, the same for every copy
+                "-s",
+                self.path,
+                self.path,
+            ],
+            paths=[self.path],
+            timeout=300,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Byte-compiling {self.source_dir} failed:\n"
+                f"{result.stdout}{result.stderr}"
+            )
+        self.compiled = True
+
+    def _install_requirements(self, runtime: aws_lambda.Runtime):
+        """
+        Installs requirements.txt as wheels built for the runtime,
+        reusing a previous install of the same requirements.
+        """
+        requirements = os.path.join(self.source_dir, "requirements.txt")
+        if not os.path.exists(requirements):
+            return
+        sha = hashlib.sha256(f"{LAMBDA_PLATFORM}:{runtime.name}:".encode())
+        with open(requirements, "rb") as f:
+            sha.update(f.read())
+        cached = os.path.join(REQUIREMENTS_CACHE, sha.hexdigest())
+        if not os.path.isdir(cached):
+            os.makedirs(REQUIREMENTS_CACHE, exist_ok=True)
+            partial = tempfile.mkdtemp(dir=REQUIREMENTS_CACHE)
+            try:
+                self._pip_install(requirements, partial, runtime)
+                os.rename(partial, cached)
+            except OSError:
+                # installed concurrently by another process
+                if not os.path.isdir(cached):
+                    raise
+            finally:
+                shutil.rmtree(partial, ignore_errors=True)
+        shutil.copytree(cached, self.path, dirs_exist_ok=True)
+
+    @staticmethod
+    def _pip_install(requirements: str, target: str, runtime: aws_lambda.Runtime):
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--quiet",
+                "--requirement",
+                requirements,
+                "--target",
+                target,
+                "--platform",
+                LAMBDA_PLATFORM,
+                "--implementation",
+                "cp",
+                "--python-version",
+                runtime.name.replace("python", ""),
+                "--only-binary=:all:",
+                "--no-compile",
+            ],
+            check=True,
+        )
+
+    def files(self):
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, self.path)
+
+    @property
+    def digest(self) -> str:
+        sha = hashlib.sha256()
+        for path, relative_path in self.files():
+            sha.update(relative_path.encode())
+            with open(path, "rb") as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    @property
+    def zip_bytes(self) -> int:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for path, relative_path in self.files():
+                archive.write(path, relative_path)
+        return buffer.tell()
+
+    def import_ms(self, module: str, paths: Sequence[str] = ()) -> Optional[float]:
+        """
+        Time taken by the runtime's Python version to import
+        ``module`` from the bundle, None if it cannot be imported
+        or no runtime interpreter is available.
+        """
+        key = (module, tuple(paths))
+        if key not in self._import_ms:
+            self._import_ms[key] = self._measure_import_ms(module, paths)
+        return self._import_ms[key]
+
+    def _measure_import_ms(self, module: str, paths: Sequence[str]) -> Optional[float]:
+        script = (
+            "import sys, time\n"
+            f"sys.path[:0] = {[self.path, *paths]!r}\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "print((time.perf_counter() - start) * 1000)\n"
+        )
+        if not self.python:
+            return None
+        # -B keeps the interpreter's bytecode out of the asset
+        result = self.python.run(["-B", "-c", script], paths=[self.path, *paths])
+        try:
+            return float(result.stdout.strip()) if result.returncode == 0 else None
+        except ValueError:
+            return None
+
+
+def get_bundle(
+    source_dir: str, runtime: aws_lambda.Runtime, exclude: Sequence[str] = ()
+) -> LambdaBundle:
+    """Bundles are shared by every stack synthesized in this process."""
+    key = (source_dir, runtime.name, tuple(exclude))
+    if key not in _BUNDLES:
+        _BUNDLES[key] = LambdaBundle(source_dir, runtime, exclude)
+    return _BUNDLES[key]
+
+
+def report_bundle(
+    scope: Construct,
+    name: str,
+    bundle: LambdaBundle,
+    handler_module: Optional[str] = None,
+    layer_paths: Sequence[str] = (),
+):
+    """Adds the bundle's size and import time to the synth output."""
+    message = f"{name}: {bundle.zip_bytes / 1024:.1f} KiB zipped"
+    if handler_module:
+        import_ms = bundle.import_ms(handler_module, layer_paths)
+        import_time = "n/a" if import_ms is None else f"{import_ms:.1f} ms"
+        message += f", handler import {import_time}"
+    Annotations.of(scope).add_info(message)
+    if not bundle.compiled:
+        Annotations.of(scope).add_warning(
+            f"{name}: not byte-compiled, {NO_BYTECODE_VARIABLE} is set"
+        )
+
+
+def function_code(
+    scope: Construct,
+    name: str,
+    source_dir: str,
+    runtime: aws_lambda.Runtime = aws_lambda.Runtime.PYTHON_3_9,
+    handler: str = "lambda_handler.main",
+    layer_paths: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    handler_module: Optional[str] = None,
+) -> aws_lambda.Code:
+    """
+    Returns the bundled code of a function and reports its size.
+
+    Parameters:
+    name (str): Function name used in the synth report
+    source_dir (str): Directory holding the handler module
+    layer_paths (list): Layer directories the handler imports from
+    exclude (list): Dead modules, relative to source_dir, to strip
+    handler_module (str): Module timed at synth when the handler
+    is not a Python function, e.g. a startup script
+    """
+    bundle = get_bundle(source_dir, runtime, exclude)
+    handler_module = handler_module or handler.rsplit(".", 1)[0]
+    report_bundle(scope, name, bundle, handler_module, layer_paths)
+    return aws_lambda.Code.from_asset(bundle.path)
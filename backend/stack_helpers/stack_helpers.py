@@ -1,8 +1,33 @@
 import os
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 
 @dataclass
 class Environment:
     log_level: str
+    # "rest" (API Gateway v1) or "http" (API Gateway v2)
+    api_mode: str = "rest"
+    # Stage throttle, requests per second and burst size
+    throttle_rate_limit: float = 25
+    throttle_burst_limit: int = 50
+    # Image requests per client IP per 5 minutes
+    device_rate_limit: int = 100
+    # Custom domain with mutual TLS for devices, disabled when unset
+    domain_name: Optional[str] = None
+    certificate_arn: Optional[str] = None
+    # Keep token authentication for devices without certificates
+    mtls_token_fallback: bool = True
+    # Folder holding device-ca.pem, defaults to backend/storage/truststore
+    truststore_dir: Optional[str] = None
+    # Stream images through a Lambda function URL
+    streaming: bool = False
+    # Album name to {"prefix": "public/..."} or {"tag": "..."},
+    # by default a single album of every image
+    albums: Dict[str, Dict[str, str]] = field(
+        default_factory=lambda: {"all": {"prefix": "public/"}}
+    )
+    # Albums of each device, keyed by certificate CN or x-device-id
+    device_albums: Dict[str, List[str]] = field(default_factory=dict)
+    # Albums of devices without an entry in device_albums
+    default_albums: List[str] = field(default_factory=lambda: ["all"])
@@ -0,0 +1,42 @@
+from typing import Dict, Set
+
+# S3 object tag listing the tag-based albums of an image,
+# separated by spaces, e.g. album=beach family
+ALBUM_TAG = "album"
+
+
+def tag_values(tags: Dict[str, str]) -> Set[str]:
+    return set(tags.get(ALBUM_TAG, "").split())
+
+
+def prefix_albums(key: str, albums: Dict[str, Dict]) -> Set[str]:
+    """Albums whose prefix contains the key."""
+    return {
+        name
+        for name, album in albums.items()
+        if album.get("prefix") and key.startswith(album["prefix"])
+    }
+
+
+def tag_albums(albums: Dict[str, Dict]) -> Set[str]:
+    return {name for name, album in albums.items() if album.get("tag")}
+
+
+def album_memberships(
+    key: str, tags: Dict[str, str], albums: Dict[str, Dict]
+) -> Set[str]:
+    """
+    Returns the albums an image belongs to.
+
+    Parameters:
+    key (str): Object key
+    tags (dict): Object tags
+    albums (dict): Album name to {"prefix": ...} or {"tag": ...}
+
+    returns:
+    set of album names
+    """
+    values = tag_values(tags)
+    return prefix_albums(key, albums) | {
+        name for name, album in albums.items() if album.get("tag") in values
+    }
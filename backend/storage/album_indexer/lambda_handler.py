@@ -0,0 +1,148 @@
+from typing import Any, Dict, Iterator, Set
+from urllib.parse import unquote_plus
+import json
+import os
+import random
+import boto3
+from botocore.exceptions import ClientError
+from photo_frame_common.logger import get_logger
+from albums import album_memberships, prefix_albums, tag_albums
+
+LOGGER = get_logger()
+
+PUBLIC_PREFIX = "public/"
+
+s3_client = boto3.client("s3")
+dynamo_client = boto3.client("dynamodb")
+
+
+def get_albums() -> Dict[str, Dict]:
+    return json.loads(os.environ["ALBUMS"])
+
+
+def shuffle_value() -> str:
+    """Random sort key of the ByShuffle index images are picked from."""
+    return f"{random.getrandbits(64):016x}"
+
+
+def put_entry(table_name: str, album: str, key: str, size: int):
+    dynamo_client.put_item(
+        TableName=table_name,
+        Item={
+            "album": {"S": album},
+            "key": {"S": key},
+            "size": {"N": str(size)},
+            "shuffle": {"S": shuffle_value()},
+        },
+    )
+
+
+def delete_entry(table_name: str, album: str, key: str):
+    dynamo_client.delete_item(
+        TableName=table_name,
+        Key={"album": {"S": album}, "key": {"S": key}},
+    )
+
+
+def index_object(bucket_name: str, table_name: str, key: str, size: int) -> Set[str]:
+    """
+    Adds an image to the albums it belongs to and removes it
+    from the tag-based albums it no longer belongs to. Returns
+    the albums it belongs to.
+    """
+    albums = get_albums()
+    tags = {}
+    if tag_albums(albums):
+        tag_set = s3_client.get_object_tagging(Bucket=bucket_name, Key=key)["TagSet"]
+        tags = {tag["Key"]: tag["Value"] for tag in tag_set}
+    members = album_memberships(key, tags, albums)
+    for album in members:
+        put_entry(table_name, album, key, size)
+    for album in tag_albums(albums) - members:
+        delete_entry(table_name, album, key)
+    LOGGER.info(f"Indexed {key} in {sorted(members)}")
+    return members
+
+
+def unindex_object(table_name: str, key: str):
+    albums = get_albums()
+    for album in prefix_albums(key, albums) | tag_albums(albums):
+        delete_entry(table_name, album, key)
+    LOGGER.info(f"Removed {key} from album indexes")
+
+
+def list_images(bucket_name: str) -> Iterator[Dict]:
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=PUBLIC_PREFIX):
+        for item in page.get("Contents", []):
+            # skip folder keys
+            if item["Size"] > 0:
+                yield item
+
+
+def list_entries(table_name: str, album: str) -> Iterator[str]:
+    paginator = dynamo_client.get_paginator("query")
+    for page in paginator.paginate(
+        TableName=table_name,
+        KeyConditionExpression="album = :album",
+        ExpressionAttributeValues={":album": {"S": album}},
+        ExpressionAttributeNames={"#key": "key"},
+        ProjectionExpression="#key",
+    ):
+        for item in page["Items"]:
+            yield item["key"]["S"]
+
+
+def rebuild(bucket_name: str, table_name: str):
+    """
+    Indexes every image under public/ and drops index entries
+    of images that are no longer in their album, because they
+    were deleted or the album's prefix changed. Run on
+    deployment for images stored before the indexer or the
+    current albums, or to repair the indexes.
+    """
+    members: Dict[str, Set[str]] = {album: set() for album in get_albums()}
+    images = 0
+    for item in list_images(bucket_name):
+        images += 1
+        for album in index_object(bucket_name, table_name, item["Key"], item["Size"]):
+            members[album].add(item["Key"])
+    for album, keys in members.items():
+        for key in list_entries(table_name, album):
+            if key not in keys:
+                delete_entry(table_name, album, key)
+    LOGGER.info(f"Rebuilt album indexes from {images} images")
+
+
+def main(event: Dict, context: Any):
+    """
+    Keeps the album indexes up to date. Invoked by S3 when an
+    image under public/ is created, removed or (re)tagged, or
+    with {"rebuild": true} by deployments and manually to index
+    existing images.
+    """
+    bucket_name = os.environ["S3_BUCKET_NAME"]
+    table_name = os.environ["ALBUM_TABLE_NAME"]
+    if event.get("rebuild"):
+        rebuild(bucket_name, table_name)
+        return
+
+    for record in event["Records"]:
+        key = unquote_plus(record["s3"]["object"]["key"])
+        event_name = record["eventName"]
+        if event_name.startswith("ObjectRemoved"):
+            unindex_object(table_name, key)
+            continue
+        size = record["s3"]["object"].get("size")
+        try:
+            if size is None:
+                # tagging events don't carry the size
+                size = s3_client.head_object(Bucket=bucket_name, Key=key)[
+                    "ContentLength"
+                ]
+            if size > 0:
+                index_object(bucket_name, table_name, key, size)
+        except ClientError as ex:
+            # removed before the event was handled, its
+            # ObjectRemoved event cleans up the index
+            LOGGER.warning(f"Skipped {key}: {ex}")
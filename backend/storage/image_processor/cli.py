@@ -0,0 +1,115 @@
+"""
+Runs the image processing pipeline on a local folder.
+
+Images are validated, stripped of EXIF and re-oriented in
+parallel with a process pool. Results are written to an
+output folder and optionally uploaded to the public/ prefix
+of the photo bucket.
+
+Usage:
+    python backend/storage/image_processor/cli.py photos/ --out processed/
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from pipeline import InvalidImage, output_name, process_image
+
+PUBLIC_PREFIX = "public/"
+
+
+@dataclass
+class Result:
+    name: str
+    input_bytes: int
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+
+
+def find_collisions(paths: Sequence[str]) -> List[List[str]]:
+    """
+    Returns the names of files that would be written to the same
+    JPEG, e.g. beach.png and beach.jpg.
+    """
+    outputs: Dict[str, List[str]] = {}
+    for path in paths:
+        outputs.setdefault(output_name(path), []).append(os.path.basename(path))
+    return [names for names in outputs.values() if len(names) > 1]
+
+
+def process_file(path: str, out_dir: str) -> Result:
+    with open(path, "rb") as f:
+        data = f.read()
+    result = Result(name=os.path.basename(path), input_bytes=len(data))
+    try:
+        image = process_image(data)
+    except InvalidImage as ex:
+        result.error = str(ex)
+        return result
+    result.output_path = os.path.join(out_dir, output_name(path))
+    with open(result.output_path, "wb") as f:
+        f.write(image.data)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("folder")
+    parser.add_argument("--out", default="processed")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--bucket", help="upload results to this bucket")
+    parser.add_argument("--prefix", default=PUBLIC_PREFIX, help="upload key prefix")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    paths = sorted(
+        os.path.join(args.folder, name)
+        for name in os.listdir(args.folder)
+        if os.path.isfile(os.path.join(args.folder, name))
+    )
+
+    if not paths:
+        print(f"No files in {args.folder}")
+        return
+    collisions = find_collisions(paths)
+    if collisions:
+        parser.error(
+            "files would overwrite each other, rename them: "
+            + "; ".join(", ".join(names) for names in collisions)
+        )
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(process_file, paths, [args.out] * len(paths)))
+    elapsed = time.perf_counter() - start
+
+    processed = [r for r in results if r.output_path]
+    for result in results:
+        if result.error:
+            print(f"rejected {result.name}: {result.error}")
+
+    if args.bucket:
+        import boto3
+
+        s3_client = boto3.client("s3")
+        for result in processed:
+            s3_client.upload_file(
+                result.output_path,
+                args.bucket,
+                f"{args.prefix}{os.path.basename(result.output_path)}",
+                ExtraArgs={"ContentType": "image/jpeg"},
+            )
+
+    input_mb = sum(r.input_bytes for r in results) / (1024 * 1024)
+    print(
+        f"{len(processed)} processed, {len(results) - len(processed)} rejected "
+        f"in {elapsed:.2f} s ({len(results) / elapsed:.1f} images/s, "
+        f"{input_mb / elapsed:.1f} MB/s) with {args.workers} workers"
+    )
+
+
+if __name__ == "__main__":
+    main()
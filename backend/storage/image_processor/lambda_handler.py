@@ -0,0 +1,172 @@
+from typing import Any, Dict
+from urllib.parse import quote, unquote_plus
+import json
+import os
+import time
+import boto3
+from botocore.exceptions import ClientError
+from photo_frame_common.logger import get_logger
+from pipeline import InvalidImage, output_name, process_image
+
+LOGGER = get_logger()
+
+INCOMING_PREFIX = "incoming/"
+PUBLIC_PREFIX = "public/"
+METRIC_NAMESPACE = "PhotoFrame"
+# Object tag read by the album indexer
+ALBUM_TAG = "album"
+# Batch progress items outlive any batch's processing
+BATCH_TTL_SECONDS = 24 * 60 * 60
+
+s3_client = boto3.client("s3")
+dynamo_client = None
+
+
+def get_dynamo_client():
+    global dynamo_client
+    if dynamo_client is None:
+        dynamo_client = boto3.client("dynamodb")
+    return dynamo_client
+
+
+def start_batch(batch_id: str) -> float:
+    """
+    Records when processing of a batch started, the earliest
+    invocation wins. Returns the batch's start time.
+    """
+    now = time.time()
+    result = get_dynamo_client().update_item(
+        TableName=os.environ["BATCH_TABLE_NAME"],
+        Key={"batch_id": {"S": batch_id}},
+        UpdateExpression="SET started = if_not_exists(started, :now), "
+        "expires_at = if_not_exists(expires_at, :expires_at)",
+        ExpressionAttributeValues={
+            ":now": {"N": str(now)},
+            ":expires_at": {"N": str(int(now) + BATCH_TTL_SECONDS)},
+        },
+        ReturnValues="ALL_NEW",
+    )
+    return float(result["Attributes"]["started"]["N"])
+
+
+def finish_image(batch_id: str, batch_images: int, key: str):
+    """
+    Records a processed or rejected image of a batch. Keys are
+    kept in a set, so retried and duplicate deliveries of an
+    image count once, and only the invocation whose image
+    completes the set reports the batch's throughput.
+    """
+    result = get_dynamo_client().update_item(
+        TableName=os.environ["BATCH_TABLE_NAME"],
+        Key={"batch_id": {"S": batch_id}},
+        UpdateExpression="ADD finished_keys :key",
+        ExpressionAttributeValues={":key": {"SS": [key]}},
+        ReturnValues="ALL_OLD",
+    )
+    attributes = result.get("Attributes", {})
+    finished = set(attributes.get("finished_keys", {}).get("SS", []))
+    if key in finished or len(finished) + 1 != batch_images:
+        return
+    elapsed = max(time.time() - float(attributes["started"]["N"]), 0.001)
+    emit_metrics(
+        batch_id,
+        BatchImages=batch_images,
+        BatchProcessingMs=elapsed * 1000,
+        BatchThroughput=batch_images / elapsed,
+    )
+
+
+def emit_metrics(batch_id: str, **metrics: float):
+    """Writes metrics in CloudWatch embedded metric format."""
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": METRIC_NAMESPACE,
+                            "Dimensions": [[]],
+                            "Metrics": [{"Name": name} for name in metrics],
+                        }
+                    ],
+                },
+                "batch_id": batch_id,
+                **metrics,
+            }
+        )
+    )
+
+
+def process_object(bucket_name: str, key: str):
+    """
+    Processes incoming/<batch_id>/<name> into public/<batch_id>/<name>.jpg
+    and removes the upload. Invalid uploads are left for the
+    incoming/ lifecycle rule to expire. Images are tagged with
+    the album of their batch, which adds them to tag-based albums.
+    The upload is only removed once the image is counted, so a
+    failed invocation is retried from the start.
+    """
+    start = time.perf_counter()
+    batch_id, name = key[len(INCOMING_PREFIX) :].split("/", 1)
+    try:
+        content_object = s3_client.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] != "NoSuchKey":
+            raise
+        # duplicate delivery of an image that is already done
+        LOGGER.info(f"Skipped {key}, already processed")
+        return
+    metadata = content_object["Metadata"]
+    # Batches created before the image count was recorded are not tracked
+    batch_images = int(metadata.get("batch-images", 0))
+    if batch_images:
+        start_batch(batch_id)
+    data = content_object["Body"].read()
+    try:
+        image = process_image(data)
+    except InvalidImage as ex:
+        LOGGER.warning(f"Rejected {key}: {ex}")
+        emit_metrics(batch_id, ImagesRejected=1)
+        if batch_images:
+            finish_image(batch_id, batch_images, key)
+        return
+
+    public_key = f"{PUBLIC_PREFIX}{batch_id}/{output_name(name)}"
+    extra_args = {}
+    album = metadata.get("album")
+    if album:
+        extra_args["Tagging"] = f"{ALBUM_TAG}={quote(album)}"
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=public_key,
+        Body=image.data,
+        ContentType="image/jpeg",
+        **extra_args,
+    )
+    if batch_images:
+        finish_image(batch_id, batch_images, key)
+    s3_client.delete_object(Bucket=bucket_name, Key=key)
+    LOGGER.info(f"Stored {public_key} ({image.width}x{image.height})")
+
+    # Time since the batch was created, including the uploads
+    batch_created = float(metadata.get("batch-created", 0))
+    emit_metrics(
+        batch_id,
+        ImagesProcessed=1,
+        BytesProcessed=len(data),
+        ProcessingMs=(time.perf_counter() - start) * 1000,
+        BatchElapsedMs=(time.time() - batch_created) * 1000 if batch_created else 0,
+    )
+
+
+def main(event: Dict, context: Any):
+    """
+    Invoked by S3 for every upload completed under incoming/.
+    Each object is a separate invocation, so a batch is
+    processed with one concurrent invocation per image.
+    """
+    for record in event["Records"]:
+        bucket_name = record["s3"]["bucket"]["name"]
+        key = unquote_plus(record["s3"]["object"]["key"])
+        process_object(bucket_name, key)
@@ -0,0 +1,62 @@
+import io
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Larger images are rejected rather than decoded
+MAX_PIXELS = 50_000_000
+JPEG_QUALITY = 90
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF"}
+
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+class InvalidImage(Exception):
+    pass
+
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    width: int
+    height: int
+
+
+def output_name(name: str) -> str:
+    """Processed images are always stored as JPEGs."""
+    stem, _ = os.path.splitext(os.path.basename(name))
+    return f"{stem}.jpg"
+
+
+def process_image(data: bytes) -> ProcessedImage:
+    """
+    Validates an uploaded image, applies its EXIF
+    orientation and re-encodes it as a JPEG without
+    any EXIF or other metadata.
+
+    Parameters:
+    data (bytes): Uploaded file
+
+    returns:
+    ProcessedImage
+    """
+    try:
+        # verify() leaves the image unusable, so it is opened twice
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise InvalidImage(f"Unsupported format {image.format}")
+            if image.width * image.height > MAX_PIXELS:
+                raise InvalidImage(f"Image is {image.width}x{image.height}")
+            image.verify()
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            return ProcessedImage(
+                data=output.getvalue(), width=image.width, height=image.height
+            )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as ex:
+        raise InvalidImage(str(ex)) from ex
@@ -1,22 +1,90 @@
+import hashlib
 import json
 import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional
 
 from aws_cdk import (
     aws_s3 as s3,
     aws_s3_deployment as s3deploy,
+    aws_s3_notifications as s3n,
+    aws_dynamodb,
+    aws_lambda,
     CfnOutput,
+    Duration,
     aws_iam as iam,
+    custom_resources as cr,
 )
 from constructs import Construct
 
+from backend.layer.infrastructure import SharedLayer
+from backend.stack_helpers.packaging import function_code
+
 
 BASE_FILE_PATH = os.path.dirname(os.path.abspath(__file__))
 
+# Uploads from the ingest API, processed into public/
+INCOMING_PREFIX = "incoming/"
+# Images served to the frames
+PUBLIC_PREFIX = "public/"
+# CA bundle that signed the device certificates, used as the
+# mutual TLS truststore of the API
+TRUSTSTORE_FILE = "device-ca.pem"
+# Local folder holding device-ca.pem
+DEFAULT_TRUSTSTORE_DIR = os.path.join(BASE_FILE_PATH, "truststore")
+# Local secondary index of the album table ordered by a random
+# value, frames pick an image with a single item query
+ALBUM_SHUFFLE_INDEX = "ByShuffle"
+ALBUM_NAME_PATTERN = re.compile(r"^[\w-]{1,64}$")
+
+
+@dataclass
+class Album:
+    # Images under this key prefix, e.g. public/beach/
+    prefix: Optional[str] = None
+    # Images whose album tag contains this value
+    tag: Optional[str] = None
+
+
+DEFAULT_ALBUMS = {"all": Album(prefix=PUBLIC_PREFIX)}
+
+
+def truststore_key(truststore_dir: str) -> str:
+    """
+    Key of the truststore, which changes with its content. API
+    Gateway only reloads a truststore when its URI changes.
+    """
+    path = os.path.join(truststore_dir, TRUSTSTORE_FILE)
+    if not os.path.isfile(path):
+        raise ValueError(f"Missing {TRUSTSTORE_FILE} in {truststore_dir}")
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    return f"truststore/{digest}/{TRUSTSTORE_FILE}"
+
 
 class Storage(Construct):
-    def __init__(self, scope: Construct, id_: str):
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        shared_layer: SharedLayer,
+        truststore_dir: Optional[str] = None,
+        albums: Dict[str, Album] = DEFAULT_ALBUMS,
+    ):
         super().__init__(scope, id_)
 
+        for name, album in albums.items():
+            if not ALBUM_NAME_PATTERN.match(name):
+                raise ValueError(f"Invalid album name {name!r}")
+            if bool(album.prefix) == bool(album.tag):
+                raise ValueError(f"Album {name} needs either a prefix or a tag")
+            if album.prefix and not album.prefix.startswith(PUBLIC_PREFIX):
+                raise ValueError(f"Album {name} must be under {PUBLIC_PREFIX}")
+            if album.tag and not ALBUM_NAME_PATTERN.match(album.tag):
+                raise ValueError(f"Invalid tag {album.tag!r} of album {name}")
+        self.albums = albums
+
         # Set up a bucket
         self.s3_bucket = s3.Bucket(
             self,
@@ -25,18 +93,183 @@ class Storage(Construct):
             encryption=s3.BucketEncryption.S3_MANAGED,
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
             enforce_ssl=True,
+            lifecycle_rules=[
+                # rejected and abandoned uploads
+                s3.LifecycleRule(
+                    id="ExpireIncoming",
+                    prefix=INCOMING_PREFIX,
+                    expiration=Duration.days(1),
+                    abort_incomplete_multipart_upload_after=Duration.days(1),
+                )
+            ],
         )
 
         # files in public folder
         full_file_path = os.path.join(BASE_FILE_PATH, "public/")
 
-        s3deploy.BucketDeployment(
+        files_deployment = s3deploy.BucketDeployment(
             self,
             "PhotoFrameFilesBucketDeployment",
             sources=[s3deploy.Source.asset(full_file_path)],
             destination_bucket=self.s3_bucket,
             destination_key_prefix="public",
+            # keep images added through the ingest API
+            prune=False,
+        )
+
+        # Device CA for mutual TLS
+        self.truststore_deployment = None
+        self.truststore_key = None
+        if truststore_dir:
+            self.truststore_key = truststore_key(truststore_dir)
+            self.truststore_deployment = s3deploy.BucketDeployment(
+                self,
+                "PhotoFrameTruststoreDeployment",
+                sources=[s3deploy.Source.asset(truststore_dir)],
+                destination_bucket=self.s3_bucket,
+                destination_key_prefix=os.path.dirname(self.truststore_key),
+                # earlier truststores stay until the domain has moved on
+                prune=False,
+            )
+
+        # Progress of each ingest batch, the processor reports the
+        # batch's throughput once its last image is done
+        batch_table = aws_dynamodb.Table(
+            self,
+            "IngestBatchTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="batch_id", type=aws_dynamodb.AttributeType.STRING
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+        )
+
+        # Validates, strips EXIF and orients ingested images. S3 invokes
+        # it once per upload, fanning a batch out over concurrent
+        # invocations.
+        image_processor_fn = aws_lambda.Function(
+            self,
+            "ImageProcessor",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            function_name="Image-processor",
+            environment={
+                "S3_BUCKET_NAME": self.s3_bucket.bucket_name,
+                "BATCH_TABLE_NAME": batch_table.table_name,
+            },
+            handler="lambda_handler.main",
+            description="Processes ingested images into the public folder",
+            code=function_code(
+                self,
+                "Image-processor",
+                os.path.join(BASE_FILE_PATH, "image_processor"),
+                layer_paths=[shared_layer.python_path],
+                exclude=["cli.py"],
+            ),
+            layers=[shared_layer.layer_version],
+            memory_size=1024,
+            reserved_concurrent_executions=10,
+            timeout=Duration.minutes(2),
+        )
+        self.s3_bucket.grant_read(image_processor_fn.role, f"{INCOMING_PREFIX}*")
+        self.s3_bucket.grant_delete(image_processor_fn.role, f"{INCOMING_PREFIX}*")
+        self.s3_bucket.grant_put(image_processor_fn.role, f"{PUBLIC_PREFIX}*")
+        batch_table.grant_read_write_data(image_processor_fn.role)
+        self.s3_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.LambdaDestination(image_processor_fn),
+            s3.NotificationKeyFilter(prefix=INCOMING_PREFIX),
+        )
+
+        # Keys and sizes of the images in each album
+        self.album_table = aws_dynamodb.Table(
+            self,
+            "AlbumIndexTable",
+            partition_key=aws_dynamodb.Attribute(
+                name="album", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="key", type=aws_dynamodb.AttributeType.STRING
+            ),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+        )
+        self.album_table.add_local_secondary_index(
+            index_name=ALBUM_SHUFFLE_INDEX,
+            sort_key=aws_dynamodb.Attribute(
+                name="shuffle", type=aws_dynamodb.AttributeType.STRING
+            ),
+        )
+
+        albums_config = {
+            name: {"prefix": album.prefix} if album.prefix else {"tag": album.tag}
+            for name, album in albums.items()
+        }
+
+        # Updates the album indexes as images are added, removed
+        # or tagged, so they never require listing the bucket.
+        album_indexer_fn = aws_lambda.Function(
+            self,
+            "AlbumIndexer",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            function_name="Album-indexer",
+            environment={
+                "S3_BUCKET_NAME": self.s3_bucket.bucket_name,
+                "ALBUM_TABLE_NAME": self.album_table.table_name,
+                "ALBUMS": json.dumps(albums_config),
+            },
+            handler="lambda_handler.main",
+            description="Maintains the album indexes",
+            code=function_code(
+                self,
+                "Album-indexer",
+                os.path.join(BASE_FILE_PATH, "album_indexer"),
+                layer_paths=[shared_layer.python_path],
+            ),
+            layers=[shared_layer.layer_version],
+            timeout=Duration.minutes(15),
+        )
+        self.album_table.grant_read_write_data(album_indexer_fn.role)
+        self.s3_bucket.grant_read(album_indexer_fn.role, f"{PUBLIC_PREFIX}*")
+        for event_type in (
+            s3.EventType.OBJECT_CREATED,
+            s3.EventType.OBJECT_REMOVED,
+            s3.EventType.OBJECT_TAGGING,
+        ):
+            self.s3_bucket.add_event_notification(
+                event_type,
+                s3n.LambdaDestination(album_indexer_fn),
+                s3.NotificationKeyFilter(prefix=PUBLIC_PREFIX),
+            )
+
+        # The deployment sync only copies changed files, so images
+        # already in the bucket never reach the indexer. Rebuild the
+        # indexes once deployed and whenever the albums change.
+        rebuild_call = cr.AwsSdkCall(
+            service="Lambda",
+            action="invoke",
+            parameters={
+                "FunctionName": album_indexer_fn.function_name,
+                # rebuilds outlast the custom resource's timeout
+                "InvocationType": "Event",
+                "Payload": json.dumps({"rebuild": True, "albums": albums_config}),
+            },
+            physical_resource_id=cr.PhysicalResourceId.of("AlbumIndexRebuild"),
+        )
+        album_rebuild = cr.AwsCustomResource(
+            self,
+            "AlbumIndexRebuild",
+            on_create=rebuild_call,
+            on_update=rebuild_call,
+            policy=cr.AwsCustomResourcePolicy.from_statements(
+                [
+                    iam.PolicyStatement(
+                        actions=["lambda:InvokeFunction"],
+                        resources=[album_indexer_fn.function_arn],
+                    )
+                ]
+            ),
+            install_latest_aws_sdk=False,
         )
+        album_rebuild.node.add_dependency(files_deployment)
 
         # Bucket Policy that allows access to anything
         # in the /public directory.
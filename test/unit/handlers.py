@@ -0,0 +1,34 @@
+import importlib
+import os
+import sys
+from types import ModuleType
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LAYER_PATH = os.path.join(ROOT, "backend", "layer", "shared", "python")
+
+# module level clients need a region outside of Lambda
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+if LAYER_PATH not in sys.path:
+    sys.path.append(LAYER_PATH)
+
+
+def load_handler(function_dir: str, module: str = "lambda_handler") -> ModuleType:
+    """
+    Imports a module of a Lambda function the way the runtime
+    does, with the function directory and the shared layer on
+    the path. Functions share module names, so previously
+    loaded ones are dropped first.
+
+    Parameters:
+    function_dir (str): Function directory relative to backend/
+    """
+    path = os.path.join(ROOT, "backend", function_dir)
+    for name in [module, "lambda_handler"] + [
+        os.path.splitext(f)[0] for f in os.listdir(path) if f.endswith(".py")
+    ]:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(path)
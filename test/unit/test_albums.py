@@ -0,0 +1,70 @@
+import json
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from backend.storage.album_indexer.albums import (
+    album_memberships,
+    prefix_albums,
+    tag_albums,
+)
+from test.unit.handlers import load_handler
+
+ALBUMS = {
+    "all": {"prefix": "public/"},
+    "beach": {"prefix": "public/beach/"},
+    "family": {"tag": "family"},
+    "pets": {"tag": "pets"},
+}
+
+
+class AlbumsTest(unittest.TestCase):
+    def test_prefix_albums(self):
+        self.assertEqual(
+            {"all", "beach"}, prefix_albums("public/beach/sunset.jpg", ALBUMS)
+        )
+        self.assertEqual({"all"}, prefix_albums("public/beachball.jpg", ALBUMS))
+
+    def test_tag_albums(self):
+        self.assertEqual({"family", "pets"}, tag_albums(ALBUMS))
+
+    def test_memberships_from_tags(self):
+        self.assertEqual(
+            {"all", "family", "pets"},
+            album_memberships("public/a.jpg", {"album": "pets family"}, ALBUMS),
+        )
+        self.assertEqual(
+            {"all"},
+            album_memberships("public/a.jpg", {"other": "family"}, ALBUMS),
+        )
+
+
+class RebuildTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("storage/album_indexer")
+        self.entries = {"beach": {"public/beach/a.jpg", "public/old/b.jpg"}}
+        self.deleted = []
+        for name, value in (
+            ("list_images", lambda bucket: iter(self.images)),
+            ("list_entries", lambda table, album: iter(self.entries.get(album, ()))),
+            ("put_entry", MagicMock()),
+            (
+                "delete_entry",
+                lambda table, album, key: self.deleted.append((album, key)),
+            ),
+            ("s3_client", MagicMock()),
+        ):
+            patcher = patch.object(self.handler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_drops_entries_outside_album(self):
+        # the beach album moved from public/old/ to public/beach/
+        self.images = [
+            {"Key": "public/beach/a.jpg", "Size": 1},
+            {"Key": "public/old/b.jpg", "Size": 1},
+        ]
+        albums = {"all": {"prefix": "public/"}, "beach": {"prefix": "public/beach/"}}
+        with patch.dict(os.environ, {"ALBUMS": json.dumps(albums)}):
+            self.handler.rebuild("bucket", "albums")
+        self.assertEqual([("beach", "public/old/b.jpg")], self.deleted)
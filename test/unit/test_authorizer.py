@@ -0,0 +1,106 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from test.unit.handlers import load_handler
+
+SECRETS = {
+    "api-access-token": "device-token",
+    "ingest-access-token": "ingest-token",
+    "origin-verify-token": "origin-token",
+}
+METHOD_ARN = "arn:aws:execute-api:us-east-1:123456789012:abc123/public/GET/image"
+
+
+def rest_event(resource: str, headers: dict) -> dict:
+    return {"resource": resource, "headers": headers, "methodArn": METHOD_ARN}
+
+
+def http_event(route_key: str, headers: dict) -> dict:
+    return {"version": "2.0", "routeKey": route_key, "headers": headers}
+
+
+class AuthorizerTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("api/authorizer")
+        secrets_client = MagicMock()
+        secrets_client.get_secret_value.side_effect = lambda SecretId: {
+            "SecretString": SECRETS[SecretId]
+        }
+        patcher = patch.object(
+            self.handler.boto3, "client", return_value=secrets_client
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env = patch.dict(
+            os.environ,
+            {
+                "API_TOKEN_NAME": "api-access-token",
+                "INGEST_TOKEN_NAME": "ingest-access-token",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_rest_device_token(self):
+        policy = self.handler.main(
+            rest_event("/image", {"x-api-token": "device-token"}), None
+        )
+        (statement,) = [
+            s for s in policy["policyDocument"]["Statement"] if s["Effect"] == "Allow"
+        ]
+        self.assertEqual(
+            ["arn:aws:execute-api:us-east-1:123456789012:abc123/public/GET/image"],
+            statement["Resource"],
+        )
+
+    def test_rest_wrong_token(self):
+        with self.assertRaisesRegex(Exception, "Unauthorized"):
+            self.handler.main(rest_event("/image", {"x-api-token": "nope"}), None)
+        # the device token is not valid for ingest routes
+        with self.assertRaisesRegex(Exception, "Unauthorized"):
+            self.handler.main(
+                rest_event("/ingest", {"x-api-token": "device-token"}), None
+            )
+
+    def test_http_simple_response(self):
+        response = self.handler.main(
+            http_event("GET /image", {"x-api-token": "device-token"}), None
+        )
+        self.assertTrue(response["isAuthorized"])
+        self.assertIn("principalId", response["context"])
+        response = self.handler.main(
+            http_event("POST /ingest/{batch_id}/complete", {"x-api-token": "x"}),
+            None,
+        )
+        self.assertEqual({"isAuthorized": False}, response)
+
+    def test_http_requires_origin_secret(self):
+        with patch.dict(os.environ, {"ORIGIN_TOKEN_NAME": "origin-verify-token"}):
+            direct = self.handler.main(
+                http_event("GET /image", {"x-api-token": "device-token"}), None
+            )
+            via_cloudfront = self.handler.main(
+                http_event(
+                    "GET /image",
+                    {"x-api-token": "device-token", "x-origin-verify": "origin-token"},
+                ),
+                None,
+            )
+        self.assertFalse(direct["isAuthorized"])
+        self.assertTrue(via_cloudfront["isAuthorized"])
+
+
+class PrincipalTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("api/image_handler")
+
+    def test_principal_of_both_payload_formats(self):
+        rest = {"requestContext": {"authorizer": {"principalId": "p1"}}}
+        http = {
+            "version": "2.0",
+            "requestContext": {"authorizer": {"lambda": {"principalId": "p2"}}},
+        }
+        self.assertEqual("p1", self.handler.get_principal_id(rest))
+        self.assertEqual("p2", self.handler.get_principal_id(http))
+        self.assertIsNone(self.handler.get_principal_id({}))
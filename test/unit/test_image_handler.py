@@ -0,0 +1,127 @@
+import random
+import unittest
+from collections import Counter
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+from test.unit.handlers import load_handler
+
+
+def rest_event(client_cert=None, headers=None) -> dict:
+    identity = {"clientCert": client_cert} if client_cert else {}
+    return {
+        "headers": headers or {},
+        "requestContext": {
+            "identity": identity,
+            "authorizer": {"principalId": "principal"},
+        },
+    }
+
+
+def http_event(client_cert=None) -> dict:
+    authentication = {"clientCert": client_cert} if client_cert else {}
+    return {
+        "version": "2.0",
+        "headers": {},
+        "requestContext": {
+            "authentication": authentication,
+            "authorizer": {"lambda": {"principalId": "principal"}},
+        },
+    }
+
+
+class FakeAlbumTable:
+    """Serves the ByShuffle queries and updates of a single album."""
+
+    def __init__(self, shuffles):
+        self.shuffles = shuffles
+        self.removed = set()
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        start = ExpressionAttributeValues[":start"]["S"]
+        if ">=" in KeyConditionExpression:
+            entries = [k for k, v in self.shuffles.items() if v >= start]
+        else:
+            entries = [k for k, v in self.shuffles.items() if v < start]
+        entries.sort(key=self.shuffles.get)
+        return {
+            "Items": [{"key": {"S": key}, "size": {"N": "1"}} for key in entries[:1]]
+        }
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        key = Key["key"]["S"]
+        if key in self.removed:
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+            )
+        self.shuffles[key] = ExpressionAttributeValues[":shuffle"]["S"]
+
+
+class PickTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("api/image_handler")
+        random.seed(1)
+
+    def pick(self, table):
+        with patch.object(self.handler.boto3, "client", return_value=table):
+            return self.handler.pick_from_album("albums", "all")
+
+    def test_picks_are_uniform(self):
+        # "b" follows almost the whole key space
+        table = FakeAlbumTable({"a": "0" * 16, "b": "f" * 15 + "0", "c": "f" * 16})
+        picks = Counter(self.pick(table)["key"] for _ in range(3000))
+        for key in "abc":
+            self.assertAlmostEqual(1000, picks[key], delta=100)
+
+    def test_removed_entry_still_served(self):
+        table = FakeAlbumTable({"a": "0" * 16})
+        table.removed.add("a")
+        self.assertEqual({"key": "a", "size": 1}, self.pick(table))
+        self.assertEqual("0" * 16, table.shuffles["a"])
+
+    def test_empty_album(self):
+        self.assertIsNone(self.pick(FakeAlbumTable({})))
+
+
+class DeviceIdTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("api/image_handler")
+
+    def test_common_name(self):
+        cert = {"subjectDN": "CN=kitchen-frame,O=Home", "serialNumber": "9"}
+        self.assertEqual("kitchen-frame", self.handler.get_device_id(rest_event(cert)))
+
+    def test_common_name_not_first(self):
+        cert = {"subjectDN": "O=Home, OU=Frames, CN=hall", "serialNumber": "9"}
+        self.assertEqual("hall", self.handler.get_device_id(rest_event(cert)))
+
+    def test_escaped_comma(self):
+        cert = {"subjectDN": "CN=frame\\,1,O=Home", "serialNumber": "9"}
+        self.assertEqual("frame,1", self.handler.get_device_id(rest_event(cert)))
+
+    def test_attribute_ending_in_cn_ignored(self):
+        cert = {"subjectDN": "XCN=fake,O=Home", "serialNumber": "9"}
+        self.assertEqual("9", self.handler.get_device_id(rest_event(cert)))
+
+    def test_missing_common_name_uses_serial(self):
+        cert = {"subjectDN": "O=Home,OU=Frames", "serialNumber": "9"}
+        self.assertEqual("9", self.handler.get_device_id(rest_event(cert)))
+
+    def test_payload_format_2_placement(self):
+        cert = {"subjectDN": "CN=den", "serialNumber": "9"}
+        self.assertEqual("den", self.handler.get_device_id(http_event(cert)))
+        # 1.0 placement is ignored for 2.0 events and vice versa
+        event = http_event()
+        event["requestContext"]["identity"] = {"clientCert": cert}
+        self.assertEqual("principal", self.handler.get_device_id(event))
+        event = rest_event()
+        event["requestContext"]["authentication"] = {"clientCert": cert}
+        self.assertEqual("principal", self.handler.get_device_id(event))
+
+    def test_token_requests(self):
+        self.assertEqual(
+            "attic",
+            self.handler.get_device_id(rest_event(headers={"X-Device-Id": "attic"})),
+        )
+        self.assertEqual("principal", self.handler.get_device_id(rest_event()))
@@ -0,0 +1,55 @@
+import io
+import unittest
+
+from PIL import Image
+
+from backend.storage.image_processor.pipeline import (
+    InvalidImage,
+    output_name,
+    process_image,
+)
+from test.unit.handlers import load_handler
+
+# EXIF orientation: rotate 90 degrees clockwise to display
+ORIENTATION_TAG = 0x0112
+ROTATE_90_CW = 6
+
+
+def make_image(format_: str = "JPEG", mode: str = "RGB", orientation: int = 0):
+    image = Image.new(mode, (40, 20))
+    exif = Image.Exif()
+    if orientation:
+        exif[ORIENTATION_TAG] = orientation
+    output = io.BytesIO()
+    image.save(output, format=format_, exif=exif)
+    return output.getvalue()
+
+
+class ImagePipelineTest(unittest.TestCase):
+    def test_orientation_applied_and_exif_stripped(self):
+        processed = process_image(make_image(orientation=ROTATE_90_CW))
+        self.assertEqual((20, 40), (processed.width, processed.height))
+        with Image.open(io.BytesIO(processed.data)) as image:
+            self.assertEqual("JPEG", image.format)
+            self.assertEqual(0, len(image.getexif()))
+
+    def test_converts_to_rgb_jpeg(self):
+        processed = process_image(make_image(format_="PNG", mode="RGBA"))
+        with Image.open(io.BytesIO(processed.data)) as image:
+            self.assertEqual(("JPEG", "RGB"), (image.format, image.mode))
+
+    def test_rejects_invalid_images(self):
+        with self.assertRaises(InvalidImage):
+            process_image(b"not an image")
+        with self.assertRaises(InvalidImage):
+            process_image(make_image()[:100])
+
+    def test_output_name(self):
+        self.assertEqual("beach.jpg", output_name("holiday/beach.PNG"))
+
+    def test_cli_finds_colliding_names(self):
+        cli = load_handler("storage/image_processor", "cli")
+        self.assertEqual(
+            [["a.jpg", "a.png"]],
+            cli.find_collisions(["in/a.jpg", "in/a.png", "in/A.png", "in/b.gif"]),
+        )
@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from test.unit.handlers import load_handler
+from test.unit import test_image_pipeline
+
+ingest_handler = load_handler("api/ingest_handler")
+image_processor = load_handler("storage/image_processor")
+
+BATCH_ID = "0" * 32
+
+
+def invoke(body, batch_id=None):
+    event = {"body": json.dumps(body)}
+    if batch_id:
+        event["pathParameters"] = {"batch_id": batch_id}
+    with patch.dict(os.environ, {"S3_BUCKET_NAME": "bucket"}):
+        response = ingest_handler.main(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+@patch.object(ingest_handler, "s3_client")
+class IngestHandlerTest(unittest.TestCase):
+    def test_create_batch(self, s3_client):
+        s3_client.create_multipart_upload.return_value = {"UploadId": "upload"}
+        s3_client.generate_presigned_url.return_value = "https://part"
+        status, body = invoke(
+            {"images": [{"name": "beach.jpg", "size": 20 * 1024 * 1024}]}
+        )
+        self.assertEqual(200, status)
+        self.assertEqual(3, len(body["uploads"][0]["part_urls"]))
+        metadata = s3_client.create_multipart_upload.call_args.kwargs["Metadata"]
+        self.assertEqual("1", metadata["batch-images"])
+
+    def test_rejects_invalid_images(self, s3_client):
+        for images in (
+            5,
+            "beach.jpg",
+            [],
+            ["beach.jpg"],
+            [{"name": "beach.jpg"}],
+            [{"name": "beach.jpg", "size": True}],
+            [{"name": 5, "size": 10}],
+            [{"name": "../beach.jpg", "size": 10}],
+            [{"name": "beach.jpg", "size": 10}, {"name": "beach.png", "size": 10}],
+        ):
+            with self.subTest(images=images):
+                status, _ = invoke({"images": images})
+                self.assertEqual(400, status)
+        s3_client.create_multipart_upload.assert_not_called()
+
+    def test_complete_batch(self, s3_client):
+        upload = {
+            "key": f"incoming/{BATCH_ID}/beach.jpg",
+            "upload_id": "upload",
+            "parts": [{"PartNumber": 1, "ETag": "etag"}],
+        }
+        status, body = invoke({"uploads": [upload]}, BATCH_ID)
+        self.assertEqual(200, status)
+        self.assertEqual([upload["key"]], body["completed"])
+
+    def test_rejects_invalid_uploads(self, s3_client):
+        key = f"incoming/{BATCH_ID}/beach.jpg"
+        for uploads in (
+            None,
+            5,
+            ["beach.jpg"],
+            [{"key": 5, "upload_id": "upload", "parts": []}],
+            [{"key": "incoming/other/beach.jpg", "upload_id": "upload", "parts": []}],
+            [{"key": key, "parts": []}],
+            [{"key": key, "upload_id": "upload", "parts": "1"}],
+        ):
+            with self.subTest(uploads=uploads):
+                status, _ = invoke({"uploads": uploads}, BATCH_ID)
+                self.assertEqual(400, status)
+        s3_client.complete_multipart_upload.assert_not_called()
+
+
+class FakeBatchTable:
+    """Applies the processor's batch updates to a single item."""
+
+    def __init__(self):
+        self.item = {}
+
+    def update_item(self, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        old = {name: dict(value) for name, value in self.item.items()}
+        if UpdateExpression.startswith("ADD finished_keys"):
+            keys = set(self.item.get("finished_keys", {}).get("SS", []))
+            keys.update(ExpressionAttributeValues[":key"]["SS"])
+            self.item["finished_keys"] = {"SS": sorted(keys)}
+            return {"Attributes": old} if old else {}
+        self.item.setdefault("started", ExpressionAttributeValues[":now"])
+        return {"Attributes": dict(self.item)}
+
+
+@patch.dict(os.environ, {"BATCH_TABLE_NAME": "batches"})
+class BatchThroughputTest(unittest.TestCase):
+    def setUp(self):
+        self.table = FakeBatchTable()
+        self.table.item["started"] = {"N": "100"}
+        for target, value in (
+            ("dynamo_client", self.table),
+            ("s3_client", MagicMock()),
+        ):
+            patcher = patch.object(image_processor, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(image_processor, "emit_metrics")
+        self.emit_metrics = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def finish(self, name):
+        key = f"incoming/{BATCH_ID}/{name}"
+        with patch.object(image_processor.time, "time", return_value=104):
+            image_processor.finish_image(BATCH_ID, 2, key)
+
+    def test_last_image_reports_throughput(self):
+        self.finish("a.jpg")
+        self.emit_metrics.assert_not_called()
+        self.finish("b.jpg")
+        self.emit_metrics.assert_called_once_with(
+            BATCH_ID, BatchImages=2, BatchProcessingMs=4000, BatchThroughput=0.5
+        )
+
+    def test_duplicates_counted_once(self):
+        self.finish("a.jpg")
+        self.finish("a.jpg")
+        self.emit_metrics.assert_not_called()
+        self.finish("b.jpg")
+        self.finish("b.jpg")
+        self.assertEqual(1, self.emit_metrics.call_count)
+
+    def test_upload_kept_until_counted(self):
+        s3_client = image_processor.s3_client
+        s3_client.get_object.return_value = {
+            "Metadata": {"batch-images": "2"},
+            "Body": io.BytesIO(test_image_pipeline.make_image()),
+        }
+        key = f"incoming/{BATCH_ID}/a.jpg"
+        with patch.object(image_processor, "finish_image", side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                image_processor.process_object("bucket", key)
+        s3_client.delete_object.assert_not_called()
+
+    def test_already_processed_upload_skipped(self):
+        s3_client = image_processor.s3_client
+        s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+        image_processor.process_object("bucket", f"incoming/{BATCH_ID}/a.jpg")
+        s3_client.put_object.assert_not_called()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from aws_cdk import aws_lambda
+
+from backend.stack_helpers import packaging
+from backend.stack_helpers.packaging import LambdaBundle, RuntimePython
+
+
+class PackagingTest(unittest.TestCase):
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        for path in [
+            "__init__.py",
+            "lambda_handler.py",
+            "cli.py",
+            "README.md",
+            "tests/test_handler.py",
+            "test_handler.py",
+            "__pycache__/lambda_handler.cpython-39.pyc",
+            "vendored/__init__.py",
+        ]:
+            full_path = os.path.join(self.source_dir, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w") as f:
+                f.write("VALUE = 1\n")
+        # the test interpreter stands in for the runtime's
+        patcher = patch.object(
+            RuntimePython, "find", return_value=RuntimePython([sys.executable])
+        )
+        self.find = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bundled_files(self, bundle: LambdaBundle):
+        return sorted(
+            relative_path
+            for _, relative_path in bundle.files()
+            if not relative_path.endswith(".pyc")
+        )
+
+    def test_strips_tests_and_dead_modules(self):
+        bundle = LambdaBundle(
+            self.source_dir, aws_lambda.Runtime.PYTHON_3_9, exclude=["cli.py"]
+        )
+        self.assertEqual(
+            ["lambda_handler.py", "vendored/__init__.py"], self.bundled_files(bundle)
+        )
+        self.assertGreater(bundle.zip_bytes, 0)
+        self.assertIsNotNone(bundle.import_ms("lambda_handler"))
+        self.assertIsNone(bundle.import_ms("missing_module"))
+
+    def test_digest_is_stable(self):
+        first = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        second = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        self.assertEqual(first.digest, second.digest)
+
+    def test_requirements_install_cached(self):
+        with open(os.path.join(self.source_dir, "requirements.txt"), "w") as f:
+            f.write("example==1.0\n")
+        cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache)
+
+        def pip_install(requirements, target, runtime):
+            with open(os.path.join(target, "example.py"), "w") as f:
+                f.write("VALUE = 2\n")
+
+        with patch.object(packaging, "REQUIREMENTS_CACHE", cache), patch.object(
+            LambdaBundle, "_pip_install", side_effect=pip_install
+        ) as install:
+            first = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+            second = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        self.assertEqual(1, install.call_count)
+        self.assertIn("example.py", self.bundled_files(first))
+        self.assertEqual(first.digest, second.digest)
+
+    def test_byte_compiled_by_runtime_python(self):
+        bundle = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        self.assertTrue(bundle.compiled)
+        self.assertIn(
+            f"__pycache__/lambda_handler.{sys.implementation.cache_tag}.pyc",
+            [path for _, path in bundle.files()],
+        )
+
+    def test_missing_runtime_python_fails(self):
+        self.find.return_value = None
+        with self.assertRaises(RuntimeError):
+            LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        with patch.dict(os.environ, {packaging.NO_BYTECODE_VARIABLE: "1"}):
+            bundle = LambdaBundle(self.source_dir, aws_lambda.Runtime.PYTHON_3_9)
+        self.assertFalse(bundle.compiled)
+        self.assertIsNone(bundle.import_ms("lambda_handler"))
+
+    def test_broken_interpreter_ignored(self):
+        # e.g. a version manager shim for a version that isn't installed
+        shim = os.path.join(self.source_dir, "python3.9")
+        with open(shim, "w") as f:
+            f.write("#!/bin/sh\nexit 127\n")
+        os.chmod(shim, os.stat(shim).st_mode | stat.S_IEXEC)
+        with patch.dict(os.environ, {"PATH": self.source_dir}), patch.dict(
+            packaging._INTERPRETERS, clear=True
+        ):
+            self.assertIsNone(RuntimePython._find(aws_lambda.Runtime.PYTHON_3_9))
@@ -0,0 +1,355 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from backend.iot.presence_rollup.rollup import (
+    FLEET_DEVICE,
+    DAY_MS,
+    HOUR_MS,
+    SESSION_CHUNK_MS,
+    TRANSACTION_ITEMS,
+    DeviceState,
+    PresenceEvent,
+    Rollups,
+    apply_event,
+    apply_fleet,
+    split_interval,
+)
+from test.unit.handlers import load_handler
+
+# 2022-10-19T00:00:00Z
+DAY_START = int(datetime(2022, 10, 19, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class InMemoryStore:
+    """Stands in for the rollup table."""
+
+    def __init__(self):
+        self.states: Dict[str, DeviceState] = {}
+        self.rollups: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.queued: Dict[str, Dict[int, Rollups]] = {}
+
+    def get_state(self, device: str) -> Optional[DeviceState]:
+        return self.states.get(device)
+
+    def add(self, device: str, rollups: Rollups):
+        for period, counters in rollups.items():
+            rollup = self.rollups.setdefault((device, period), {})
+            for name, value in counters.items():
+                rollup[name] = rollup.get(name, 0) + value
+
+    def apply(
+        self,
+        device: str,
+        previous: Optional[DeviceState],
+        state: DeviceState,
+        rollups: Rollups,
+    ) -> bool:
+        if self.states.get(device) != previous:
+            return False
+        self.states[device] = state
+        self.add(device, rollups)
+        self.queued.setdefault(device, {})[state.since_ms] = rollups
+        return True
+
+    def queued_fleet(self, device: str) -> Dict[int, Rollups]:
+        return dict(self.queued.get(device, {}))
+
+    def apply_fleet(self, queued: Dict[str, List[int]], rollups: Rollups):
+        for device, entries in queued.items():
+            for queued_ms in entries:
+                if queued_ms not in self.queued.get(device, {}):
+                    raise KeyError(queued_ms)
+        for device, entries in queued.items():
+            for queued_ms in entries:
+                del self.queued[device][queued_ms]
+        self.add(FLEET_DEVICE, rollups)
+
+
+class FailingStore(InMemoryStore):
+    """Fails the writes with the given numbers, leaving the store unchanged."""
+
+    def __init__(self, failed_writes=()):
+        super().__init__()
+        self.failed_writes = set(failed_writes)
+        # items in each write
+        self.writes = []
+
+    def fail(self, items: int):
+        self.writes.append(items)
+        if len(self.writes) in self.failed_writes:
+            raise ConnectionError()
+
+    def apply(self, device, previous, state, rollups) -> bool:
+        # the state, the queue entry and the counters
+        self.fail(len(rollups) + 2)
+        return super().apply(device, previous, state, rollups)
+
+    def apply_fleet(self, queued, rollups):
+        self.fail(sum(map(len, queued.values())) + len(rollups))
+        super().apply_fleet(queued, rollups)
+
+
+def event(event_type: str, offset_ms: int, device: str = "frame") -> PresenceEvent:
+    return PresenceEvent(device, event_type, DAY_START + offset_ms)
+
+
+class PresenceRollupTest(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryStore()
+
+    def test_split_interval(self):
+        self.assertEqual(
+            [(0, HOUR_MS), (HOUR_MS, HOUR_MS // 2)],
+            list(split_interval(0, HOUR_MS * 3 // 2, HOUR_MS)),
+        )
+        self.assertEqual([], list(split_interval(5, 5, HOUR_MS)))
+
+    def test_uptime_split_across_hours(self):
+        apply_event(self.store, event("connected", HOUR_MS // 2))
+        apply_event(self.store, event("disconnected", 2 * HOUR_MS))
+        rollups = self.store.rollups
+        self.assertEqual(1800, rollups[("frame", "hour#2022-10-19T00")]["uptime_s"])
+        self.assertEqual(3600, rollups[("frame", "hour#2022-10-19T01")]["uptime_s"])
+        self.assertEqual(1, rollups[("frame", "hour#2022-10-19T02")]["disconnects"])
+        day = rollups[("frame", "day#2022-10-19")]
+        self.assertEqual({"uptime_s": 5400, "connects": 1, "disconnects": 1}, day)
+
+    def test_session_across_days(self):
+        apply_event(self.store, event("connected", DAY_MS - HOUR_MS))
+        apply_event(self.store, event("disconnected", DAY_MS + HOUR_MS))
+        rollups = self.store.rollups
+        self.assertEqual(3600, rollups[("frame", "day#2022-10-19")]["uptime_s"])
+        self.assertEqual(3600, rollups[("frame", "day#2022-10-20")]["uptime_s"])
+
+    def test_fleet_totals(self):
+        for device in ("a", "b"):
+            apply_event(self.store, event("connected", 0, device))
+            apply_event(self.store, event("disconnected", HOUR_MS, device))
+        self.assertNotIn((FLEET_DEVICE, "day#2022-10-19"), self.store.rollups)
+        apply_fleet(self.store, ["a", "b"])
+        fleet = self.store.rollups[(FLEET_DEVICE, "day#2022-10-19")]
+        self.assertEqual(7200, fleet["uptime_s"])
+        self.assertEqual(2, fleet["disconnects"])
+        self.assertEqual({"a": {}, "b": {}}, self.store.queued)
+
+    def test_fleet_batch_written_together(self):
+        store = FailingStore()
+        devices = [f"frame-{i}" for i in range(100)]
+        for device in devices:
+            apply_event(store, event("connected", 0, device))
+        writes = len(store.writes)
+        apply_fleet(store, devices)
+        # a delete per event and an update per period
+        self.assertEqual([TRANSACTION_ITEMS, 2 + 2], store.writes[writes:])
+        fleet = store.rollups[(FLEET_DEVICE, "day#2022-10-19")]
+        self.assertEqual({"connects": 100}, fleet)
+
+    def test_failed_fleet_write_resumed_by_retried_batch(self):
+        store = FailingStore(failed_writes={3})
+        batch = [event("connected", 0), event("disconnected", HOUR_MS)]
+        for presence_event in batch:
+            apply_event(store, presence_event)
+        with self.assertRaises(ConnectionError):
+            apply_fleet(store, ["frame"])
+        # the retried batch skips its events but adds their counters
+        for presence_event in batch:
+            self.assertFalse(apply_event(store, presence_event))
+        apply_fleet(store, ["frame"])
+        apply_fleet(store, ["frame"])
+        fleet = store.rollups[(FLEET_DEVICE, "day#2022-10-19")]
+        self.assertEqual({"uptime_s": 3600, "connects": 1, "disconnects": 1}, fleet)
+
+    def test_retried_and_stale_events_skipped(self):
+        connected = event("connected", 0)
+        self.assertTrue(apply_event(self.store, connected))
+        self.assertFalse(apply_event(self.store, connected))
+        self.assertTrue(apply_event(self.store, event("disconnected", HOUR_MS)))
+        self.assertFalse(apply_event(self.store, event("connected", HOUR_MS // 2)))
+        day = self.store.rollups[("frame", "day#2022-10-19")]
+        self.assertEqual({"uptime_s": 3600, "connects": 1, "disconnects": 1}, day)
+
+    def test_disconnected_time_not_counted(self):
+        apply_event(self.store, event("disconnected", 0))
+        apply_event(self.store, event("connected", HOUR_MS))
+        day = self.store.rollups[("frame", "day#2022-10-19")]
+        self.assertNotIn("uptime_s", day)
+
+    def device_uptime(self, store: InMemoryStore) -> float:
+        return sum(
+            rollup.get("uptime_s", 0)
+            for (device, period), rollup in store.rollups.items()
+            if device == "frame" and period.startswith("day#")
+        )
+
+    def test_failed_write_retried_without_loss(self):
+        store = FailingStore(failed_writes={2})
+        apply_event(store, event("connected", 0))
+        with self.assertRaises(ConnectionError):
+            apply_event(store, event("disconnected", HOUR_MS))
+        self.assertEqual(DeviceState("connected", DAY_START), store.states["frame"])
+        # the retried event is applied once
+        self.assertTrue(apply_event(store, event("disconnected", HOUR_MS)))
+        self.assertFalse(apply_event(store, event("disconnected", HOUR_MS)))
+        day = store.rollups[("frame", "day#2022-10-19")]
+        self.assertEqual({"uptime_s": 3600, "connects": 1, "disconnects": 1}, day)
+
+    def test_long_session_written_in_chunks(self):
+        store = FailingStore()
+        apply_event(store, event("connected", HOUR_MS // 2))
+        apply_event(store, event("disconnected", 30 * DAY_MS))
+        # a DynamoDB transaction holds at most 100 items
+        self.assertLessEqual(max(store.writes), 100)
+        self.assertEqual((30 * DAY_MS - HOUR_MS // 2) / 1000, self.device_uptime(store))
+        self.assertEqual(
+            DeviceState("disconnected", DAY_START + 30 * DAY_MS), store.states["frame"]
+        )
+
+    def test_failed_chunk_resumed(self):
+        # connect, first chunk, failed second chunk
+        store = FailingStore(failed_writes={3})
+        disconnected = event("disconnected", 2 * SESSION_CHUNK_MS + HOUR_MS)
+        apply_event(store, event("connected", 0))
+        with self.assertRaises(ConnectionError):
+            apply_event(store, disconnected)
+        self.assertEqual(
+            DeviceState("connected", DAY_START + SESSION_CHUNK_MS),
+            store.states["frame"],
+        )
+        self.assertTrue(apply_event(store, disconnected))
+        self.assertEqual(
+            disconnected.timestamp_ms - DAY_START, self.device_uptime(store) * 1000
+        )
+        apply_fleet(store, ["frame"])
+        self.assertLessEqual(max(store.writes), TRANSACTION_ITEMS)
+        fleet = store.rollups[(FLEET_DEVICE, "day#2022-10-21")]
+        self.assertEqual({"uptime_s": 3600, "disconnects": 1}, fleet)
+
+
+def cancelled(*codes: str) -> ClientError:
+    return ClientError(
+        {
+            "Error": {"Code": "TransactionCanceledException"},
+            "CancellationReasons": [{"Code": code} for code in codes],
+        },
+        "TransactWriteItems",
+    )
+
+
+class DynamoRollupStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = load_handler("iot/presence_rollup")
+        self.client = MagicMock()
+        with patch.object(self.handler.boto3, "client", return_value=self.client):
+            self.store = self.handler.DynamoRollupStore("rollups")
+        self.state_class = self.handler.DeviceState
+
+    def apply(self):
+        return self.store.apply(
+            "frame",
+            self.state_class("connected", 1000),
+            self.state_class("disconnected", 2000),
+            {
+                "hour#2022-10-19T00": {"uptime_s": 1, "disconnects": 1},
+                "day#2022-10-19": {"uptime_s": 1, "disconnects": 1},
+            },
+        )
+
+    def test_state_and_counters_in_one_transaction(self):
+        self.assertTrue(self.apply())
+        (call,) = self.client.transact_write_items.call_args_list
+        state, queued, hour, day = call.kwargs["TransactItems"]
+        self.assertEqual("since_ms = :previous", state["Put"]["ConditionExpression"])
+        self.assertEqual("fleet#2000", queued["Put"]["Item"]["period"]["S"])
+        self.assertEqual(
+            {"uptime_s": 1, "disconnects": 1},
+            json.loads(queued["Put"]["Item"]["rollups"]["S"])["day#2022-10-19"],
+        )
+        self.assertIn("expires_at", hour["Update"]["UpdateExpression"])
+        self.assertEqual(
+            {"device": {"S": "frame"}, "period": {"S": "day#2022-10-19"}},
+            day["Update"]["Key"],
+        )
+        self.assertNotIn("expires_at", day["Update"]["UpdateExpression"])
+
+    def test_claimed_state_skips_event(self):
+        self.client.transact_write_items.side_effect = cancelled(
+            "ConditionalCheckFailed", "None", "None", "None"
+        )
+        self.assertFalse(self.apply())
+
+    def test_conflicts_raised_for_retry(self):
+        self.client.transact_write_items.side_effect = cancelled(
+            "None", "None", "TransactionConflict", "None"
+        )
+        with self.assertRaises(ClientError):
+            self.apply()
+
+    def apply_fleet(self):
+        self.store.apply_fleet(
+            {"a": [1000, 2000], "b": [1000]},
+            {"day#2022-10-19": {"connects": 3}},
+        )
+
+    def test_fleet_added_and_dequeued_together(self):
+        self.apply_fleet()
+        (call,) = self.client.transact_write_items.call_args_list
+        *deletes, fleet = call.kwargs["TransactItems"]
+        self.assertEqual(
+            [("a", "fleet#1000"), ("a", "fleet#2000"), ("b", "fleet#1000")],
+            [
+                (
+                    item["Delete"]["Key"]["device"]["S"],
+                    item["Delete"]["Key"]["period"]["S"],
+                )
+                for item in deletes
+            ],
+        )
+        self.assertEqual(
+            "attribute_exists(device)", deletes[0]["Delete"]["ConditionExpression"]
+        )
+        self.assertEqual(FLEET_DEVICE, fleet["Update"]["Key"]["device"]["S"])
+
+    @patch("time.sleep")
+    def test_fleet_conflicts_retried(self, sleep):
+        conflict = cancelled("None", "None", "None", "TransactionConflict")
+        self.client.transact_write_items.side_effect = [conflict, conflict, {}]
+        self.apply_fleet()
+        self.assertEqual(3, self.client.transact_write_items.call_count)
+
+        self.client.transact_write_items.reset_mock()
+        self.client.transact_write_items.side_effect = conflict
+        with self.assertRaises(ClientError):
+            self.apply_fleet()
+        self.assertEqual(
+            self.handler.FLEET_WRITE_ATTEMPTS,
+            self.client.transact_write_items.call_count,
+        )
+
+    def test_dequeued_entries_raised(self):
+        self.client.transact_write_items.side_effect = cancelled(
+            "ConditionalCheckFailed", "None", "None", "None"
+        )
+        with self.assertRaises(ClientError):
+            self.apply_fleet()
+        self.assertEqual(1, self.client.transact_write_items.call_count)
+
+    def test_queued_fleet(self):
+        self.client.get_paginator.return_value.paginate.return_value = [
+            {
+                "Items": [
+                    {
+                        "period": {"S": "fleet#2000"},
+                        "rollups": {"S": '{"day#2022-10-19": {"connects": 1}}'},
+                    }
+                ]
+            }
+        ]
+        self.assertEqual(
+            {2000: {"day#2022-10-19": {"connects": 1}}},
+            self.store.queued_fleet("frame"),
+        )
@@ -0,0 +1,111 @@
+import math
+import unittest
+
+from backend.simulation.fleet import (
+    FunctionConfig,
+    LatencyModel,
+    SimulationConfig,
+    percentile,
+    simulate,
+)
+
+
+def get_config(**kwargs) -> SimulationConfig:
+    defaults = {
+        "devices": 20,
+        "duration_s": 120,
+        "request_interval_s": 60,
+        "notify_interval_s": 60,
+        "seed": 7,
+    }
+    defaults.update(kwargs)
+    return SimulationConfig(**defaults)
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_request_accounting(self):
+        report = simulate(get_config())
+        self.assertEqual(
+            report.requests, report.succeeded + report.throttled + report.errors
+        )
+        self.assertEqual(report.s3_requests["GET"], report.succeeded)
+        self.assertGreater(report.throughput_rps, 0)
+        self.assertGreater(report.functions["Photo-handler"].gb_seconds, 0)
+
+    def test_list_pages_scale_with_images(self):
+        report = simulate(get_config(images=2500, album_index=False))
+        self.assertEqual(3 * report.s3_requests["GET"], report.s3_requests["LIST"])
+
+    def test_album_index_independent_of_images(self):
+        report = simulate(get_config(images=100_000))
+        self.assertEqual(0, report.s3_requests["LIST"])
+        self.assertEqual(report.s3_requests["GET"], report.dynamodb_requests["QUERY"])
+
+    def test_reserved_concurrency_throttles_herd(self):
+        report = simulate(
+            get_config(
+                notify=True,
+                devices=50,
+                image_handler=FunctionConfig("Photo-handler", reserved_concurrency=1),
+            )
+        )
+        self.assertGreater(report.throttled, 0)
+        self.assertLessEqual(report.functions["Photo-handler"].peak_concurrency, 1)
+
+    def test_stage_throttle(self):
+        report = simulate(
+            get_config(notify=True, devices=50, stage_rate_limit=1, stage_burst_limit=5)
+        )
+        self.assertGreater(report.throttled, 0)
+        self.assertEqual(0, report.functions["Photo-handler"].throttles)
+
+    def test_large_images_fail(self):
+        report = simulate(get_config(image_size_kb=LatencyModel(8 * 1024, 0)))
+        self.assertEqual(0, report.succeeded)
+        self.assertGreater(report.errors, 0)
+
+    def test_large_images_stream(self):
+        report = simulate(
+            get_config(streaming=True, image_size_kb=LatencyModel(8 * 1024, 0))
+        )
+        self.assertEqual(0, report.errors)
+        self.assertNotIn(
+            "API-Authorizer",
+            [name for name, f in report.functions.items() if f.invocations],
+        )
+
+    def test_seed_reproduces_results(self):
+        config = get_config(devices=200, notify=True)
+        self.assertEqual(simulate(config).as_dict(), simulate(config).as_dict())
+
+    def test_concurrency_follows_littles_law(self):
+        # without the authorizer cache, no requests queue up behind
+        # its first cold start
+        config = get_config(devices=500, duration_s=600, authorizer_cache_ttl_s=0)
+        report = simulate(config)
+        handler = report.functions["Photo-handler"]
+        # L = arrival rate x time in the function
+        arrival_rate = config.devices / config.request_interval_s
+        expected = arrival_rate * handler.mean_duration_ms / 1000
+        self.assertAlmostEqual(expected, handler.mean_concurrency, delta=0.1 * expected)
+        # the peak is reached while the first environments start, so
+        # bound it by the arrivals during a slow cold start
+        cold_start = config.image_handler.cold_start
+        cold_ms = cold_start.median_ms * math.exp(3 * cold_start.sigma)
+        peak = arrival_rate * (cold_ms + handler.mean_duration_ms) / 1000
+        self.assertLessEqual(handler.peak_concurrency, peak + 6 * math.sqrt(peak))
+        self.assertEqual(0, report.throttled)
+
+    def test_init_billed(self):
+        handler = FunctionConfig("Photo-handler", idle_timeout_s=0)
+        cold = simulate(get_config(image_handler=handler))
+        warm = simulate(get_config())
+        self.assertGreater(
+            cold.functions["Photo-handler"].gb_seconds,
+            warm.functions["Photo-handler"].gb_seconds,
+        )
+
+    def test_percentile(self):
+        self.assertEqual(0.0, percentile([], 50))
+        self.assertEqual(2, percentile([1, 2, 3, 4], 50))
+        self.assertEqual(4, percentile([1, 2, 3, 4], 99))
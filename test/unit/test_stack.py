@@ -1,16 +1,20 @@
 import json
 import os.path
+import tempfile
 import unittest
 from typing import Dict
 from unittest.mock import patch
 
 from aws_cdk import App
+from aws_cdk.assertions import Annotations
 
 
 from backend.component import Backend
+from backend.storage.infrastructure import truststore_key
 
 
-ENV_VARIABLES = {"test": "test"}
+# stack tests don't need a Python 3.9 interpreter
+ENV_VARIABLES = {"test": "test", "PHOTO_FRAME_NO_BYTECODE": "1"}
 
 
 def get_mock_context() -> Dict:
@@ -35,4 +39,422 @@ class AppTest(unittest.TestCase):
         buckets = [
             v for k, v in stack["Resources"].items() if v["Type"] == "AWS::S3::Bucket"
         ]
-        self.assertEqual(1, len(buckets))
\ No newline at end of file
+        self.assertEqual(1, len(buckets))
+
+    def test_rest_api_configured(self):
+        stack = json.loads(self.template)
+        types = [v["Type"] for v in stack["Resources"].values()]
+        self.assertIn("AWS::ApiGateway::RestApi", types)
+        self.assertIn("AWS::WAFv2::WebACLAssociation", types)
+        self.assertNotIn("AWS::ApiGatewayV2::Api", types)
+
+    def test_throttling_configured(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        (stage,) = [v for v in resources if v["Type"] == "AWS::ApiGateway::Stage"]
+        (method_settings,) = stage["Properties"]["MethodSettings"]
+        self.assertEqual(25, method_settings["ThrottlingRateLimit"])
+        self.assertEqual(50, method_settings["ThrottlingBurstLimit"])
+
+        (web_acl,) = [v for v in resources if v["Type"] == "AWS::WAFv2::WebACL"]
+        rate_rule = web_acl["Properties"]["Rules"][0]
+        statement = rate_rule["Statement"]["RateBasedStatement"]
+        self.assertEqual("IP", statement["AggregateKeyType"])
+        self.assertEqual(100, statement["Limit"])
+        self.assertEqual(
+            "/image",
+            statement["ScopeDownStatement"]["ByteMatchStatement"]["SearchString"],
+        )
+        self.assertEqual(
+            429, rate_rule["Action"]["Block"]["CustomResponse"]["ResponseCode"]
+        )
+
+        filters = [v for v in resources if v["Type"] == "AWS::Logs::MetricFilter"]
+        self.assertEqual(1, len(filters))
+
+    def test_ingest_configured(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        methods = sorted(
+            v["Properties"]["HttpMethod"]
+            for v in resources
+            if v["Type"] == "AWS::ApiGateway::Method"
+        )
+        self.assertEqual(["GET", "POST", "POST"], methods)
+        (bucket,) = [v for v in resources if v["Type"] == "AWS::S3::Bucket"]
+        (rule,) = bucket["Properties"]["LifecycleConfiguration"]["Rules"]
+        self.assertEqual("incoming/", rule["Prefix"])
+        (notifications,) = [
+            v for v in resources if v["Type"] == "Custom::S3BucketNotifications"
+        ]
+        (config,) = [
+            config
+            for config in notifications["Properties"]["NotificationConfiguration"][
+                "LambdaFunctionConfigurations"
+            ]
+            if config["Filter"]["Key"]["FilterRules"]
+            == [{"Name": "prefix", "Value": "incoming/"}]
+        ]
+        self.assertEqual(["s3:ObjectCreated:*"], config["Events"])
+
+    def test_album_index_configured(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        (table,) = [
+            r
+            for r in resources
+            if r["Type"] == "AWS::DynamoDB::Table"
+            and "LocalSecondaryIndexes" in r["Properties"]
+        ]
+        self.assertEqual(
+            "ByShuffle", table["Properties"]["LocalSecondaryIndexes"][0]["IndexName"]
+        )
+        (notifications,) = [
+            r for r in resources if r["Type"] == "Custom::S3BucketNotifications"
+        ]
+        events = [
+            (
+                config["Events"][0],
+                config["Filter"]["Key"]["FilterRules"][0]["Value"],
+            )
+            for config in notifications["Properties"]["NotificationConfiguration"][
+                "LambdaFunctionConfigurations"
+            ]
+        ]
+        for event in ("s3:ObjectCreated:*", "s3:ObjectRemoved:*", "s3:ObjectTagging:*"):
+            self.assertIn((event, "public/"), events)
+        (handler,) = [
+            r
+            for r in resources
+            if r["Type"] == "AWS::Lambda::Function"
+            and r["Properties"].get("FunctionName") == "Photo-handler"
+        ]
+        variables = handler["Properties"]["Environment"]["Variables"]
+        self.assertEqual('["all"]', variables["DEFAULT_ALBUMS"])
+
+    def test_album_index_rebuilt_on_deploy(self):
+        stack = json.loads(self.template)
+        (rebuild,) = [
+            r for r in stack["Resources"].values() if r["Type"] == "Custom::AWS"
+        ]
+        call = json.loads(
+            "".join(
+                part if isinstance(part, str) else "indexer"
+                for part in rebuild["Properties"]["Create"]["Fn::Join"][1]
+            )
+        )
+        self.assertEqual("Event", call["parameters"]["InvocationType"])
+        self.assertTrue(json.loads(call["parameters"]["Payload"])["rebuild"])
+        self.assertIn("Update", rebuild["Properties"])
+
+    def test_presence_history_configured(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        (history,) = [
+            r
+            for r in resources
+            if r["Type"] == "AWS::DynamoDB::Table"
+            and "StreamSpecification" in r["Properties"]
+        ]
+        self.assertEqual(
+            "expires_at",
+            history["Properties"]["TimeToLiveSpecification"]["AttributeName"],
+        )
+        # the stream orders a device's events only if they share a key
+        self.assertEqual(
+            [
+                {"AttributeName": "device_name", "KeyType": "HASH"},
+                {"AttributeName": "timestamp", "KeyType": "RANGE"},
+            ],
+            history["Properties"]["KeySchema"],
+        )
+        rules = [
+            r["Properties"]["TopicRulePayload"]
+            for r in resources
+            if r["Type"] == "AWS::IoT::TopicRule"
+        ]
+        self.assertEqual(2, len(rules))
+        self.assertIn(
+            "${topic(5)}",
+            [
+                action["DynamoDB"]["HashKeyValue"]
+                for rule in rules
+                for action in rule["Actions"]
+                if "DynamoDB" in action
+            ],
+        )
+        (mapping,) = [
+            r for r in resources if r["Type"] == "AWS::Lambda::EventSourceMapping"
+        ]
+        self.assertIn(
+            "Destination",
+            mapping["Properties"]["DestinationConfig"]["OnFailure"],
+        )
+
+    def test_functions_use_shared_layer(self):
+        stack = json.loads(self.template)
+        layers = [
+            k
+            for k, v in stack["Resources"].items()
+            if v["Type"] == "AWS::Lambda::LayerVersion"
+            and v["Properties"].get("LayerName") == "photo-frame-shared"
+        ]
+        self.assertEqual(1, len(layers))
+        functions = [
+            v["Properties"]
+            for v in stack["Resources"].values()
+            if v["Type"] == "AWS::Lambda::Function"
+            and "FunctionName" in v["Properties"]
+        ]
+        self.assertTrue(functions)
+        for function in functions:
+            self.assertEqual([{"Ref": layers[0]}], function["Layers"])
+
+
+class HttpApiTest(unittest.TestCase):
+    @classmethod
+    @patch.dict(os.environ, ENV_VARIABLES)
+    def setUpClass(
+        cls,
+    ):
+        context = get_mock_context()
+        context["prod"]["api_mode"] = "http"
+        app = App(context=context)
+        Backend(app, "PhotoFrameService")
+        stack = app.synth().get_stack_by_name("PhotoFrameService")
+
+        cls.template = json.dumps(stack.template)
+
+    def get_resources(self, type_: str):
+        stack = json.loads(self.template)
+        return [v for v in stack["Resources"].values() if v["Type"] == type_]
+
+    def test_web_acl_region_checked(self):
+        stack = json.loads(self.template)
+        (rule,) = [v for k, v in stack["Rules"].items() if "WebAclRegionRule" in k]
+        self.assertEqual(
+            {"Fn::Equals": [{"Ref": "AWS::Region"}, "us-east-1"]},
+            rule["Assertions"][0]["Assert"],
+        )
+
+    @patch.dict(os.environ, ENV_VARIABLES)
+    def test_web_acl_outside_us_east_1_fails(self):
+        context = get_mock_context()
+        context["prod"]["api_mode"] = "http"
+        app = App(context=context)
+        stack = Backend(
+            app,
+            "PhotoFrameService",
+            env={"account": "123456789012", "region": "eu-west-1"},
+        )
+        Annotations.from_stack(stack).has_error(
+            "*", "CLOUDFRONT scoped web ACLs must be deployed in us-east-1"
+        )
+
+    def test_http_api_configured(self):
+        self.assertEqual(1, len(self.get_resources("AWS::ApiGatewayV2::Api")))
+        self.assertEqual([], self.get_resources("AWS::ApiGateway::RestApi"))
+        authorizers = self.get_resources("AWS::ApiGatewayV2::Authorizer")
+        self.assertEqual(2, len(authorizers))
+        for authorizer in authorizers:
+            properties = authorizer["Properties"]
+            self.assertTrue(properties["EnableSimpleResponses"])
+            self.assertEqual("2.0", properties["AuthorizerPayloadFormatVersion"])
+            self.assertEqual(300, properties["AuthorizerResultTtlInSeconds"])
+        routes = sorted(
+            r["Properties"]["RouteKey"]
+            for r in self.get_resources("AWS::ApiGatewayV2::Route")
+        )
+        self.assertEqual(
+            ["GET /image", "POST /ingest", "POST /ingest/{batch_id}/complete"], routes
+        )
+
+    def test_waf_on_front_door(self):
+        (web_acl,) = self.get_resources("AWS::WAFv2::WebACL")
+        self.assertEqual("CLOUDFRONT", web_acl["Properties"]["Scope"])
+        self.assertEqual([], self.get_resources("AWS::WAFv2::WebACLAssociation"))
+        (distribution,) = self.get_resources("AWS::CloudFront::Distribution")
+        self.assertIn("WebACLId", distribution["Properties"]["DistributionConfig"])
+
+    def test_device_id_forwarded(self):
+        (policy,) = self.get_resources("AWS::CloudFront::OriginRequestPolicy")
+        headers = policy["Properties"]["OriginRequestPolicyConfig"]["HeadersConfig"]
+        self.assertEqual("whitelist", headers["HeaderBehavior"])
+        self.assertEqual(
+            ["x-api-token", "x-device-id", "x-ingest-token"], sorted(headers["Headers"])
+        )
+
+    def test_origin_verified(self):
+        (distribution,) = self.get_resources("AWS::CloudFront::Distribution")
+        (origin,) = distribution["Properties"]["DistributionConfig"]["Origins"]
+        self.assertEqual(
+            ["x-origin-verify"],
+            [header["HeaderName"] for header in origin["OriginCustomHeaders"]],
+        )
+        for authorizer in self.get_resources("AWS::ApiGatewayV2::Authorizer"):
+            self.assertIn(
+                "$request.header.x-origin-verify",
+                authorizer["Properties"]["IdentitySource"],
+            )
+
+
+class StreamingTest(unittest.TestCase):
+    @classmethod
+    @patch.dict(os.environ, ENV_VARIABLES)
+    def setUpClass(
+        cls,
+    ):
+        context = get_mock_context()
+        context["prod"]["streaming"] = True
+        app = App(context=context)
+        Backend(app, "PhotoFrameService")
+        stack = app.synth().get_stack_by_name("PhotoFrameService")
+
+        cls.template = json.dumps(stack.template)
+
+    def test_function_url_streams(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        (url,) = [r for r in resources if r["Type"] == "AWS::Lambda::Url"]
+        self.assertEqual("RESPONSE_STREAM", url["Properties"]["InvokeMode"])
+        (handler,) = [
+            r
+            for r in resources
+            if r["Type"] == "AWS::Lambda::Function"
+            and r["Properties"].get("FunctionName") == "Photo-stream-handler"
+        ]
+        self.assertEqual("run.sh", handler["Properties"]["Handler"])
+        variables = handler["Properties"]["Environment"]["Variables"]
+        self.assertEqual("response_stream", variables["AWS_LWA_INVOKE_MODE"])
+
+    def test_function_url_behind_web_acl(self):
+        stack = json.loads(self.template)
+        resources = stack["Resources"].values()
+        (url,) = [r for r in resources if r["Type"] == "AWS::Lambda::Url"]
+        self.assertEqual("AWS_IAM", url["Properties"]["AuthType"])
+        permissions = [
+            r["Properties"]
+            for r in resources
+            if r["Type"] == "AWS::Lambda::Permission"
+            and r["Properties"].get("Principal") == "cloudfront.amazonaws.com"
+        ]
+        self.assertEqual(
+            ["lambda:InvokeFunction", "lambda:InvokeFunctionUrl"],
+            sorted(p["Action"] for p in permissions),
+        )
+        self.assertFalse(
+            [r for r in resources if r["Properties"].get("Principal") == "*"]
+        )
+
+        (distribution,) = [
+            r for r in resources if r["Type"] == "AWS::CloudFront::Distribution"
+        ]
+        config = distribution["Properties"]["DistributionConfig"]
+        self.assertIn("OriginAccessControlId", config["Origins"][0])
+        acls = {
+            key: r["Properties"]
+            for key, r in stack["Resources"].items()
+            if r["Type"] == "AWS::WAFv2::WebACL"
+        }
+        (stream_acl,) = [
+            key for key, acl in acls.items() if acl["Scope"] == "CLOUDFRONT"
+        ]
+        self.assertEqual({"Fn::GetAtt": [stream_acl, "Arn"]}, config["WebACLId"])
+        self.assertEqual("DeviceRateLimit", acls[stream_acl]["Rules"][0]["Name"])
+
+    @patch.dict(os.environ, ENV_VARIABLES)
+    def test_mtls_only_rejected(self):
+        truststore_dir = tempfile.mkdtemp()
+        with open(os.path.join(truststore_dir, "device-ca.pem"), "w") as f:
+            f.write("-----BEGIN CERTIFICATE-----\n")
+        context = get_mock_context()
+        context["prod"].update(
+            {
+                "streaming": True,
+                "domain_name": "frames.example.com",
+                "certificate_arn": (
+                    "arn:aws:acm:us-east-1:123456789012:certificate/example"
+                ),
+                "mtls_token_fallback": False,
+                "truststore_dir": truststore_dir,
+            }
+        )
+        with self.assertRaisesRegex(ValueError, "token fallback"):
+            Backend(App(context=context), "PhotoFrameService")
+
+
+class MutualTlsTest(unittest.TestCase):
+    @classmethod
+    @patch.dict(os.environ, ENV_VARIABLES)
+    def setUpClass(
+        cls,
+    ):
+        truststore_dir = tempfile.mkdtemp()
+        with open(os.path.join(truststore_dir, "device-ca.pem"), "w") as f:
+            f.write("-----BEGIN CERTIFICATE-----\n")
+
+        context = get_mock_context()
+        context["prod"].update(
+            {
+                "domain_name": "frames.example.com",
+                "certificate_arn": (
+                    "arn:aws:acm:us-east-1:123456789012:certificate/example"
+                ),
+                "mtls_token_fallback": False,
+                "truststore_dir": truststore_dir,
+            }
+        )
+        app = App(context=context)
+        Backend(app, "PhotoFrameService")
+        stack = app.synth().get_stack_by_name("PhotoFrameService")
+
+        cls.template = json.dumps(stack.template)
+        cls.truststore_dir = truststore_dir
+
+    def get_resources(self, type_: str):
+        stack = json.loads(self.template)
+        return [v for v in stack["Resources"].values() if v["Type"] == type_]
+
+    def test_domain_requires_client_certificates(self):
+        (domain,) = self.get_resources("AWS::ApiGateway::DomainName")
+        truststore = domain["Properties"]["MutualTlsAuthentication"]
+        self.assertEqual("s3://", truststore["TruststoreUri"]["Fn::Join"][1][0])
+        self.assertEqual(
+            f"/{truststore_key(self.truststore_dir)}",
+            truststore["TruststoreUri"]["Fn::Join"][1][2],
+        )
+
+    def test_truststore_key_follows_content(self):
+        first = truststore_key(self.truststore_dir)
+        other_dir = tempfile.mkdtemp()
+        with open(os.path.join(other_dir, "device-ca.pem"), "w") as f:
+            f.write("-----BEGIN CERTIFICATE-----\nrotated\n")
+        self.assertNotEqual(first, truststore_key(other_dir))
+        self.assertTrue(first.endswith("/device-ca.pem"))
+        with self.assertRaises(ValueError):
+            truststore_key(tempfile.mkdtemp())
+
+    def test_image_route_without_authorizer(self):
+        apis = self.get_resources("AWS::ApiGateway::RestApi")
+        self.assertEqual(2, len(apis))
+        self.assertEqual(
+            [True],
+            [
+                api["Properties"]["DisableExecuteApiEndpoint"]
+                for api in apis
+                if "DisableExecuteApiEndpoint" in api["Properties"]
+            ],
+        )
+        (image_method,) = [
+            method
+            for method in self.get_resources("AWS::ApiGateway::Method")
+            if method["Properties"]["HttpMethod"] == "GET"
+        ]
+        self.assertEqual("NONE", image_method["Properties"]["AuthorizationType"])
+        self.assertEqual(2, len(self.get_resources("AWS::WAFv2::WebACLAssociation")))
+
+    def test_rate_limit_counts_certificate_requests(self):
+        (web_acl,) = self.get_resources("AWS::WAFv2::WebACL")
+        statement = web_acl["Properties"]["Rules"][0]["Statement"]
+        # certificate authenticated frames send no token header
+        self.assertEqual("IP", statement["RateBasedStatement"]["AggregateKeyType"])
@@ -0,0 +1,117 @@
+import http.client
+import io
+import os
+import threading
+import unittest
+from http.server import HTTPServer
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from test.unit.handlers import load_handler
+
+stream_server = load_handler("api/image_handler", "stream_server")
+
+ENV_VARIABLES = {
+    "API_TOKEN_NAME": "api-token",
+    "S3_BUCKET_NAME": "bucket",
+    "ALBUM_TABLE_NAME": "albums",
+    "DEVICE_ALBUMS": "{}",
+    "DEFAULT_ALBUMS": '["all"]',
+}
+
+
+def secrets_client(*tokens):
+    client = MagicMock()
+    client.get_secret_value.side_effect = [{"SecretString": t} for t in tokens]
+    return client
+
+
+@patch.dict(os.environ, ENV_VARIABLES)
+class ApiTokenTest(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(stream_server._secret, {"value": None, "fetched": 0.0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fetched_on_fresh_microvm(self):
+        client = secrets_client("token")
+        # monotonic clocks start near zero after boot
+        with patch.object(stream_server.boto3, "client", return_value=client), patch(
+            "time.monotonic", return_value=1.0
+        ):
+            self.assertEqual("token", stream_server.get_api_token())
+
+    def test_cached_then_refreshed(self):
+        client = secrets_client("old", "new")
+        with patch.object(stream_server.boto3, "client", return_value=client), patch(
+            "time.monotonic"
+        ) as monotonic:
+            monotonic.return_value = 1000.0
+            self.assertEqual("old", stream_server.get_api_token())
+            monotonic.return_value = 1000.0 + stream_server.SECRET_CACHE_SECONDS
+            self.assertEqual("old", stream_server.get_api_token())
+            monotonic.return_value = 1001.0 + stream_server.SECRET_CACHE_SECONDS
+            self.assertEqual("new", stream_server.get_api_token())
+        self.assertEqual(2, client.get_secret_value.call_count)
+
+
+@patch.dict(os.environ, ENV_VARIABLES)
+@patch.object(stream_server, "get_api_token", return_value="token")
+@patch.object(stream_server, "pick_image")
+@patch.object(stream_server, "s3_client")
+class ImageRequestHandlerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), stream_server.ImageRequestHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get(self, path, headers=None):
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        try:
+            connection.request("GET", path, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def test_streams_image(self, s3_client, pick_image, get_api_token):
+        data = b"\xff\xd8" + bytes(200000)
+        pick_image.return_value = {"key": "public/a.jpg", "size": len(data)}
+        s3_client.get_object.return_value = {
+            "Body": io.BytesIO(data),
+            "ContentLength": len(data),
+        }
+        status, body = self.get("/image", {"x-api-token": "token"})
+        self.assertEqual((200, data), (status, body))
+        pick_image.assert_called_once_with("albums", ["all"])
+
+    def test_readiness(self, s3_client, pick_image, get_api_token):
+        self.assertEqual(200, self.get("/ping")[0])
+        get_api_token.assert_not_called()
+
+    def test_unknown_path(self, s3_client, pick_image, get_api_token):
+        self.assertEqual(404, self.get("/other", {"x-api-token": "token"})[0])
+
+    def test_rejects_bad_tokens(self, s3_client, pick_image, get_api_token):
+        for headers in ({}, {"x-api-token": "wrong"}, {"x-api-token": "tökén"}):
+            with self.subTest(headers=headers):
+                self.assertEqual(401, self.get("/image", headers)[0])
+        pick_image.assert_not_called()
+
+    def test_retries_removed_images(self, s3_client, pick_image, get_api_token):
+        pick_image.return_value = {"key": "public/a.jpg", "size": 1}
+        s3_client.get_object.side_effect = [
+            ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject"),
+            {"Body": io.BytesIO(b"x"), "ContentLength": 1},
+        ]
+        self.assertEqual((200, b"x"), self.get("/image", {"x-api-token": "token"}))
+
+    def test_empty_albums(self, s3_client, pick_image, get_api_token):
+        pick_image.side_effect = FileNotFoundError()
+        self.assertEqual(404, self.get("/image", {"x-api-token": "token"})[0])
@@ -0,0 +1,31 @@
+import io
+import tracemalloc
+import unittest
+
+from backend.api.image_handler.streaming import copy_stream
+
+
+class StreamingTest(unittest.TestCase):
+    def test_copies_in_chunks(self):
+        data = bytes(range(256)) * 1000
+        chunks = []
+        copied = copy_stream(io.BytesIO(data), chunks.append, chunk_size=4096)
+        self.assertEqual(len(data), copied)
+        self.assertEqual(data, b"".join(chunks))
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+
+    def test_memory_independent_of_size(self):
+        class Body:
+            def __init__(self, size):
+                self.remaining = size
+
+            def read(self, amt):
+                amt = min(amt, self.remaining)
+                self.remaining -= amt
+                return b"\0" * amt
+
+        tracemalloc.start()
+        copy_stream(Body(32 * 1024 * 1024), lambda chunk: None)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertLess(peak, 1024 * 1024)